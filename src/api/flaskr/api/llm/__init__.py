@@ -1,4 +1,5 @@
-from typing import Generator
+import asyncio
+from typing import AsyncGenerator, Generator
 from .ernie import get_ernie_response, get_erine_models, chat_ernie
 from .glm import get_zhipu_models, invoke_glm
 import openai
@@ -10,6 +11,15 @@ from openai.types.chat import ChatCompletionStreamOptionsParam
 from openai.types.shared_params import ResponseFormatJSONObject
 from flask import current_app
 from .dify import DifyChunkChatCompletionResponse, dify_chat_message
+from .accounting import StreamAccounting, truncate_log
+from .aio import aiter_sync, iter_async
+from .response_cache import (
+    get_cached_response,
+    get_policy_ttl,
+    make_key as make_response_cache_key,
+    set_cached_response,
+)
+from .router import get_router
 from flaskr.common.config import get_config
 from flaskr.service.common.models import raise_error_with_args
 from ..ark.sign import request
@@ -223,6 +233,76 @@ class LLMStreamResponse:
         self.usage = LLMStreamaUsage(**usage) if usage else None
 
 
+# characters per chunk when a cached response is replayed as a stream
+_REPLAY_CHUNK_SIZE = 20
+
+
+def _lookup_response_cache(
+    app: Flask, model: str, generation_name: str, messages: list, json, kwargs
+) -> tuple:
+    """
+    Returns:
+        (cache key, ttl, cached text), the key is None if the generation is not cached
+    """
+    ttl = get_policy_ttl(generation_name)
+    if not ttl:
+        return None, 0, None
+    key = make_response_cache_key(model, messages, json, kwargs)
+    return key, ttl, get_cached_response(app, key)
+
+
+async def _alookup_response_cache(
+    app: Flask, model: str, generation_name: str, messages: list, json, kwargs
+) -> tuple:
+    """
+    _lookup_response_cache for the LLM event loop, the Redis or disk read runs
+    in the default executor so a slow cache does not stall the other streams
+    """
+    if not get_policy_ttl(generation_name):
+        return None, 0, None
+    return await asyncio.get_running_loop().run_in_executor(
+        None,
+        _lookup_response_cache,
+        app,
+        model,
+        generation_name,
+        messages,
+        json,
+        kwargs,
+    )
+
+
+async def _aset_cached_response(app: Flask, key: str, text: str, ttl: int) -> None:
+    await asyncio.get_running_loop().run_in_executor(
+        None, set_cached_response, app, key, text, ttl
+    )
+
+
+def _replay_cached_response(
+    app: Flask,
+    span: StatefulSpanClient,
+    model: str,
+    generation_name: str,
+    generation_input: list,
+    key: str,
+    text: str,
+    kwargs: dict,
+) -> Generator[LLMStreamResponse, None, None]:
+    app.logger.info(f"invoke_llm [{model}] response cache hit: {key}")
+    accounting = StreamAccounting(app, span, model, generation_name, generation_input)
+    chunks = [
+        text[i : i + _REPLAY_CHUNK_SIZE]
+        for i in range(0, len(text), _REPLAY_CHUNK_SIZE)
+    ]
+    for i, chunk in enumerate(chunks):
+        is_end = i == len(chunks) - 1
+        yield LLMStreamResponse(
+            "cache-" + key[:16], is_end, False, chunk, "stop" if is_end else None, None
+        )
+        accounting.add(chunk)
+    accounting.finish(metadata={**kwargs, "response_cache": "hit"})
+
+
 def get_openai_client_and_model(model: str):
     client = None
     if (
@@ -300,8 +380,25 @@ def invoke_llm(
     generation_name: str = "invoke_llm",
     **kwargs,
 ) -> Generator[LLMStreamResponse, None, None]:
+    client, _ = get_openai_client_and_model(model.strip())
+    if client:
+        # OpenAI compatible providers stream over the shared async client
+        yield from iter_async(
+            ainvoke_llm(
+                app,
+                user_id,
+                span,
+                model,
+                message,
+                system=system,
+                json=json,
+                generation_name=generation_name,
+                **kwargs,
+            )
+        )
+        return
     app.logger.info(
-        f"invoke_llm [{model}] {message} ,system:{system} ,json:{json} ,kwargs:{kwargs}"
+        f"invoke_llm [{model}] {truncate_log(message)} ,system:{truncate_log(system)} ,json:{json} ,kwargs:{kwargs}"
     )
     kwargs.update({"stream": True})
     model = model.strip()
@@ -309,47 +406,25 @@ def invoke_llm(
     if system:
         generation_input.append({"role": "system", "content": system})
     generation_input.append({"role": "user", "content": message})
-    generation = span.generation(
-        model=model, input=generation_input, name=generation_name
+    cache_key, cache_ttl, cached_text = _lookup_response_cache(
+        app, model, generation_name, generation_input, json, kwargs
     )
-    response_text = ""
-    usage = None
-    client, invoke_model = get_openai_client_and_model(model)
-    start_completion_time = None
-    if client:
-        messages = []
-        if system:
-            messages.append({"content": system, "role": "system"})
-        messages.append({"content": message, "role": "user"})
-        if json:
-            kwargs["response_format"] = ResponseFormatJSONObject(type="json_object")
-        kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
-        kwargs["stream_options"] = ChatCompletionStreamOptionsParam(include_usage=True)
-        response = client.chat.completions.create(
-            model=invoke_model, messages=messages, **kwargs
-        )
-
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            if len(res.choices) and res.choices[0].delta.content:
-                response_text += res.choices[0].delta.content
-                yield LLMStreamResponse(
-                    res.id,
-                    True if res.choices[0].finish_reason else False,
-                    False,
-                    res.choices[0].delta.content,
-                    res.choices[0].finish_reason,
-                    None,
-                )
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-    elif model in ERNIE_MODELS:
+    if cached_text is not None:
+        for res in _replay_cached_response(
+            app,
+            span,
+            model,
+            generation_name,
+            generation_input,
+            cache_key,
+            cached_text,
+            kwargs,
+        ):
+            yield res
+        span.update(output=cached_text)
+        return
+    accounting = StreamAccounting(app, span, model, generation_name, generation_input)
+    if model in ERNIE_MODELS:
         if not ernie_enabled:
             raise_error_with_args(
                 "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
@@ -364,11 +439,9 @@ def invoke_llm(
             kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
         response = get_ernie_response(app, model, message, **kwargs)
         for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.result
+            accounting.add(res.result)
             if res.usage:
-                usage = ModelUsage(
+                accounting.usage = ModelUsage(
                     unit="TOKENS",
                     input=res.usage.prompt_tokens,
                     output=res.usage.completion_tokens,
@@ -397,11 +470,9 @@ def invoke_llm(
         messages.append({"content": message, "role": "user"})
         response = invoke_glm(app, model.lower(), messages, **kwargs)
         for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.result
+            accounting.add(res.result)
             if res.usage:
-                usage = ModelUsage(
+                accounting.usage = ModelUsage(
                     unit="TOKENS",
                     input=res.usage.prompt_tokens,
                     output=res.usage.completion_tokens,
@@ -418,10 +489,8 @@ def invoke_llm(
     elif model in DIFY_MODELS:
         response = dify_chat_message(app, message, user_id)
         for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
             if res.event == "message":
-                response_text += res.answer
+                accounting.add(res.answer)
                 yield LLMStreamResponse(
                     res.task_id,
                     True if res.event == "message" else False,
@@ -436,16 +505,9 @@ def invoke_llm(
             model=model,
         )
 
-    app.logger.info(f"invoke_llm response: {response_text} ")
-    app.logger.info(f"invoke_llm usage: {usage.__str__()}")
-    generation.end(
-        input=generation_input,
-        output=response_text,
-        usage=usage,
-        metadata=kwargs,
-        completion_start_time=start_completion_time,
-    )
-    span.update(output=response_text)
+    response_text = accounting.finish(metadata=kwargs, update_span=True)
+    if cache_key and response_text:
+        set_cached_response(app, cache_key, response_text, cache_ttl)
 
 
 def chat_llm(
@@ -458,44 +520,48 @@ def chat_llm(
     generation_name: str = "user_follow_ask",
     **kwargs,
 ) -> Generator[LLMStreamResponse, None, None]:
-    app.logger.info(f"chat_llm [{model}] {messages} ,json:{json} ,kwargs:{kwargs}")
+    client, _ = get_openai_client_and_model(model.strip())
+    if client:
+        # OpenAI compatible providers stream over the shared async client
+        yield from iter_async(
+            achat_llm(
+                app,
+                user_id,
+                span,
+                model,
+                messages,
+                json=json,
+                generation_name=generation_name,
+                **kwargs,
+            )
+        )
+        return
+    app.logger.info(
+        f"chat_llm [{model}] {truncate_log(messages)} ,json:{json} ,kwargs:{kwargs}"
+    )
     kwargs.update({"stream": True})
     model = model.strip()
     generation_input = messages
-    generation = span.generation(
-        model=model, input=generation_input, name=generation_name
+    cache_key, cache_ttl, cached_text = _lookup_response_cache(
+        app, model, generation_name, generation_input, json, kwargs
     )
-    response_text = ""
-    usage = None
-    start_completion_time = None
+    if cached_text is not None:
+        for res in _replay_cached_response(
+            app,
+            span,
+            model,
+            generation_name,
+            generation_input,
+            cache_key,
+            cached_text,
+            kwargs,
+        ):
+            yield res
+        return
+    accounting = StreamAccounting(app, span, model, generation_name, generation_input)
     if kwargs.get("temperature", None) is not None:
         kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
-    client, invoke_model = get_openai_client_and_model(model)
-    if client:
-        response = client.chat.completions.create(
-            model=invoke_model, messages=messages, **kwargs
-        )
-        for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            if len(res.choices) and res.choices[0].delta.content:
-                response_text += res.choices[0].delta.content
-                yield LLMStreamResponse(
-                    res.id,
-                    True if res.choices[0].finish_reason else False,
-                    False,
-                    res.choices[0].delta.content,
-                    res.choices[0].finish_reason,
-                    None,
-                )
-            if res.usage:
-                usage = ModelUsage(
-                    unit="TOKENS",
-                    input=res.usage.prompt_tokens,
-                    output=res.usage.completion_tokens,
-                    total=res.usage.total_tokens,
-                )
-    elif model in ERNIE_MODELS:
+    if model in ERNIE_MODELS:
         if not ernie_enabled:
             raise_error_with_args(
                 "LLM.SPECIFIED_LLM_NOT_CONFIGURED",
@@ -506,11 +572,9 @@ def chat_llm(
             kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
         response = chat_ernie(app, model, messages, **kwargs)
         for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.result
+            accounting.add(res.result)
             if res.usage:
-                usage = ModelUsage(
+                accounting.usage = ModelUsage(
                     unit="TOKENS",
                     input=res.usage.prompt_tokens,
                     output=res.usage.completion_tokens,
@@ -535,11 +599,9 @@ def chat_llm(
             kwargs["temperature"] = str(kwargs["temperature"])
         response = invoke_glm(app, model.lower(), messages, **kwargs)
         for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
-            response_text += res.choices[0].delta.content
+            accounting.add(res.choices[0].delta.content)
             if res.usage:
-                usage = ModelUsage(
+                accounting.usage = ModelUsage(
                     unit="TOKENS",
                     input=res.usage.prompt_tokens,
                     output=res.usage.completion_tokens,
@@ -558,10 +620,8 @@ def chat_llm(
             dify_chat_message(app, messages[-1]["content"], user_id)
         )
         for res in response:
-            if start_completion_time is None:
-                start_completion_time = datetime.now()
             if res.event == "message":
-                response_text += res.answer
+                accounting.add(res.answer)
                 yield LLMStreamResponse(
                     res.task_id,
                     True if res.event == "message" else False,
@@ -576,15 +636,183 @@ def chat_llm(
             model=model,
         )
 
-    app.logger.info(f"invoke_llm response: {response_text} ")
-    app.logger.info(f"invoke_llm usage: {usage.__str__()}")
-    generation.end(
-        input=generation_input,
-        output=response_text,
-        usage=usage,
-        metadata=kwargs,
-        completion_start_time=start_completion_time,
+    response_text = accounting.finish(metadata=kwargs)
+    if cache_key and response_text:
+        set_cached_response(app, cache_key, response_text, cache_ttl)
+
+
+async def ainvoke_llm(
+    app: Flask,
+    user_id: str,
+    span: StatefulSpanClient,
+    model: str,
+    message: str,
+    system: str = None,
+    json: bool = False,
+    generation_name: str = "invoke_llm",
+    **kwargs,
+) -> AsyncGenerator[LLMStreamResponse, None]:
+    """
+    Async version of invoke_llm, must run on the LLM event loop.
+    Providers without an OpenAI compatible API run their sync SDK in the
+    default executor.
+    """
+    client, _ = get_openai_client_and_model(model.strip())
+    if not client:
+        async for res in aiter_sync(
+            invoke_llm(
+                app,
+                user_id,
+                span,
+                model,
+                message,
+                system=system,
+                json=json,
+                generation_name=generation_name,
+                **kwargs,
+            )
+        ):
+            yield res
+        return
+    app.logger.info(
+        f"invoke_llm [{model}] {truncate_log(message)} ,system:{truncate_log(system)} ,json:{json} ,kwargs:{kwargs}"
+    )
+    kwargs.update({"stream": True})
+    model = model.strip()
+    generation_input = []
+    if system:
+        generation_input.append({"role": "system", "content": system})
+    generation_input.append({"role": "user", "content": message})
+    cache_key, cache_ttl, cached_text = await _alookup_response_cache(
+        app, model, generation_name, generation_input, json, kwargs
     )
+    if cached_text is not None:
+        for res in _replay_cached_response(
+            app,
+            span,
+            model,
+            generation_name,
+            generation_input,
+            cache_key,
+            cached_text,
+            kwargs,
+        ):
+            yield res
+        span.update(output=cached_text)
+        return
+    accounting = StreamAccounting(app, span, model, generation_name, generation_input)
+    messages = []
+    if system:
+        messages.append({"content": system, "role": "system"})
+    messages.append({"content": message, "role": "user"})
+    if json:
+        kwargs["response_format"] = ResponseFormatJSONObject(type="json_object")
+    kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
+    kwargs["stream_options"] = ChatCompletionStreamOptionsParam(include_usage=True)
+    async for res in get_router().astream(
+        model, messages, on_model=accounting.set_served_model, **kwargs
+    ):
+        if len(res.choices) and res.choices[0].delta.content:
+            accounting.add(res.choices[0].delta.content)
+            yield LLMStreamResponse(
+                res.id,
+                True if res.choices[0].finish_reason else False,
+                False,
+                res.choices[0].delta.content,
+                res.choices[0].finish_reason,
+                None,
+            )
+        if res.usage:
+            accounting.usage = ModelUsage(
+                unit="TOKENS",
+                input=res.usage.prompt_tokens,
+                output=res.usage.completion_tokens,
+                total=res.usage.total_tokens,
+            )
+
+    response_text = accounting.finish(metadata=kwargs, update_span=True)
+    if cache_key and response_text:
+        await _aset_cached_response(app, cache_key, response_text, cache_ttl)
+
+
+async def achat_llm(
+    app: Flask,
+    user_id: str,
+    span: StatefulSpanClient,
+    model: str,
+    messages: list,
+    json: bool = False,
+    generation_name: str = "user_follow_ask",
+    **kwargs,
+) -> AsyncGenerator[LLMStreamResponse, None]:
+    """
+    Async version of chat_llm, must run on the LLM event loop
+    """
+    client, _ = get_openai_client_and_model(model.strip())
+    if not client:
+        async for res in aiter_sync(
+            chat_llm(
+                app,
+                user_id,
+                span,
+                model,
+                messages,
+                json=json,
+                generation_name=generation_name,
+                **kwargs,
+            )
+        ):
+            yield res
+        return
+    app.logger.info(
+        f"chat_llm [{model}] {truncate_log(messages)} ,json:{json} ,kwargs:{kwargs}"
+    )
+    kwargs.update({"stream": True})
+    model = model.strip()
+    generation_input = messages
+    cache_key, cache_ttl, cached_text = await _alookup_response_cache(
+        app, model, generation_name, generation_input, json, kwargs
+    )
+    if cached_text is not None:
+        for res in _replay_cached_response(
+            app,
+            span,
+            model,
+            generation_name,
+            generation_input,
+            cache_key,
+            cached_text,
+            kwargs,
+        ):
+            yield res
+        return
+    accounting = StreamAccounting(app, span, model, generation_name, generation_input)
+    if kwargs.get("temperature", None) is not None:
+        kwargs["temperature"] = float(kwargs.get("temperature", 0.8))
+    async for res in get_router().astream(
+        model, messages, on_model=accounting.set_served_model, **kwargs
+    ):
+        if len(res.choices) and res.choices[0].delta.content:
+            accounting.add(res.choices[0].delta.content)
+            yield LLMStreamResponse(
+                res.id,
+                True if res.choices[0].finish_reason else False,
+                False,
+                res.choices[0].delta.content,
+                res.choices[0].finish_reason,
+                None,
+            )
+        if res.usage:
+            accounting.usage = ModelUsage(
+                unit="TOKENS",
+                input=res.usage.prompt_tokens,
+                output=res.usage.completion_tokens,
+                total=res.usage.total_tokens,
+            )
+
+    response_text = accounting.finish(metadata=kwargs)
+    if cache_key and response_text:
+        await _aset_cached_response(app, cache_key, response_text, cache_ttl)
 
 
 def get_current_models(app: Flask) -> list[str]:
@@ -0,0 +1,270 @@
+"""
+LLM stream accounting
+
+Keeps the per chunk work of a streamed completion small:
+
+- chunks are appended to a list and joined once when the stream ends
+- prompts and responses are truncated to LLM_LOG_MAX_CHARS in the logs
+- the Langfuse generation and the span output are built and sent by a
+  background exporter thread instead of the request thread
+
+usage:
+    accounting = StreamAccounting(app, span, model, generation_name, messages)
+    for chunk in stream:
+        accounting.add(chunk.text)
+    accounting.usage = usage
+    accounting.finish(metadata=kwargs)
+"""
+
+import atexit
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from flask import Flask
+
+from flaskr.common.config import get_config
+
+
+def truncate_log(value: Any, limit: Optional[int] = None) -> str:
+    """
+    Truncate a log payload to limit characters, 0 keeps it whole
+    """
+    if limit is None:
+        limit = int(get_config("LLM_LOG_MAX_CHARS"))
+    text = value if isinstance(value, str) else str(value)
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...({len(text)} chars)"
+
+
+class TraceExporter:
+    """
+    Runs trace calls on a daemon thread, draining up to batch_size calls per
+    wakeup. The queue is bounded, calls submitted to a full queue are dropped.
+    """
+
+    def __init__(self, name: str, batch_size: int = 100, maxsize: int = 10000):
+        self.name = name
+        self.batch_size = batch_size
+        self.maxsize = maxsize
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._app: Optional[Flask] = None
+        self._thread_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def submit(self, app: Flask, func: Callable, *args, **kwargs) -> bool:
+        """
+        Queue a call
+        Returns:
+            bool: False if the queue is full and the call was dropped
+        """
+        self._app = app
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+        return True
+
+    def _ensure_thread(self) -> None:
+        # keyed by pid so forked workers start their own thread
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            if self._thread_pid is not None:
+                self._queue = queue.Queue(maxsize=self.maxsize)
+            self._thread_pid = os.getpid()
+            thread = threading.Thread(
+                target=self._run, name=f"trace-exporter-{self.name}", daemon=True
+            )
+            thread.start()
+
+    def _run(self) -> None:
+        while True:
+            calls = [self._queue.get()]
+            self._drain(calls)
+            self._export(calls)
+
+    def _drain(self, calls: list) -> None:
+        try:
+            while len(calls) < self.batch_size:
+                calls.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+    def _export(self, calls: list) -> None:
+        exported = failed = 0
+        for func, args, kwargs in calls:
+            try:
+                func(*args, **kwargs)
+                exported += 1
+            except Exception as e:
+                failed += 1
+                if self._app is not None:
+                    self._app.logger.warning(f"trace export {self.name} failed: {e}")
+        with self._lock:
+            self.exported += exported
+            self.failed += failed
+            self.batches += 1
+
+    def flush(self) -> None:
+        """
+        Run the queued calls now, in the calling thread
+        """
+        while True:
+            calls = []
+            self._drain(calls)
+            if not calls:
+                return
+            self._export(calls)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "depth": self._queue.qsize(),
+            "maxsize": self.maxsize,
+            "submitted": self.submitted,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_trace_exporter() -> TraceExporter:
+    """
+    Get the trace exporter of this process, sized by LLM_TRACE_EXPORT_QUEUE_SIZE
+    """
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = TraceExporter(
+                    "langfuse", maxsize=int(get_config("LLM_TRACE_EXPORT_QUEUE_SIZE"))
+                )
+    return _exporter
+
+
+@atexit.register
+def flush_trace_exporter() -> None:
+    """
+    Export the calls still queued, called when the process exits
+    """
+    if _exporter is not None and _exporter._thread_pid == os.getpid():
+        _exporter.flush()
+
+
+class StreamAccounting:
+    """
+    Accounting of one streamed generation
+    """
+
+    __slots__ = (
+        "app",
+        "span",
+        "model",
+        "requested_model",
+        "generation_name",
+        "generation_input",
+        "start_time",
+        "start_completion_time",
+        "chunks",
+        "usage",
+    )
+
+    def __init__(
+        self,
+        app: Flask,
+        span,
+        model: str,
+        generation_name: str,
+        generation_input: Any,
+    ):
+        self.app = app
+        self.span = span
+        self.model = model
+        self.requested_model: Optional[str] = None
+        self.generation_name = generation_name
+        self.generation_input = generation_input
+        self.start_time = datetime.now()
+        self.start_completion_time: Optional[datetime] = None
+        self.chunks: list[str] = []
+        self.usage = None
+
+    def add(self, text: Optional[str]) -> None:
+        """
+        Record a received chunk, the first one marks the completion start
+        """
+        if self.start_completion_time is None:
+            self.start_completion_time = datetime.now()
+        if text:
+            self.chunks.append(text)
+
+    def set_served_model(self, model: str) -> None:
+        """
+        Record the model that served the stream, e.g. a fallback after a failover
+        """
+        if model != self.model:
+            self.requested_model = self.model
+            self.model = model
+
+    @property
+    def text(self) -> str:
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+    def finish(self, metadata: Optional[dict] = None, update_span: bool = False) -> str:
+        """
+        Log the response and export the generation
+        Returns:
+            str: the response text
+        """
+        text = self.text
+        if self.requested_model:
+            metadata = {**(metadata or {}), "requested_model": self.requested_model}
+        self.app.logger.info(f"invoke_llm response: {truncate_log(text)} ")
+        self.app.logger.info(f"invoke_llm usage: {self.usage.__str__()}")
+        get_trace_exporter().submit(
+            self.app,
+            _export_generation,
+            self.span,
+            update_span,
+            name=self.generation_name,
+            model=self.model,
+            # the caller may keep appending to its message list
+            input=list(self.generation_input)
+            if isinstance(self.generation_input, list)
+            else self.generation_input,
+            output=text,
+            usage=self.usage,
+            metadata=dict(metadata) if metadata else metadata,
+            start_time=self.start_time,
+            end_time=datetime.now(),
+            completion_start_time=self.start_completion_time,
+        )
+        return text
+
+
+def _export_generation(span, update_span: bool, **generation) -> None:
+    span.generation(**generation)
+    if update_span:
+        span.update(output=generation["output"])
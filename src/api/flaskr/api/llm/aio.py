@@ -0,0 +1,181 @@
+"""
+Async LLM runtime
+
+All async LLM clients of a worker process run on one event loop in a daemon
+thread. They share the HTTP connection pools of each provider, so a single
+process can multiplex many concurrent learner streams instead of holding a
+thread per stream.
+
+usage:
+    # async code running on the loop
+    client = get_async_client(openai_client)
+    stream = await client.chat.completions.create(..., stream=True)
+
+    # sync callers
+    for chunk in iter_async(agen):
+        ...
+    result = run_async(coro)
+"""
+
+import asyncio
+import itertools
+import math
+import os
+import queue
+import threading
+from typing import AsyncIterator, Awaitable, Generator, Iterable, Optional, TypeVar
+
+import httpx
+import openai
+
+from flaskr.common.config import get_config
+
+T = TypeVar("T")
+
+_ITEM = object()
+_DONE = object()
+_ERROR = object()
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_pid: Optional[int] = None
+_loop_lock = threading.Lock()
+
+# httpcore scans the whole pool on every request and response, which gets
+# quadratic with hundreds of open streams, so providers get several small pools
+_CONNECTIONS_PER_POOL = 32
+
+_async_clients: dict[tuple[str, str], list[openai.AsyncOpenAI]] = {}
+_async_clients_lock = threading.Lock()
+_round_robin = itertools.count()
+
+
+def _run_loop(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the LLM event loop of this process, starting it on first use.
+    It is keyed by pid so forked workers start their own loop.
+    """
+    global _loop, _loop_thread, _loop_pid
+    if _loop_pid == os.getpid():
+        return _loop
+    with _loop_lock:
+        if _loop_pid == os.getpid():
+            return _loop
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(
+            target=_run_loop, args=(loop,), name="llm-event-loop", daemon=True
+        )
+        thread.start()
+        with _async_clients_lock:
+            # pools inherited from the parent belong to its loop
+            _async_clients.clear()
+        _loop, _loop_thread, _loop_pid = loop, thread, os.getpid()
+        return loop
+
+
+def _in_loop_thread() -> bool:
+    return _loop_thread is not None and threading.current_thread() is _loop_thread
+
+
+def run_async(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    Run a coroutine on the LLM loop and wait for its result
+    """
+    if _in_loop_thread():
+        raise RuntimeError("run_async called from the LLM event loop")
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return future.result(timeout)
+    finally:
+        future.cancel()
+
+
+def iter_async(agen: AsyncIterator[T]) -> Generator[T, None, None]:
+    """
+    Iterate an async iterator from sync code.
+    Items are handed over as soon as the loop produces them. Closing the
+    generator early cancels the async side, which closes the HTTP stream.
+    """
+    if _in_loop_thread():
+        raise RuntimeError("iter_async called from the LLM event loop")
+    items: queue.Queue = queue.Queue()
+
+    async def _pump():
+        try:
+            async for item in agen:
+                items.put((_ITEM, item))
+        except BaseException as e:
+            items.put((_ERROR, e))
+            raise
+        items.put((_DONE, None))
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), get_loop())
+    try:
+        while True:
+            kind, value = items.get()
+            if kind is _ITEM:
+                yield value
+            elif kind is _DONE:
+                return
+            else:
+                raise value
+    finally:
+        if not future.done():
+            future.cancel()
+
+
+async def aiter_sync(iterable: Iterable[T]) -> AsyncIterator[T]:
+    """
+    Iterate a blocking iterator from async code without blocking the loop,
+    used for providers that only have sync SDKs
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, _DONE)
+        if item is _DONE:
+            return
+        yield item
+
+
+def _create_async_clients(client: openai.Client) -> list[openai.AsyncOpenAI]:
+    max_connections = int(get_config("LLM_MAX_CONNECTIONS"))
+    pool_count = max(1, math.ceil(max_connections / _CONNECTIONS_PER_POOL))
+    pool_size = math.ceil(max_connections / pool_count)
+    return [
+        openai.AsyncOpenAI(
+            api_key=client.api_key,
+            base_url=client.base_url,
+            timeout=client.timeout,
+            max_retries=client.max_retries,
+            http_client=httpx.AsyncClient(
+                timeout=client.timeout,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                ),
+            ),
+        )
+        for _ in range(pool_count)
+    ]
+
+
+def get_async_client(client: openai.Client) -> openai.AsyncOpenAI:
+    """
+    Get an async client sharing api key and base url with a sync client.
+    The connection pools are kept per provider and handed out round robin.
+    """
+    key = (str(client.base_url), client.api_key)
+    async_clients = _async_clients.get(key)
+    if async_clients is None:
+        with _async_clients_lock:
+            async_clients = _async_clients.get(key)
+            if async_clients is None:
+                async_clients = _create_async_clients(client)
+                _async_clients[key] = async_clients
+    return async_clients[next(_round_robin) % len(async_clients)]
@@ -0,0 +1,76 @@
+"""
+Per model rate limit
+
+A token bucket per model name shared by all threads of a worker process,
+used by background jobs that fan out many LLM calls at once.
+
+usage:
+    get_model_rate_limiter(model).acquire()
+"""
+
+import threading
+import time
+from typing import Optional
+
+from flaskr.common.config import get_config
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket, rate is in requests per minute.
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rpm: int, burst: Optional[int] = None):
+        self.rpm = rpm
+        self.capacity = burst or max(1, rpm // 60)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Take a token, returns how long the caller has to wait for it
+        """
+        with self._lock:
+            now = time.monotonic()
+            rate = self.rpm / 60.0
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * rate
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / rate
+
+    def acquire(self) -> float:
+        """
+        Block until a request is allowed
+        Returns:
+            float: seconds waited
+        """
+        if self.rpm <= 0:
+            return 0.0
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_model_rate_limiter(model: str) -> RateLimiter:
+    """
+    Get the rate limiter of a model, configured by LLM_RATE_LIMIT_RPM
+    """
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                limiter = RateLimiter(int(get_config("LLM_RATE_LIMIT_RPM")))
+                _limiters[model] = limiter
+    return limiter
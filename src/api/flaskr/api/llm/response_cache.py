@@ -0,0 +1,224 @@
+"""
+LLM response cache
+
+Completions that are fully determined by their input, e.g. publish summaries
+or content blocks without user variables, are generated once and replayed
+for every later identical request.
+
+Caching is opt-in per generation name, LLM_RESPONSE_CACHE_POLICIES maps
+generation name patterns to a TTL in seconds:
+
+    LLM_RESPONSE_CACHE_POLICIES="shifu_summary:604800,debug-*:3600"
+
+The key is a hash of the model, the normalized messages, the response
+format and the sampling arguments. Entries are stored in Redis (expired by
+TTL, evicted by the maxmemory policy of the server) or in a local directory
+(expired by TTL, least recently used entries evicted above
+LLM_RESPONSE_CACHE_MAX_ENTRIES).
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from flask import Flask
+
+from flaskr.common.config import get_config
+
+# arguments that change how a response is delivered, not what it contains
+_TRANSPORT_ARGS = {"stream", "stream_options"}
+
+# pruning the disk cache lists the directory, do it every this many writes
+_DISK_PRUNE_INTERVAL = 100
+
+
+def parse_policies(value: str) -> list[tuple[str, int]]:
+    """
+    Parse "name:ttl,pattern*:ttl" into [(pattern, ttl)], in order
+    """
+    policies = []
+    for item in (value or "").split(","):
+        pattern, _, ttl = item.strip().rpartition(":")
+        if pattern and ttl.strip().isdigit():
+            policies.append((pattern.strip(), int(ttl)))
+    return policies
+
+
+def _normalize_text(text) -> str:
+    if not isinstance(text, str):
+        return text
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def make_key(model: str, messages: list, json_format: bool, kwargs: dict) -> str:
+    """
+    Hash of everything that determines the completion
+    """
+    arguments = {
+        k: float(v) if k == "temperature" and v is not None else v
+        for k, v in kwargs.items()
+        if k not in _TRANSPORT_ARGS
+    }
+    payload = {
+        "model": model.strip(),
+        "messages": [
+            {"role": m.get("role"), "content": _normalize_text(m.get("content"))}
+            for m in messages
+        ],
+        "json": bool(json_format),
+        "arguments": arguments,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode()
+    ).hexdigest()
+
+
+class RedisResponseBackend:
+    def get(self, app: Flask, key: str) -> Optional[dict]:
+        from flaskr import dao
+
+        redis = getattr(dao, "redis_client", None)
+        if redis is None:
+            return None
+        value = redis.get(self._get_redis_key(app, key))
+        return json.loads(value) if value else None
+
+    def set(self, app: Flask, key: str, entry: dict, ttl: int) -> None:
+        from flaskr import dao
+
+        redis = getattr(dao, "redis_client", None)
+        if redis is None:
+            return
+        redis.set(self._get_redis_key(app, key), json.dumps(entry), ex=ttl)
+
+    @staticmethod
+    def _get_redis_key(app: Flask, key: str) -> str:
+        return (app.config.get("REDIS_KEY_PREFIX") or "") + "llm_response:" + key
+
+
+class DiskResponseBackend:
+    """
+    One json file per entry, reads touch the file so the least recently used
+    entries are pruned first
+    """
+
+    def __init__(self, directory: str, max_entries: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, app: Flask, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        if entry.get("expires_at", 0) < time.time():
+            self._remove(path)
+            return None
+        os.utime(path)
+        return entry
+
+    def set(self, app: Flask, key: str, entry: dict, ttl: int) -> None:
+        entry = dict(entry, expires_at=time.time() + ttl)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, self._path(key))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % _DISK_PRUNE_INTERVAL == 0
+        if prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """
+        Drop the least recently used entries above max_entries, expired
+        entries are dropped when they are read
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if dir_entry.name.endswith(".json"):
+                    try:
+                        entries.append((dir_entry.stat().st_mtime, dir_entry.path))
+                    except FileNotFoundError:
+                        pass
+        entries.sort(reverse=True)
+        for _, path in entries[self.max_entries :]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_backend = None
+_policies: Optional[list[tuple[str, int]]] = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                if get_config("LLM_RESPONSE_CACHE_BACKEND") == "disk":
+                    _backend = DiskResponseBackend(
+                        get_config("LLM_RESPONSE_CACHE_DIR")
+                        or os.path.join(tempfile.gettempdir(), "llm_response_cache"),
+                        int(get_config("LLM_RESPONSE_CACHE_MAX_ENTRIES")),
+                    )
+                else:
+                    _backend = RedisResponseBackend()
+    return _backend
+
+
+def get_policy_ttl(generation_name: str) -> int:
+    """
+    TTL of the first policy matching the generation name, 0 if not cached
+    """
+    global _policies
+    if _policies is None:
+        _policies = parse_policies(get_config("LLM_RESPONSE_CACHE_POLICIES"))
+    for pattern, ttl in _policies:
+        if fnmatch.fnmatchcase(generation_name or "", pattern):
+            return ttl
+    return 0
+
+
+def get_cached_response(app: Flask, key: str) -> Optional[str]:
+    """
+    Get the text of a cached completion, None on a miss
+    """
+    try:
+        entry = get_backend().get(app, key)
+    except Exception as e:
+        app.logger.warning(f"get llm response cache failed: {key} {e}")
+        return None
+    return entry["text"] if entry else None
+
+
+def set_cached_response(app: Flask, key: str, text: str, ttl: int) -> None:
+    """
+    Cache the text of a completed generation
+    """
+    try:
+        get_backend().set(app, key, {"text": text}, ttl)
+    except Exception as e:
+        app.logger.warning(f"set llm response cache failed: {key} {e}")
@@ -0,0 +1,346 @@
+"""
+LLM router
+
+Routes a streaming chat completion of a model to the OpenAI compatible
+providers configured for it and keeps per provider health:
+
+- a fallback chain per model, LLM_FALLBACK_CHAINS="gpt-4o>deepseek-chat>qwen/qwen-max,..."
+- EWMA of the time to first token of each provider and model
+- a circuit breaker per provider and model, open providers are skipped
+- failover to the next model of the chain when a provider fails before
+  its first token
+- optional hedging, when the first token does not arrive within
+  LLM_HEDGE_TTFT_MS the next model of the chain is raced against it and
+  the slower stream is cancelled
+
+Once a stream has produced its first token it is never switched, errors
+after that are raised to the caller.
+
+usage:
+    async for chunk in get_router().astream(model, messages, stream=True, ...):
+        ...
+"""
+
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, Callable, Optional
+
+import openai
+
+from flaskr.common.config import get_config
+from .aio import get_async_client
+
+# errors caused by the request itself, another provider would fail the same way
+_REQUEST_ERRORS = (openai.BadRequestError, openai.UnprocessableEntityError)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures. After reset_timeout
+    one trial request is let through, its result closes or reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # a trial that was never reported back is retried after another timeout
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.failures >= self.failure_threshold > 0
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ProviderHealth:
+    """
+    Latency and error tracking of one provider and model
+    """
+
+    def __init__(self, name: str, breaker: CircuitBreaker, alpha: float = 0.2):
+        self.name = name
+        self.breaker = breaker
+        self.alpha = alpha
+        self.ewma_ttft: Optional[float] = None
+        self.requests = 0
+        self.errors = 0
+
+    def observe_ttft(self, seconds: float) -> None:
+        if self.ewma_ttft is None:
+            self.ewma_ttft = seconds
+        else:
+            self.ewma_ttft = self.alpha * seconds + (1 - self.alpha) * self.ewma_ttft
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.breaker.state,
+            "ewma_ttft_ms": round(self.ewma_ttft * 1000)
+            if self.ewma_ttft is not None
+            else None,
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+
+class _Target:
+    def __init__(self, model: str, client: openai.Client, invoke_model: str, health):
+        self.model = model
+        self.client = client
+        self.invoke_model = invoke_model
+        self.health: ProviderHealth = health
+
+
+def parse_fallback_chains(value: str) -> dict[str, list[str]]:
+    """
+    Parse "a>b>c,d>e" into {"a": ["b", "c"], "d": ["e"]}
+    """
+    chains = {}
+    for chain in (value or "").split(","):
+        models = [m.strip() for m in chain.split(">") if m.strip()]
+        if len(models) > 1:
+            chains[models[0]] = models[1:]
+    return chains
+
+
+class LLMRouter:
+    def __init__(
+        self,
+        resolve: Callable[[str], tuple],
+        fallback_chains: Optional[dict[str, list[str]]] = None,
+        hedge_ttft: Optional[float] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+    ):
+        """
+        Args:
+            resolve: model name -> (openai client or None, provider model name)
+            fallback_chains: model name -> fallback model names in order
+            hedge_ttft: seconds to wait for a first token before racing the
+                next model of the chain, None disables hedging
+        """
+        self.resolve = resolve
+        self.fallback_chains = fallback_chains or {}
+        self.hedge_ttft = hedge_ttft
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._health: dict[tuple[str, str], ProviderHealth] = {}
+        self._health_lock = threading.Lock()
+
+    def get_health(
+        self, client: openai.Client, invoke_model: str, model: Optional[str] = None
+    ) -> ProviderHealth:
+        # the stats name is the model, the base url of a provider is not exposed
+        key = (str(client.base_url), invoke_model)
+        health = self._health.get(key)
+        if health is None:
+            with self._health_lock:
+                health = self._health.get(key)
+                if health is None:
+                    health = ProviderHealth(
+                        model or invoke_model,
+                        CircuitBreaker(self.failure_threshold, self.reset_timeout),
+                    )
+                    self._health[key] = health
+        return health
+
+    def _get_targets(self, model: str) -> list[_Target]:
+        client, invoke_model = self.resolve(model)
+        targets = [_Target(model, client, invoke_model, None)]
+        for fallback in self.fallback_chains.get(model, []):
+            try:
+                client, invoke_model = self.resolve(fallback)
+            except Exception:
+                # a fallback that is not configured in this deployment
+                continue
+            if client:
+                targets.append(_Target(fallback, client, invoke_model, None))
+        for target in targets:
+            target.health = self.get_health(
+                target.client, target.invoke_model, target.model
+            )
+        # the configured order of the chain, breakers are asked when a target
+        # is tried, so a half open one only spends its trial on a request
+        # that actually reaches the provider
+        return targets
+
+    async def _open(self, target: _Target, messages: list, retry: bool, kwargs):
+        client = get_async_client(target.client)
+        if not retry:
+            # fail over at once instead of retrying a failing provider
+            client = client.with_options(max_retries=0)
+        target.health.requests += 1
+        start = time.monotonic()
+        stream = await client.chat.completions.create(
+            model=target.invoke_model, messages=messages, **kwargs
+        )
+        iterator = stream.__aiter__()
+        try:
+            first = await iterator.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except BaseException:
+            await stream.close()
+            raise
+        target.health.observe_ttft(time.monotonic() - start)
+        return stream, iterator, first
+
+    def _record_failure(self, target: _Target, e: BaseException) -> None:
+        if isinstance(e, _REQUEST_ERRORS):
+            return
+        target.health.errors += 1
+        target.health.breaker.record_failure()
+
+    async def astream(
+        self,
+        model: str,
+        messages: list,
+        on_model: Optional[Callable[[str], None]] = None,
+        **kwargs,
+    ) -> AsyncIterator:
+        """
+        Stream a chat completion of the model or of a fallback of its chain
+
+        Args:
+            on_model: called with the model that serves the stream, before
+                its first chunk
+        """
+        targets = self._get_targets(model)
+        attempts: dict[asyncio.Task, _Target] = {}
+        next_index = 0
+        launched = 0
+        last_error: Optional[BaseException] = None
+        winner = None
+
+        def _start(target: _Target, retry: bool):
+            nonlocal launched
+            launched += 1
+            task = asyncio.ensure_future(self._open(target, messages, retry, kwargs))
+            attempts[task] = target
+
+        def _launch():
+            nonlocal next_index
+            while next_index < len(targets):
+                target = targets[next_index]
+                next_index += 1
+                if target.health.breaker.allow():
+                    _start(target, next_index == len(targets))
+                    return
+            if not launched:
+                # with every provider open the primary is still tried
+                # instead of failing fast
+                _start(targets[0], True)
+
+        try:
+            _launch()
+            while attempts and winner is None:
+                can_hedge = self.hedge_ttft and next_index < len(targets)
+                done, _ = await asyncio.wait(
+                    list(attempts),
+                    timeout=self.hedge_ttft if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    _launch()
+                    continue
+                for task in done:
+                    target = attempts.pop(task)
+                    if task.exception() is None:
+                        if winner is None:
+                            winner = (target, task.result())
+                        else:
+                            await task.result()[0].close()
+                        continue
+                    last_error = task.exception()
+                    self._record_failure(target, last_error)
+                    if isinstance(last_error, _REQUEST_ERRORS):
+                        raise last_error
+                if winner is None and not attempts and next_index < len(targets):
+                    _launch()
+        finally:
+            # cancel the slower attempts and close the streams they opened
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                results = await asyncio.gather(*attempts, return_exceptions=True)
+                for result in results:
+                    if isinstance(result, tuple):
+                        await result[0].close()
+        if winner is None:
+            raise last_error
+
+        target, (stream, iterator, first) = winner
+        target.health.breaker.record_success()
+        if on_model:
+            on_model(target.model)
+        try:
+            if first is not None:
+                yield first
+            async for chunk in iterator:
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as e:
+            self._record_failure(target, e)
+            raise
+        finally:
+            await stream.close()
+
+    def stats(self) -> list[dict]:
+        with self._health_lock:
+            healths = list(self._health.values())
+        return [health.stats() for health in healths]
+
+
+_router: Optional[LLMRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> LLMRouter:
+    """
+    Get the router of this process, configured by the LLM_FALLBACK_CHAINS,
+    LLM_HEDGE_TTFT_MS and LLM_CIRCUIT_* settings
+    """
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                from . import get_openai_client_and_model
+
+                hedge_ttft_ms = int(get_config("LLM_HEDGE_TTFT_MS"))
+                _router = LLMRouter(
+                    get_openai_client_and_model,
+                    parse_fallback_chains(get_config("LLM_FALLBACK_CHAINS")),
+                    hedge_ttft=hedge_ttft_ms / 1000 if hedge_ttft_ms > 0 else None,
+                    failure_threshold=int(get_config("LLM_CIRCUIT_FAILURE_THRESHOLD")),
+                    reset_timeout=int(get_config("LLM_CIRCUIT_RESET_SECONDS")),
+                )
+    return _router
@@ -2,10 +2,12 @@ from flask import Flask
 import click
 import asyncio
 import logging
+import time
 from sqlalchemy import create_engine, text
 from .import_user import import_user
 from .unified_migration_task import UnifiedMigrationTask, MigrationConfig
 from flaskr.service.shifu.migration import migrate_shifu_to_mdflow_content
+from flaskr.service.shifu.shifu_publish_funcs import get_shifu_summary
 
 
 def setup_migration_logging():
@@ -165,6 +167,31 @@ def enable_commands(app: Flask):
         """
         migrate_shifu_to_mdflow_content(app, shifu_bid)
 
+    @console.command(name="shifu_summary")
+    @click.argument("shifu_bid")
+    def shifu_summary_command(shifu_bid):
+        """Generate section summaries and ask prompts of a published shifu,
+        sections finished by an interrupted publish are not generated again
+        usage: flask console shifu_summary <shifu_bid>
+        """
+        get_shifu_summary(app, shifu_bid)
+
+    @console.command(name="jobs_worker")
+    @click.option("--threads", default=4, help="Worker threads")
+    def jobs_worker_command(threads):
+        """Run background jobs, e.g. shifu summaries and CDN warm-ups, until stopped
+        usage: flask console jobs_worker --threads 4
+        """
+        from flaskr.dao.jobs import MemoryJobBackend, get_job_queue
+
+        job_queue = get_job_queue(app)
+        if isinstance(job_queue.backend, MemoryJobBackend):
+            raise click.ClickException("jobs_worker needs JOB_BACKEND=redis and Redis")
+        job_queue.start_workers(app, threads)
+        click.echo(f"running background jobs with {threads} threads")
+        while True:
+            time.sleep(60)
+
     @console.command(name="verify")
     def verify_command():
         """Verify data consistency between old and new tables"""
@@ -9,10 +9,11 @@ from datetime import datetime
 from typing import Dict, List, Tuple, Optional
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
-from sqlalchemy import text, create_engine
+from sqlalchemy import bindparam, create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker
 import os
 import sys
+import zlib
 
 # Configure logging
 logging.basicConfig(
@@ -26,6 +27,15 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def _row_crc32(*values) -> int:
+    """CRC32(CONCAT_WS('|', ...)) of MySQL"""
+    return zlib.crc32("|".join(str(v) for v in values if v is not None).encode("utf-8"))
+
+
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    dbapi_connection.create_function("row_crc32", -1, _row_crc32)
+
+
 @dataclass
 class MigrationConfig:
     """Migration configuration"""
@@ -34,7 +44,12 @@ class MigrationConfig:
     max_workers: int = 4
     max_retries: int = 3
     retry_delay: float = 1.0
+    # Unused since the checksums cover every record, kept for callers
     consistency_check_sample_size: int = 100
+    # Source records per checksum chunk, and below which a mismatching
+    # range is compared row by row
+    checksum_chunk_size: int = 10000
+    checksum_leaf_size: int = 100
 
 
 @dataclass
@@ -69,7 +84,7 @@ class ConsistencyCheckResult:
     table_pair: str
     old_count: int
     new_count: int
-    sample_integrity_passed: bool
+    checksums_passed: bool
     data_mismatches: List[str]
 
     @property
@@ -78,7 +93,7 @@ class ConsistencyCheckResult:
 
     @property
     def is_consistent(self) -> bool:
-        return self.count_match and self.sample_integrity_passed
+        return self.count_match and self.checksums_passed
 
 
 class UnifiedMigrationTask:
@@ -107,9 +122,12 @@ class UnifiedMigrationTask:
             max_overflow=20,
             pool_recycle=3600,
         )
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _register_sqlite_functions)
         self.SessionClass = sessionmaker(bind=self.engine)
         self.config = config or MigrationConfig()
         self.force_full_migration = False
+        self._sync_log_ready = False
 
         # Table mapping configuration
         self.table_mappings = {
@@ -119,12 +137,32 @@ class UnifiedMigrationTask:
                 "mapping": self._map_attendscript_to_progress_record,
                 "key_field": "attend_id",
                 "target_key": "progress_record_bid",
+                "checksum_columns": {
+                    "progress_record_bid": "attend_id",
+                    "shifu_bid": "course_id",
+                    "outline_item_bid": "lesson_id",
+                    "user_bid": "user_id",
+                    "status": "status",
+                    "block_position": "script_index",
+                },
             },
             "ai_course_lesson_attendscript": {
                 "target": "learn_generated_blocks",
                 "mapping": self._map_log_script_to_generated_block,
                 "key_field": "log_id",
                 "target_key": "generated_block_bid",
+                "checksum_columns": {
+                    "generated_block_bid": "log_id",
+                    "progress_record_bid": "attend_id",
+                    "user_bid": "user_id",
+                    "block_bid": "script_id",
+                    "outline_item_bid": "lesson_id",
+                    "shifu_bid": "course_id",
+                    "type": "script_ui_type",
+                    "role": "script_role",
+                    "generated_content": "script_content",
+                    "position": "script_index",
+                },
             },
             # Order tables (Order related tables)
             "ai_course_buy_record": {
@@ -132,12 +170,28 @@ class UnifiedMigrationTask:
                 "mapping": self._map_buy_record_to_order,
                 "key_field": "record_id",
                 "target_key": "order_bid",
+                "checksum_columns": {
+                    "order_bid": "record_id",
+                    "shifu_bid": "course_id",
+                    "user_bid": "user_id",
+                    "payable_price": "price",
+                    "paid_price": "paid_value",
+                    "status": "status",
+                },
             },
             "pingxx_order": {
                 "target": "order_pingxx_orders",
                 "mapping": self._map_pingxx_order,
                 "key_field": "order_id",
                 "target_key": "pingxx_order_bid",
+                "checksum_columns": {
+                    "pingxx_order_bid": "order_id",
+                    "order_bid": "record_id",
+                    "transaction_no": "pingxx_transaction_no",
+                    "charge_id": "charge_id",
+                    "amount": "amount",
+                    "status": "status",
+                },
             },
             # Coupon tables (Coupon related tables)
             "discount": {
@@ -145,31 +199,49 @@ class UnifiedMigrationTask:
                 "mapping": self._map_discount_to_coupon,
                 "key_field": "discount_id",
                 "target_key": "coupon_bid",
+                "checksum_columns": {
+                    "coupon_bid": "discount_id",
+                    "code": "discount_code",
+                    "value": "discount_value",
+                    "total_count": "discount_count",
+                    "used_count": "discount_used",
+                    "status": "status",
+                },
             },
             "discount_record": {
                 "target": "promo_coupon_usages",
                 "mapping": self._map_discount_log_to_usage,
                 "key_field": "record_id",
                 "target_key": "coupon_usage_bid",
+                "checksum_columns": {
+                    "coupon_usage_bid": "record_id",
+                    "coupon_bid": "discount_id",
+                    "user_bid": "user_id",
+                    "status": "status",
+                },
             },
         }
 
         logger.info(f"Initialized unified migration task with database: {database_url}")
 
     async def migrate_all_tables(self) -> Dict[str, MigrationResult]:
-        """Migrate all configured tables asynchronously"""
+        """Migrate all configured tables, one worker thread per table"""
         logger.info("Starting unified migration for all tables...")
 
         results = {}
-        tasks = []
-
-        # Create migration tasks for each table
-        for source_table, config in self.table_mappings.items():
-            task = self._migrate_table_async(source_table, config)
-            tasks.append(task)
+        loop = asyncio.get_event_loop()
 
-        # Execute migrations concurrently
-        migration_results = await asyncio.gather(*tasks, return_exceptions=True)
+        # Tables are independent, run them in parallel worker threads
+        with ThreadPoolExecutor(
+            max_workers=self.config.max_workers, thread_name_prefix="migration"
+        ) as executor:
+            tasks = [
+                loop.run_in_executor(
+                    executor, self._migrate_table, source_table, config
+                )
+                for source_table, config in self.table_mappings.items()
+            ]
+            migration_results = await asyncio.gather(*tasks, return_exceptions=True)
 
         # Process results
         for i, (source_table, _) in enumerate(self.table_mappings.items()):
@@ -190,10 +262,8 @@ class UnifiedMigrationTask:
 
         return results
 
-    async def _migrate_table_async(
-        self, source_table: str, table_config: Dict
-    ) -> MigrationResult:
-        """Migrate a single table asynchronously"""
+    def _migrate_table(self, source_table: str, table_config: Dict) -> MigrationResult:
+        """Migrate a single table in keyset paginated batches"""
         logger.info(f"Starting migration for table: {source_table}")
         start_time = datetime.now()
 
@@ -203,7 +273,7 @@ class UnifiedMigrationTask:
         target_key = table_config["target_key"]
 
         # Check if tables exist
-        if not await self._table_exists_async(source_table):
+        if not self._table_exists(source_table):
             logger.warning(f"Source table {source_table} does not exist, skipping...")
             return MigrationResult(
                 table_name=source_table,
@@ -215,7 +285,7 @@ class UnifiedMigrationTask:
                 errors=[f"Source table {source_table} does not exist"],
             )
 
-        if not await self._table_exists_async(target_table):
+        if not self._table_exists(target_table):
             logger.warning(f"Target table {target_table} does not exist, skipping...")
             return MigrationResult(
                 table_name=source_table,
@@ -228,52 +298,68 @@ class UnifiedMigrationTask:
             )
 
         # Get total record count
-        total_count = await self._get_table_count_async(source_table)
+        total_count = self._get_table_count(source_table)
         logger.info(f"Total records to migrate from {source_table}: {total_count}")
 
         # Process in batches
         synced_count = 0
         error_count = 0
         errors = []
-        offset = 0
+        last_id = self._get_start_id(source_table, target_table)
+        processed_count = 0 if last_id == 0 else None
+        batch_number = 0
 
-        while offset < total_count:
+        while True:
+            batch_number += 1
             try:
-                batch_result = await self._process_batch_async(
+                batch_result = self._process_batch_sync(
                     source_table,
                     target_table,
                     mapping_func,
                     key_field,
                     target_key,
-                    offset,
-                )
-                synced_count += batch_result["synced"]
-                error_count += batch_result["errors"]
-                errors.extend(batch_result["error_messages"])
-
-                offset += self.config.batch_size
-
-                # Log progress with more detail
-                progress = min(100, (offset / total_count) * 100)
-                logger.info(
-                    f"Migration progress for {source_table}: {progress:.1f}% ({synced_count}/{total_count}) - Batch {offset // self.config.batch_size + 1}"
+                    last_id,
                 )
-
-                # Also print for visibility during flask db upgrade
-                print(
-                    f"[MIGRATION] {source_table}: {progress:.1f}% ({synced_count}/{total_count})"
-                )
-                import sys
-
-                sys.stdout.flush()
-
             except Exception as e:
                 logger.error(
-                    f"Batch processing failed for {source_table} at offset {offset}: {e}"
+                    f"Batch processing failed for {source_table} after id {last_id}: {e}"
                 )
-                errors.append(f"Batch error at offset {offset}: {str(e)}")
+                errors.append(f"Batch error after id {last_id}: {str(e)}")
                 error_count += self.config.batch_size
-                offset += self.config.batch_size
+                # Skip the failed batch
+                batch_end_id = self._get_batch_end_id(source_table, last_id)
+                if batch_end_id is None:
+                    break
+                last_id = batch_end_id
+                continue
+
+            if batch_result["fetched"] == 0:
+                break
+            synced_count += batch_result["synced"]
+            error_count += batch_result["errors"]
+            errors.extend(batch_result["error_messages"])
+            last_id = batch_result["last_id"]
+            if processed_count is not None:
+                processed_count += batch_result["fetched"]
+
+            # Log progress with more detail
+            if processed_count is not None and total_count:
+                progress = min(100, (processed_count / total_count) * 100)
+                progress_text = f"{progress:.1f}%"
+            else:
+                progress_text = f"after id {last_id}"
+            logger.info(
+                f"Migration progress for {source_table}: {progress_text} ({synced_count}/{total_count}) - Batch {batch_number}"
+            )
+
+            # Also print for visibility during flask db upgrade
+            print(
+                f"[MIGRATION] {source_table}: {progress_text} ({synced_count}/{total_count})"
+            )
+            sys.stdout.flush()
+
+            if batch_result["fetched"] < self.config.batch_size:
+                break
 
         end_time = datetime.now()
         result = MigrationResult(
@@ -289,34 +375,51 @@ class UnifiedMigrationTask:
         completion_message = f"Migration completed for {source_table}: {synced_count}/{total_count} records, {error_count} errors"
         logger.info(completion_message)
         print(f"[MIGRATION] ✅ {completion_message}")
-        import sys
-
         sys.stdout.flush()
         return result
 
-    async def _process_batch_async(
-        self,
-        source_table: str,
-        target_table: str,
-        mapping_func,
-        key_field: str,
-        target_key: str,
-        offset: int,
-    ) -> Dict:
-        """Process a batch of records asynchronously"""
-        loop = asyncio.get_event_loop()
-
-        with ThreadPoolExecutor(max_workers=self.config.max_workers) as executor:
-            future = executor.submit(
-                self._process_batch_sync,
-                source_table,
-                target_table,
-                mapping_func,
-                key_field,
-                target_key,
-                offset,
+    def _get_start_id(self, source_table: str, target_table: str) -> int:
+        """Source id after which the migration of a table starts"""
+        if self.force_full_migration:
+            return 0
+        session = self.SessionClass()
+        try:
+            # If the target has less than 100 records, consider it fresh
+            target_count = self._get_table_count_with_session(
+                session, target_table, "deleted = 0"
+            )
+            if target_count < 100:
+                return 0
+            last_synced_id = self._get_last_synced_id_with_session(
+                session, f"{source_table}_sync"
             )
-            return await loop.run_in_executor(None, lambda: future.result())
+            if last_synced_id > 0:
+                logger.info(
+                    f"Running incremental migration for {source_table} starting from ID {last_synced_id + 1}"
+                )
+            return last_synced_id
+        finally:
+            session.close()
+
+    def _get_batch_end_id(self, source_table: str, after_id: int) -> Optional[int]:
+        """Last source id of the batch after an id"""
+        session = self.SessionClass()
+        try:
+            return session.execute(
+                text(
+                    f"""
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM {source_table}
+                        WHERE id > :after_id
+                        ORDER BY id ASC
+                        LIMIT :batch_size
+                    ) batch
+                """
+                ),
+                {"after_id": after_id, "batch_size": self.config.batch_size},
+            ).scalar()
+        finally:
+            session.close()
 
     def _process_batch_sync(
         self,
@@ -325,144 +428,91 @@ class UnifiedMigrationTask:
         mapping_func,
         key_field: str,
         target_key: str,
-        offset: int,
+        after_id: int,
     ) -> Dict:
-        """Process a batch of records synchronously"""
+        """Process the batch of records after a source id"""
         # Create a new session for this batch to avoid concurrency issues
         session = self.SessionClass()
         try:
-            # Get last synced ID for incremental updates
-            last_synced_id = self._get_last_synced_id_with_session(
-                session, f"{source_table}_sync"
-            )
-
-            # Determine migration mode
-            should_do_full_migration = self.force_full_migration
-
-            if not should_do_full_migration:
-                # Check if this is a fresh migration by looking at target table count
-                target_table_name = self.table_mappings[source_table]["target"]
-                target_count = self._get_table_count_with_session(
-                    session, target_table_name, "deleted = 0"
-                )
-                should_do_full_migration = (
-                    target_count < 100
-                )  # If less than 100 records, consider it fresh
-
-            # Fetch batch of records using ID-based pagination
-            if not should_do_full_migration and last_synced_id > 0:
-                # Incremental migration - get records with ID greater than last synced ID
-                query = text(
+            # Keyset pagination, the cost of a batch does not grow with its position
+            records = session.execute(
+                text(
                     f"""
                     SELECT * FROM {source_table}
-                    WHERE id > :last_synced_id
+                    WHERE id > :after_id
                     ORDER BY id ASC
                     LIMIT :batch_size
                 """
-                )
-                params = {
-                    "last_synced_id": last_synced_id,
-                    "batch_size": self.config.batch_size,
+                ),
+                {"after_id": after_id, "batch_size": self.config.batch_size},
+            ).fetchall()
+            if not records:
+                return {
+                    "fetched": 0,
+                    "last_id": after_id,
+                    "synced": 0,
+                    "errors": 0,
+                    "error_messages": [],
                 }
-                logger.info(
-                    f"Running incremental migration for {source_table} starting from ID {last_synced_id + 1}"
-                )
-            else:
-                # Full migration - use OFFSET-based pagination
-                query = text(
-                    f"""
-                    SELECT * FROM {source_table}
-                    ORDER BY id ASC
-                    LIMIT :batch_size OFFSET :offset
-                """
-                )
-                params = {"batch_size": self.config.batch_size, "offset": offset}
-                logger.info(
-                    f"Running full migration for {source_table} batch at offset {offset}"
-                )
-
-            records = session.execute(query, params).fetchall()
 
-            synced_count = 0
             error_count = 0
             error_messages = []
 
+            # Map the records, a later record of the same key wins
+            rows = {}
             for record in records:
                 try:
-                    # Check if record already exists in target table
-                    existing_query = text(
-                        f"""
-                        SELECT COUNT(*) FROM {target_table}
-                        WHERE {target_key} = :key_value AND deleted = 0
-                    """
-                    )
-
-                    existing_count = session.execute(
-                        existing_query, {"key_value": getattr(record, key_field)}
-                    ).scalar()
-
-                    # Map the record
-                    mapped_data = mapping_func(record)
-
-                    if existing_count > 0:
-                        # Update existing record
-                        update_fields = []
-                        update_params = {"key_value": getattr(record, key_field)}
-
-                        for field, value in mapped_data.items():
-                            if field != target_key:  # Don't update the key field
-                                update_fields.append(f"{field} = :{field}")
-                                update_params[field] = value
-
-                        if update_fields:
-                            update_query = text(
-                                f"""
-                                UPDATE {target_table}
-                                SET {", ".join(update_fields)}
-                                WHERE {target_key} = :key_value
-                            """
-                            )
-                            session.execute(update_query, update_params)
-                    else:
-                        # Insert new record
-                        field_names = list(mapped_data.keys())
-                        field_placeholders = [f":{field}" for field in field_names]
-
-                        insert_query = text(
-                            f"""
-                            INSERT INTO {target_table} ({", ".join(field_names)})
-                            VALUES ({", ".join(field_placeholders)})
-                        """
-                        )
-                        session.execute(insert_query, mapped_data)
-
-                    synced_count += 1
-
+                    rows[getattr(record, key_field)] = mapping_func(record)
                 except Exception as e:
                     error_count += 1
                     error_msg = f"Record migration failed for {getattr(record, key_field)}: {str(e)}"
                     error_messages.append(error_msg)
                     logger.error(error_msg)
 
-                    if (
-                        error_count > self.config.batch_size * 0.5
-                    ):  # If more than 50% errors
-                        raise Exception(f"Too many errors in batch: {error_count}")
-
-            # Commit the batch
-            session.commit()
+            # Existing target records of the batch, fetched at once
+            existing_ids = self._get_existing_ids_with_session(
+                session, target_table, target_key, list(rows.keys())
+            )
+            for key, row in rows.items():
+                if key in existing_ids:
+                    row["id"] = existing_ids[key]
 
-            # Update last synced ID
-            if records:
-                latest_id = max(
-                    record.id for record in records if hasattr(record, "id")
+            try:
+                self._write_rows_with_session(
+                    session, target_table, target_key, list(rows.values())
                 )
-                self._update_last_synced_id_with_session(
-                    session, f"{source_table}_sync", latest_id
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.warning(
+                    f"Bulk write failed for {source_table}, writing records one by one: {e}"
                 )
+                for key, row in rows.items():
+                    try:
+                        self._write_rows_with_session(
+                            session, target_table, target_key, [row]
+                        )
+                        session.commit()
+                    except Exception as e:
+                        session.rollback()
+                        error_count += 1
+                        error_msg = f"Record migration failed for {key}: {str(e)}"
+                        error_messages.append(error_msg)
+                        logger.error(error_msg)
+
+            if error_count > self.config.batch_size * 0.5:  # If more than 50% errors
+                raise Exception(f"Too many errors in batch: {error_count}")
+
+            # Update last synced ID
+            latest_id = records[-1].id
+            self._update_last_synced_id_with_session(
+                session, f"{source_table}_sync", latest_id
+            )
 
             return {
-                "synced": synced_count,
+                "fetched": len(records),
+                "last_id": latest_id,
+                "synced": len(records) - error_count,
                 "errors": error_count,
                 "error_messages": error_messages,
             }
@@ -474,164 +524,274 @@ class UnifiedMigrationTask:
         finally:
             session.close()
 
+    def _get_existing_ids_with_session(
+        self, session, target_table: str, target_key: str, keys: List
+    ) -> Dict:
+        """Ids of the target records of keys, by key"""
+        if not keys:
+            return {}
+        query = text(
+            f"""
+            SELECT id, {target_key} FROM {target_table}
+            WHERE {target_key} IN :keys AND deleted = 0
+        """
+        ).bindparams(bindparam("keys", expanding=True))
+        return {
+            key: id for id, key in session.execute(query, {"keys": keys}).fetchall()
+        }
+
+    def _write_rows_with_session(
+        self, session, target_table: str, target_key: str, rows: List[Dict]
+    ):
+        """
+        Insert new rows and upsert rows with the id of their existing record,
+        each as one multi-row statement
+        """
+        new_rows = [row for row in rows if "id" not in row]
+        existing_rows = [row for row in rows if "id" in row]
+        if new_rows:
+            fields = list(new_rows[0].keys())
+            session.execute(
+                text(
+                    f"""
+                    INSERT INTO {target_table} ({", ".join(fields)})
+                    VALUES ({", ".join(f":{field}" for field in fields)})
+                """
+                ),
+                new_rows,
+            )
+        if existing_rows:
+            fields = list(existing_rows[0].keys())
+            # Don't update the key field
+            update_fields = [f for f in fields if f not in ("id", target_key)]
+            if self.engine.dialect.name == "mysql":
+                on_conflict = "ON DUPLICATE KEY UPDATE " + ", ".join(
+                    f"{field} = VALUES({field})" for field in update_fields
+                )
+            else:
+                on_conflict = "ON CONFLICT (id) DO UPDATE SET " + ", ".join(
+                    f"{field} = excluded.{field}" for field in update_fields
+                )
+            session.execute(
+                text(
+                    f"""
+                    INSERT INTO {target_table} ({", ".join(fields)})
+                    VALUES ({", ".join(f":{field}" for field in fields)})
+                    {on_conflict}
+                """
+                ),
+                existing_rows,
+            )
+
     async def verify_data_consistency(self) -> Dict[str, ConsistencyCheckResult]:
-        """Verify data consistency between old and new tables"""
+        """
+        Verify data consistency between old and new tables by comparing
+        checksums of id range chunks, in parallel worker threads
+        """
         logger.info("Starting comprehensive data consistency verification...")
 
         results = {}
+        loop = asyncio.get_event_loop()
 
-        for source_table, config in self.table_mappings.items():
-            target_table = config["target"]
-            key_field = config["key_field"]
-            target_key = config["target_key"]
-
-            try:
-                # Count verification
-                old_count = await self._get_table_count_async(source_table)
-                new_count = await self._get_table_count_async(
-                    target_table, where_clause="deleted = 0"
-                )
-
-                # Sample integrity check
-                (
-                    sample_check_passed,
-                    mismatches,
-                ) = await self._verify_sample_integrity_async(
-                    source_table, target_table, key_field, target_key
-                )
+        with ThreadPoolExecutor(
+            max_workers=self.config.max_workers, thread_name_prefix="verify"
+        ) as executor:
+            chunk_tasks = {}
+            for source_table, config in self.table_mappings.items():
+                try:
+                    chunks = self._plan_checksum_chunks(source_table, config)
+                except Exception as e:
+                    chunks = e
+                chunk_tasks[source_table] = chunks
+                if isinstance(chunks, Exception):
+                    continue
+                chunk_tasks[source_table] = [
+                    loop.run_in_executor(
+                        executor, self._verify_chunk, source_table, config, lo, hi
+                    )
+                    for lo, hi in chunks
+                ]
+
+            for source_table, config in self.table_mappings.items():
+                target_table = config["target"]
+                tasks = chunk_tasks[source_table]
+                if isinstance(tasks, Exception):
+                    chunk_results = [tasks]
+                else:
+                    chunk_results = await asyncio.gather(*tasks, return_exceptions=True)
+
+                errors = [r for r in chunk_results if isinstance(r, Exception)]
+                if errors:
+                    logger.error(
+                        f"Consistency check failed for {source_table}: {errors[0]}"
+                    )
+                    results[source_table] = ConsistencyCheckResult(
+                        table_pair=f"{source_table} -> {target_table}",
+                        old_count=0,
+                        new_count=0,
+                        checksums_passed=False,
+                        data_mismatches=[f"Check failed: {str(e)}" for e in errors],
+                    )
+                    continue
 
                 result = ConsistencyCheckResult(
                     table_pair=f"{source_table} -> {target_table}",
-                    old_count=old_count,
-                    new_count=new_count,
-                    sample_integrity_passed=sample_check_passed,
-                    data_mismatches=mismatches,
+                    old_count=sum(r[0] for r in chunk_results),
+                    new_count=sum(r[1] for r in chunk_results),
+                    checksums_passed=all(not r[2] for r in chunk_results),
+                    data_mismatches=[m for r in chunk_results for m in r[2]],
                 )
-
                 results[source_table] = result
 
                 status = "✓ PASSED" if result.is_consistent else "✗ FAILED"
                 logger.info(
-                    f"Consistency check {status} for {source_table}: {old_count} -> {new_count}"
-                )
-
-            except Exception as e:
-                logger.error(f"Consistency check failed for {source_table}: {e}")
-                results[source_table] = ConsistencyCheckResult(
-                    table_pair=f"{source_table} -> {target_table}",
-                    old_count=0,
-                    new_count=0,
-                    sample_integrity_passed=False,
-                    data_mismatches=[f"Check failed: {str(e)}"],
+                    f"Consistency check {status} for {source_table}: {result.old_count} -> {result.new_count}"
                 )
 
         return results
 
-    async def _verify_sample_integrity_async(
-        self, source_table: str, target_table: str, key_field: str, target_key: str
-    ) -> Tuple[bool, List[str]]:
-        """Verify data integrity using random sampling"""
+    def _plan_checksum_chunks(
+        self, source_table: str, table_config: Dict
+    ) -> List[Tuple[int, int]]:
+        """Source id ranges (lo, hi] of about checksum_chunk_size records"""
+        for table_name in (source_table, table_config["target"]):
+            if not self._table_exists(table_name):
+                raise Exception(f"Table {table_name} does not exist")
         session = self.SessionClass()
         try:
-            # Get random sample from source table
-            sample_query = text(
-                f"""
-                SELECT * FROM {source_table}
-                ORDER BY RAND()
-                LIMIT :sample_size
-            """
+            min_id, max_id = session.execute(
+                text(f"SELECT MIN(id), MAX(id) FROM {source_table}")
+            ).fetchone()
+        finally:
+            session.close()
+        if min_id is None:
+            return []
+        size = self.config.checksum_chunk_size
+        return [(lo, min(lo + size, max_id)) for lo in range(min_id - 1, max_id, size)]
+
+    def _verify_chunk(
+        self, source_table: str, table_config: Dict, lo: int, hi: int
+    ) -> Tuple[int, int, List[str]]:
+        """Source and target record counts and mismatches of an id range"""
+        session = self.SessionClass()
+        try:
+            source, target = self._range_checksums(
+                session, source_table, table_config, lo, hi
             )
-
-            samples = session.execute(
-                sample_query, {"sample_size": self.config.consistency_check_sample_size}
-            ).fetchall()
-
             mismatches = []
-
-            for sample in samples:
-                key_value = getattr(sample, key_field)
-
-                # Find corresponding record in target table
-                target_query = text(
-                    f"""
-                    SELECT * FROM {target_table}
-                    WHERE {target_key} = :key_value AND deleted = 0
-                    LIMIT 1
-                """
+            if source != target:
+                mismatches = self._find_mismatches(
+                    session, source_table, table_config, lo, hi
                 )
-
-                target_record = session.execute(
-                    target_query, {"key_value": key_value}
-                ).fetchone()
-
-                if not target_record:
-                    mismatches.append(f"Missing record in target: {key_value}")
-                    continue
-
-                # Verify specific field mappings based on table type
-                verification_passed = self._verify_record_mapping(
-                    source_table, sample, target_record
-                )
-
-                if not verification_passed:
-                    mismatches.append(f"Data mismatch for record: {key_value}")
-
-            success_rate = (
-                (len(samples) - len(mismatches)) / len(samples) if samples else 1.0
-            )
-            passed = success_rate >= 0.95  # 95% success rate required
-
-            return passed, mismatches
-
-        except Exception as e:
-            logger.error(f"Sample integrity check failed: {e}")
-            return False, [f"Integrity check error: {str(e)}"]
+            return source[0], target[0], mismatches
         finally:
             session.close()
 
-    def _verify_record_mapping(
-        self, source_table: str, source_record, target_record
-    ) -> bool:
-        """Verify specific field mappings for a record"""
-        try:
-            if source_table == "ai_course_buy_record":
-                return (
-                    abs(float(target_record.payable_price) - float(source_record.price))
-                    < 0.01
-                    and abs(
-                        float(target_record.paid_price)
-                        - float(source_record.paid_value)
-                    )
-                    < 0.01
-                )
-            elif source_table == "discount":
-                return (
-                    target_record.code == source_record.discount_code
-                    and abs(
-                        float(target_record.value) - float(source_record.discount_value)
+    def _find_mismatches(
+        self, session, source_table: str, table_config: Dict, lo: int, hi: int
+    ) -> List[str]:
+        """Bisect a mismatching id range down to the records that differ"""
+        if hi - lo <= self.config.checksum_leaf_size:
+            return self._compare_rows(session, source_table, table_config, lo, hi)
+        mid = (lo + hi) // 2
+        mismatches = []
+        for half_lo, half_hi in ((lo, mid), (mid, hi)):
+            source, target = self._range_checksums(
+                session, source_table, table_config, half_lo, half_hi
+            )
+            if source != target:
+                mismatches.extend(
+                    self._find_mismatches(
+                        session, source_table, table_config, half_lo, half_hi
                     )
-                    < 0.01
                 )
-            elif source_table == "pingxx_order":
-                return (
-                    target_record.transaction_no == source_record.pingxx_transaction_no
-                    and target_record.amount == source_record.amount
-                )
-            elif source_table in [
-                "ai_course_lesson_attendscript",
-                "ai_course_lesson_attend",
-            ]:
-                # For study tables, verify basic bid mapping
-                return (
-                    hasattr(target_record, "user_bid")
-                    and target_record.user_bid is not None
-                )
-            else:
-                return True  # Basic existence check for other tables
+        return mismatches
+
+    def _range_checksums(
+        self, session, source_table: str, table_config: Dict, lo: int, hi: int
+    ) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+        """(count, checksum) of the source records of an id range and their targets"""
+        columns = table_config["checksum_columns"]
+        params = {"lo": lo, "hi": hi}
+        source = session.execute(
+            text(
+                f"""
+                SELECT COUNT(*), SUM({self._row_checksum_sql([f"s.{c}" for c in columns.values()])})
+                FROM {source_table} s
+                WHERE s.id > :lo AND s.id <= :hi
+            """
+            ),
+            params,
+        ).fetchone()
+        target = session.execute(
+            text(
+                f"""
+                SELECT COUNT(*), SUM({self._row_checksum_sql([f"t.{c}" for c in columns])})
+                {self._target_join_sql(source_table, table_config)}
+            """
+            ),
+            params,
+        ).fetchone()
+        return (
+            (source[0] or 0, int(source[1] or 0)),
+            (target[0] or 0, int(target[1] or 0)),
+        )
 
-        except Exception as e:
-            logger.error(f"Record mapping verification failed: {e}")
-            return False
+    def _compare_rows(
+        self, session, source_table: str, table_config: Dict, lo: int, hi: int
+    ) -> List[str]:
+        """Row by row comparison of a small id range"""
+        columns = table_config["checksum_columns"]
+        key_field = table_config["key_field"]
+        params = {"lo": lo, "hi": hi}
+        source_rows = session.execute(
+            text(
+                f"""
+                SELECT s.{key_field}, {self._row_checksum_sql([f"s.{c}" for c in columns.values()])}
+                FROM {source_table} s
+                WHERE s.id > :lo AND s.id <= :hi
+            """
+            ),
+            params,
+        ).fetchall()
+        target_checksums: Dict = {}
+        for key, checksum in session.execute(
+            text(
+                f"""
+                SELECT s.{key_field}, {self._row_checksum_sql([f"t.{c}" for c in columns])}
+                {self._target_join_sql(source_table, table_config)}
+            """
+            ),
+            params,
+        ).fetchall():
+            target_checksums.setdefault(key, []).append(checksum)
+
+        mismatches = []
+        for key, checksum in source_rows:
+            targets = target_checksums.get(key, [])
+            if not targets:
+                mismatches.append(f"Missing record in target: {key}")
+            elif len(targets) > 1:
+                mismatches.append(f"Duplicate records in target: {key}")
+            elif targets[0] != checksum:
+                mismatches.append(f"Data mismatch for record: {key}")
+        return mismatches
+
+    def _target_join_sql(self, source_table: str, table_config: Dict) -> str:
+        """FROM clause of the target records of a source id range"""
+        return f"""
+            FROM {source_table} s
+            JOIN {table_config["target"]} t
+                ON t.{table_config["target_key"]} = s.{table_config["key_field"]}
+                AND t.deleted = 0
+            WHERE s.id > :lo AND s.id <= :hi
+        """
+
+    def _row_checksum_sql(self, columns: List[str]) -> str:
+        """SQL expression of the CRC32 of a row's columns"""
+        if self.engine.dialect.name == "mysql":
+            return f"CRC32(CONCAT_WS('|', {', '.join(columns)}))"
+        return f"row_crc32({', '.join(columns)})"
 
     # Table mapping functions
     def _map_attendscript_to_progress_record(self, record) -> Dict:
@@ -755,24 +915,13 @@ class UnifiedMigrationTask:
         }
 
     # Helper methods
-    async def _table_exists_async(self, table_name: str) -> bool:
-        """Check if table exists asynchronously"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._table_exists, table_name)
-
     def _table_exists(self, table_name: str) -> bool:
         """Check if table exists"""
-        session = self.SessionClass()
         try:
-            result = session.execute(
-                text(f"SHOW TABLES LIKE '{table_name}'")
-            ).fetchone()
-            return result is not None
+            return inspect(self.engine).has_table(table_name)
         except Exception as e:
             logger.error(f"Error checking table existence {table_name}: {e}")
             return False
-        finally:
-            session.close()
 
     def _get_table_count_with_session(
         self, session, table_name: str, where_clause: str = ""
@@ -895,9 +1044,9 @@ class UnifiedMigrationTask:
 
             session.execute(
                 text(
-                    "INSERT INTO migration_sync_log (sync_type, sync_time, created_at) VALUES (:type, :time, NOW())"
+                    "INSERT INTO migration_sync_log (sync_type, sync_time, created_at) VALUES (:type, :time, :now)"
                 ),
-                {"type": sync_type, "time": sync_time},
+                {"type": sync_type, "time": sync_time, "now": datetime.now()},
             )
             session.commit()
         except Exception as e:
@@ -912,9 +1061,9 @@ class UnifiedMigrationTask:
 
             session.execute(
                 text(
-                    "INSERT INTO migration_sync_log (sync_type, last_synced_id, sync_time, created_at) VALUES (:type, :last_id, NOW(), NOW())"
+                    "INSERT INTO migration_sync_log (sync_type, last_synced_id, sync_time, created_at) VALUES (:type, :last_id, :now, :now)"
                 ),
-                {"type": sync_type, "last_id": last_synced_id},
+                {"type": sync_type, "last_id": last_synced_id, "now": datetime.now()},
             )
             session.commit()
         except Exception as e:
@@ -930,6 +1079,26 @@ class UnifiedMigrationTask:
 
     def _ensure_sync_log_table_with_session(self, session):
         """Ensure sync log table exists using provided session"""
+        # Checked once per task, not for every batch
+        if self._sync_log_ready:
+            return
+        if self.engine.dialect.name == "sqlite":
+            session.execute(
+                text(
+                    """
+                CREATE TABLE IF NOT EXISTS migration_sync_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sync_type VARCHAR(50) NOT NULL,
+                    sync_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    last_synced_id BIGINT DEFAULT NULL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+                )
+            )
+            session.commit()
+            self._sync_log_ready = True
+            return
         try:
             session.execute(
                 text(
@@ -979,6 +1148,7 @@ class UnifiedMigrationTask:
                 logger.warning(f"Error checking/adding last_synced_id column: {e}")
 
             session.commit()
+            self._sync_log_ready = True
         except Exception as e:
             logger.error(f"Error creating sync log table: {e}")
 
@@ -1032,9 +1202,7 @@ class UnifiedMigrationTask:
             report.append(
                 f"  Count Match: {result.old_count} -> {result.new_count} {'✓' if result.count_match else '✗'}"
             )
-            report.append(
-                f"  Sample Integrity: {'✓' if result.sample_integrity_passed else '✗'}"
-            )
+            report.append(f"  Checksums: {'✓' if result.checksums_passed else '✗'}")
             if result.data_mismatches:
                 report.append(f"  Mismatches: {len(result.data_mismatches)}")
             report.append("")
@@ -1,8 +1,14 @@
+import atexit
 import logging
 import os
+import queue
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Optional
 from flask import Flask, request
 import uuid
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 import threading
 import socket
 from datetime import datetime
@@ -45,23 +51,250 @@ class RequestFormatter(logging.Formatter):
 
 
 class FeishuLogHandler(logging.Handler):
-    def __init__(self, webhook_url):
+    """
+    Sends error logs to a Feishu webhook as digests. Runs on the thread of
+    the FeishuQueueHandler listener, never on a request thread.
+
+    - identical errors (same logger, level and message) are sent once per
+      dedup_window, later ones are only counted
+    - errors are collected for digest_interval seconds into one message
+    - at most rate_limit messages are sent per minute, errors wait meanwhile
+      and the oldest are dropped beyond max_pending
+    - every message reports the errors deduplicated and dropped since the
+      previous one
+    """
+
+    def __init__(
+        self,
+        webhook_url: str,
+        digest_interval: float = 10,
+        dedup_window: float = 300,
+        rate_limit: int = 6,
+        max_pending: int = 50,
+        max_chars: int = 8000,
+        clock=time.monotonic,
+    ):
         super().__init__(level=logging.ERROR)
         self.webhook_url = webhook_url
+        self.digest_interval = digest_interval
+        self.dedup_window = dedup_window
+        self.rate_limit = rate_limit
+        self.max_pending = max_pending
+        self.max_chars = max_chars
+        self.clock = clock
+        # key -> [formatted record, count]
+        self._pending: OrderedDict = OrderedDict()
+        self._digest_started: Optional[float] = None
+        self._sent_at: dict = {}
+        self._send_times: deque = deque()
+        self._unreported_duplicates = 0
+        self._unreported_drops = 0
+        self.received = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.messages = 0
+        self.failed = 0
 
     def emit(self, record):
-        log_entry = self.format(record)
-        payload = {
-            "msg_type": "text",
-            "content": {"text": f"师傅出错啦！\n{log_entry}\n"},
-        }
+        key = getattr(record, "alert_key", None) or (
+            record.name,
+            record.levelno,
+            record.getMessage(),
+        )
+        now = self.clock()
+        self.received += 1
+        if key in self._pending:
+            self._pending[key][1] += 1
+            self.deduplicated += 1
+            return
+        if now - self._sent_at.get(key, float("-inf")) < self.dedup_window:
+            self.deduplicated += 1
+            self._unreported_duplicates += 1
+            return
+        if len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+            self.count_dropped()
+        self._pending[key] = [self.format(record), 1]
+        if self._digest_started is None:
+            self._digest_started = now
+
+    def count_dropped(self, count: int = 1) -> None:
+        self.dropped += count
+        self._unreported_drops += count
+
+    def flush(self, force: bool = False):
+        """
+        Send the pending errors if the digest is due and the rate limit allows
+        """
+        if not self._pending:
+            return
+        now = self.clock()
+        if not force and now - self._digest_started < self.digest_interval:
+            return
+        while self._send_times and now - self._send_times[0] >= 60:
+            self._send_times.popleft()
+        if not force and len(self._send_times) >= self.rate_limit:
+            return
+        self._send_times.append(now)
+        self._post(self._digest(now))
+        self._digest_started = now if self._pending else None
+        # forget errors older than the window
+        for key in [
+            k for k, t in self._sent_at.items() if now - t >= self.dedup_window
+        ]:
+            del self._sent_at[key]
+
+    def _digest(self, now: float) -> str:
+        lines = ["师傅出错啦！"]
+        size = len(lines[0])
+        while self._pending:
+            key, (entry, count) = next(iter(self._pending.items()))
+            if count > 1:
+                entry = f"{entry}\n(重复 {count} 次)"
+            if len(lines) > 1 and size + len(entry) > self.max_chars:
+                # the rest goes with the next message
+                break
+            lines.append(entry[: self.max_chars])
+            size += len(entry)
+            del self._pending[key]
+            self._sent_at[key] = now
+        if self._unreported_duplicates or self._unreported_drops:
+            lines.append(
+                f"另有 {self._unreported_duplicates} 条重复错误未发送，"
+                f"{self._unreported_drops} 条错误被丢弃"
+            )
+            self._unreported_duplicates = 0
+            self._unreported_drops = 0
+        return "\n\n".join(lines)
+
+    def _post(self, text: str) -> None:
+        payload = {"msg_type": "text", "content": {"text": text}}
         try:
-            response = requests.post(self.webhook_url, json=payload)
+            response = requests.post(self.webhook_url, json=payload, timeout=5)
             response.raise_for_status()
+            self.messages += 1
         except requests.exceptions.RequestException as e:
-            from flask import current_app
+            # not logged, the error would come back to this handler
+            self.failed += 1
+            sys.stderr.write(f"Failed to send log to Feishu: {e}\n")
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "messages": self.messages,
+            "failed": self.failed,
+            "pending": len(self._pending),
+        }
+
+
+class _AlertQueue(queue.Queue):
+    # the listener calls task_done for ticks too, nobody joins this queue
+    def task_done(self):
+        pass
+
+
+_TICK = object()
+
+
+class _AlertListener(QueueListener):
+    """
+    Feeds queued records to the handlers, and lets them flush once per tick
+    when no records arrive
+    """
+
+    def __init__(self, queue, handler, tick: float = 1.0):
+        super().__init__(queue, handler)
+        self.tick = tick
+
+    def dequeue(self, block):
+        try:
+            return self.queue.get(timeout=self.tick)
+        except queue.Empty:
+            return _TICK
+
+    def handle(self, record):
+        if record is not _TICK:
+            super().handle(record)
+        for handler in self.handlers:
+            handler.flush()
+
+
+class FeishuQueueHandler(QueueHandler):
+    """
+    Hands error records to a FeishuLogHandler on a listener thread. The
+    record is formatted on the logging thread, the queue is bounded and a
+    record that does not fit is dropped and counted instead of blocking.
+    """
+
+    def __init__(self, handler: FeishuLogHandler, maxsize: int = 1000):
+        super().__init__(_AlertQueue(maxsize=maxsize))
+        self.setLevel(logging.ERROR)
+        self.feishu_handler = handler
+        self.maxsize = maxsize
+        self._listener: Optional[_AlertListener] = None
+        self._listener_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def prepare(self, record):
+        key = (record.name, record.levelno, record.getMessage())
+        record = super().prepare(record)
+        record.alert_key = key
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _ensure_listener(self) -> None:
+        # keyed by pid so forked workers start their own listener
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            if self._listener_pid is not None:
+                self.queue = _AlertQueue(maxsize=self.maxsize)
+            else:
+                atexit.register(self.stop)
+            self._listener_pid = os.getpid()
+            self._listener = _AlertListener(self.queue, self.feishu_handler)
+            self._listener.start()
+
+    def stop(self) -> None:
+        """
+        Send what is pending, called at exit
+        """
+        if self._listener is not None and self._listener_pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+        self.feishu_handler.flush(force=True)
+
+    def stats(self) -> dict:
+        stats = self.feishu_handler.stats()
+        stats["queue_dropped"] = self.dropped
+        stats["dropped"] += self.dropped
+        stats["depth"] = self.queue.qsize()
+        return stats
+
+
+_feishu_queue_handler: Optional[FeishuQueueHandler] = None
+
 
-            current_app.logger.error(f"Failed to send log to Feishu: {e}")
+def get_feishu_log_stats() -> dict:
+    """
+    Counters of the Feishu error alerts of this process
+    """
+    if _feishu_queue_handler is None:
+        return {"enabled": False}
+    return {"enabled": True, **_feishu_queue_handler.stats()}
 
 
 class ColoredRequestFormatter(RequestFormatter, colorlog.ColoredFormatter):
@@ -176,9 +409,19 @@ def init_log(app: Flask) -> Flask:
     feishu_webhook_url = get_config("FEISHU_LOG_WEBHOOK_URL", None)
     if feishu_webhook_url:
         app.logger.info("Feishu enabled.")
-        feishu_handler = FeishuLogHandler(feishu_webhook_url)
+        global _feishu_queue_handler
+        feishu_handler = FeishuQueueHandler(
+            FeishuLogHandler(
+                feishu_webhook_url,
+                digest_interval=int(get_config("FEISHU_LOG_DIGEST_SECONDS")),
+                dedup_window=int(get_config("FEISHU_LOG_DEDUP_SECONDS")),
+                rate_limit=int(get_config("FEISHU_LOG_RATE_LIMIT_PER_MINUTE")),
+            ),
+            maxsize=int(get_config("FEISHU_LOG_QUEUE_SIZE")),
+        )
         feishu_handler.setFormatter(formatter)
         app.logger.addHandler(feishu_handler)
+        _feishu_queue_handler = feishu_handler
     else:
         app.logger.info("Feishu disabled.")
     app.logger.setLevel(logging.INFO)
@@ -0,0 +1,265 @@
+"""
+In-process cache
+
+This module contains a small thread-safe LRU cache that lives inside the
+worker process, and an invalidation bus that broadcasts evictions to every
+worker over Redis pub/sub.
+
+usage:
+    cache = get_cache("shifu_struct", maxsize=256)
+    subscribe_invalidation("shifu_struct", lambda key: ...)
+    invalidate_on_commit(app, "shifu_struct", shifu_bid)
+
+Invalidations registered with invalidate_on_commit are only published after
+the current database transaction commits, so other workers never re-read the
+old rows and put them back into the cache.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with optional ttl
+    """
+
+    def __init__(self, name: str, maxsize: int = 256, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expire_at = entry
+            if expire_at is not None and expire_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = ttl if ttl is not None else self.ttl
+        expire_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        with self._lock:
+            if self._data.pop(key, _MISSING) is _MISSING:
+                return False
+            self.invalidations += 1
+            return True
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]) -> int:
+        """
+        Delete all keys matching the predicate
+        Returns:
+            int: number of deleted keys
+        """
+        with self._lock:
+            keys = [k for k in self._data.keys() if predicate(k)]
+            for k in keys:
+                del self._data[k]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.invalidations += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_caches: dict[str, LRUCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, maxsize: int = 256, ttl: Optional[float] = None) -> LRUCache:
+    """
+    Get or create a named process-local cache
+    Args:
+        name: Cache name, also used in stats
+        maxsize: Max entries kept before the least recently used is evicted
+        ttl: Optional ttl in seconds
+    Returns:
+        LRUCache: the cache
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = LRUCache(name, maxsize=maxsize, ttl=ttl)
+            _caches[name] = cache
+        return cache
+
+
+def get_cache_stats() -> list[dict]:
+    """
+    Get stats of all process-local caches
+    """
+    with _caches_lock:
+        caches = list(_caches.values())
+    return [cache.stats() for cache in caches]
+
+
+# invalidation bus
+_handlers: dict[str, list[Callable[[Optional[str]], None]]] = {}
+_origin = uuid.uuid4().hex
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+
+
+def _get_origin() -> str:
+    # forked workers share the module state, so the pid tells them apart
+    return f"{_origin}:{os.getpid()}"
+
+
+def _get_channel(app: Flask) -> str:
+    return (app.config.get("REDIS_KEY_PREFIX") or "") + "cache:invalidate"
+
+
+def _dispatch(topic: str, key: Optional[str]) -> None:
+    for handler in _handlers.get(topic, []):
+        try:
+            handler(key)
+        except Exception:
+            pass
+
+
+def _dispatch_all() -> None:
+    # key None means the whole topic is stale
+    for topic in list(_handlers.keys()):
+        _dispatch(topic, None)
+
+
+def subscribe_invalidation(topic: str, handler: Callable[[Optional[str]], None]):
+    """
+    Register a handler called with the invalidated key,
+    or None when everything under the topic must be dropped
+    """
+    _handlers.setdefault(topic, []).append(handler)
+
+
+def _listen(app: Flask) -> None:
+    from flaskr import dao
+
+    channel = _get_channel(app)
+    while True:
+        try:
+            pubsub = dao.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            # messages may have been missed while (re)connecting
+            _dispatch_all()
+            for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                data = json.loads(message["data"])
+                if data.get("origin") == _get_origin():
+                    continue
+                _dispatch(data.get("topic"), data.get("key"))
+        except Exception as e:
+            app.logger.warning(f"cache invalidation listener error: {e}")
+            time.sleep(1)
+
+
+def ensure_invalidation_listener(app: Flask) -> None:
+    """
+    Start the pub/sub listener for this process if it is not running.
+    It is keyed by pid so forked workers start their own listener.
+    """
+    global _listener_pid
+    from flaskr import dao
+
+    if _listener_pid == os.getpid() or getattr(dao, "redis_client", None) is None:
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener_pid = os.getpid()
+        thread = threading.Thread(
+            target=_listen, args=(app,), name="cache-invalidation", daemon=True
+        )
+        thread.start()
+
+
+def publish_invalidation(app: Flask, topic: str, key: Optional[str]) -> None:
+    """
+    Invalidate a key in this process and broadcast it to other processes
+    """
+    from flaskr import dao
+
+    _dispatch(topic, key)
+    if getattr(dao, "redis_client", None) is None:
+        return
+    try:
+        dao.redis_client.publish(
+            _get_channel(app),
+            json.dumps({"topic": topic, "key": key, "origin": _get_origin()}),
+        )
+    except Exception as e:
+        app.logger.warning(f"publish cache invalidation failed: {topic} {key} {e}")
+
+
+def invalidate_on_commit(app: Flask, topic: str, key: Optional[str]) -> None:
+    """
+    Publish the invalidation once the current transaction commits
+    """
+    from flaskr.dao import db
+
+    pending = db.session.info.setdefault("cache_invalidations", [])
+    pending.append((app, topic, key))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending_invalidations(session: Session):
+    pending = session.info.pop("cache_invalidations", None)
+    if not pending:
+        return
+    for app, topic, key in dict.fromkeys(pending):
+        publish_invalidation(app, topic, key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending_invalidations(session: Session):
+    session.info.pop("cache_invalidations", None)
@@ -0,0 +1,503 @@
+"""
+Background jobs
+
+Side work the response does not wait for, e.g. the summary generation after
+a publish or the CDN warm-up after an upload, is queued as a job and run by
+worker threads:
+
+- jobs are kept in Redis, a job taken by a worker is leased and queued again
+  when the worker dies before the lease expires
+- a failing job is retried with exponential backoff up to max_attempts
+- a job enqueued with an idempotency key is created once, enqueueing the
+  same key again returns the existing job
+- without Redis, or with JOB_BACKEND=memory, jobs are kept in process memory
+
+usage:
+    @job_handler("shifu.summary")
+    def generate_summary(app, shifu_id):
+        ...
+
+    job_id = enqueue_job(app, "shifu.summary", {"shifu_id": ...}, key=...)
+
+Every process that enqueues jobs runs JOB_WORKER_THREADS workers, set it to
+0 to leave the jobs to `flask console jobs_worker` processes.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Optional
+
+from flask import Flask
+
+from flaskr.common.config import get_config
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_RETRYING = "retrying"
+JOB_STATUS_SUCCEEDED = "succeeded"
+JOB_STATUS_FAILED = "failed"
+
+# upper bound of the backoff between two attempts
+MAX_BACKOFF_SECONDS = 300
+
+
+class JobHandler:
+    def __init__(self, name: str, func: Callable, max_attempts: Optional[int]):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+
+
+_handlers: dict[str, JobHandler] = {}
+
+
+def job_handler(name: str, max_attempts: Optional[int] = None):
+    """
+    Register a function as the handler of a job, it is called with the app
+    and the payload of the job as keyword arguments
+    Args:
+        name: Job name
+        max_attempts: Attempts before the job fails, JOB_MAX_ATTEMPTS if None
+    """
+
+    def decorator(func: Callable) -> Callable:
+        _handlers[name] = JobHandler(name, func, max_attempts)
+        return func
+
+    return decorator
+
+
+class MemoryJobBackend:
+    """
+    Jobs in process memory, for tests and setups without Redis
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._jobs: dict[str, dict] = {}
+        self._keys: dict[str, str] = {}
+        self._ready: deque = deque()
+        self._delayed: list[tuple[float, str]] = []
+        self._running: set[str] = set()
+        # finished jobs by finish time, dropped after the ttl
+        self._finished: deque = deque()
+
+    def create(self, job: dict, ttl: int) -> tuple[dict, bool]:
+        with self._cond:
+            key = job.get("key")
+            if key and self._keys.get(key) in self._jobs:
+                return self._jobs[self._keys[key]], False
+            if key:
+                self._keys[key] = job["job_id"]
+            self._jobs[job["job_id"]] = job
+            self._ready.append(job["job_id"])
+            self._cond.notify()
+            return job, True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def get_by_key(self, key: str) -> Optional[dict]:
+        with self._cond:
+            return self.get(self._keys.get(key, ""))
+
+    def take(self, timeout: float, lease: int) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._ready.append(heapq.heappop(self._delayed)[1])
+                if self._ready:
+                    job = self._jobs[self._ready.popleft()]
+                    self._running.add(job["job_id"])
+                    return dict(job)
+                wait = deadline - time.monotonic()
+                if self._delayed:
+                    wait = min(wait, self._delayed[0][0] - now)
+                if wait <= 0:
+                    return None
+                self._cond.wait(wait)
+
+    def save(self, job: dict, ttl: int) -> None:
+        with self._cond:
+            self._jobs[job["job_id"]] = dict(job)
+            if job["status"] in (JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED):
+                self._running.discard(job["job_id"])
+                self._finished.append((job["updated_at"], job["job_id"]))
+                while self._finished and self._finished[0][0] < time.time() - ttl:
+                    expired = self._jobs.pop(self._finished.popleft()[1], None)
+                    if expired and expired.get("key"):
+                        self._keys.pop(expired["key"], None)
+            elif job["status"] == JOB_STATUS_RETRYING:
+                self._running.discard(job["job_id"])
+                heapq.heappush(self._delayed, (job["run_at"], job["job_id"]))
+                self._cond.notify()
+
+    def renew(self, job_ids: list[str], lease: int) -> None:
+        pass
+
+    def depth(self) -> dict:
+        with self._cond:
+            return {
+                "ready": len(self._ready),
+                "delayed": len(self._delayed),
+                "running": len(self._running),
+            }
+
+
+# moves due retries and jobs of expired leases to the ready list,
+# then leases the next ready job
+_TAKE_SCRIPT = """
+for _, key in ipairs({KEYS[2], KEYS[3]}) do
+    local due = redis.call('ZRANGEBYSCORE', key, '-inf', ARGV[1], 'LIMIT', 0, 100)
+    for _, id in ipairs(due) do
+        redis.call('ZREM', key, id)
+        redis.call('LPUSH', KEYS[1], id)
+    end
+end
+local id = redis.call('RPOP', KEYS[1])
+if id then
+    redis.call('ZADD', KEYS[3], ARGV[2], id)
+end
+return id
+"""
+
+
+class RedisJobBackend:
+    """
+    Jobs in Redis, shared by all processes:
+    job:<id> the job as JSON, job_key:<key> the id of the job of a key,
+    jobs:ready the ids to run, jobs:delayed the ids to retry by due time,
+    jobs:leases the ids taken by workers by lease deadline
+    """
+
+    def __init__(self, redis, prefix: str):
+        self.redis = redis
+        self.prefix = prefix
+        self.ready_key = prefix + "jobs:ready"
+        self.delayed_key = prefix + "jobs:delayed"
+        self.leases_key = prefix + "jobs:leases"
+        self._take = redis.register_script(_TAKE_SCRIPT)
+
+    def _job_key(self, job_id: str) -> str:
+        return self.prefix + "job:" + job_id
+
+    def create(self, job: dict, ttl: int) -> tuple[dict, bool]:
+        job_key = self._job_key(job["job_id"])
+        self.redis.set(job_key, json.dumps(job), ex=ttl)
+        key = job.get("key")
+        if key:
+            # the job is written first, a taken key always has its job
+            name = self.prefix + "job_key:" + key
+            if not self.redis.set(name, job["job_id"], nx=True, ex=ttl):
+                existing = self.get_by_key(key)
+                if existing:
+                    self.redis.delete(job_key)
+                    return existing, False
+                # the job of the key expired
+                self.redis.set(name, job["job_id"], ex=ttl)
+        self.redis.lpush(self.ready_key, job["job_id"])
+        return job, True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        value = self.redis.get(self._job_key(job_id))
+        return json.loads(value) if value else None
+
+    def get_by_key(self, key: str) -> Optional[dict]:
+        job_id = self.redis.get(self.prefix + "job_key:" + key)
+        if not job_id:
+            return None
+        return self.get(job_id.decode() if isinstance(job_id, bytes) else job_id)
+
+    def take(self, timeout: float, lease: int) -> Optional[dict]:
+        now = time.time()
+        job_id = self._take(
+            keys=[self.ready_key, self.delayed_key, self.leases_key],
+            args=[now, now + lease],
+        )
+        if not job_id:
+            time.sleep(timeout)
+            return None
+        job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+        job = self.get(job_id)
+        if job is None:
+            # expired meanwhile
+            self.redis.zrem(self.leases_key, job_id)
+        return job
+
+    def save(self, job: dict, ttl: int) -> None:
+        job_id = job["job_id"]
+        self.redis.set(self._job_key(job_id), json.dumps(job), ex=ttl)
+        if job["status"] in (JOB_STATUS_SUCCEEDED, JOB_STATUS_FAILED):
+            self.redis.zrem(self.leases_key, job_id)
+        elif job["status"] == JOB_STATUS_RETRYING:
+            pipe = self.redis.pipeline()
+            pipe.zrem(self.leases_key, job_id)
+            pipe.zadd(self.delayed_key, {job_id: job["run_at"]})
+            pipe.execute()
+
+    def renew(self, job_ids: list[str], lease: int) -> None:
+        if job_ids:
+            deadline = time.time() + lease
+            self.redis.zadd(
+                self.leases_key, {job_id: deadline for job_id in job_ids}, xx=True
+            )
+
+    def depth(self) -> dict:
+        return {
+            "ready": self.redis.llen(self.ready_key),
+            "delayed": self.redis.zcard(self.delayed_key),
+            "running": self.redis.zcard(self.leases_key),
+        }
+
+
+class JobQueue:
+    """
+    Enqueues jobs into a backend and runs them with worker threads
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.worker_threads = int(get_config("JOB_WORKER_THREADS"))
+        self.max_attempts = int(get_config("JOB_MAX_ATTEMPTS"))
+        self.backoff = int(get_config("JOB_RETRY_BACKOFF_SECONDS"))
+        self.lease = int(get_config("JOB_LEASE_SECONDS"))
+        self.ttl = int(get_config("JOB_RESULT_TTL_SECONDS"))
+        self.poll_interval = 1.0
+        self._app: Optional[Flask] = None
+        self._workers_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # jobs run by the workers of this process, their leases are renewed
+        self._running: set[str] = set()
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+
+    def enqueue(
+        self,
+        app: Flask,
+        name: str,
+        payload: dict = None,
+        key: Optional[str] = None,
+        user_bid: Optional[str] = None,
+    ) -> str:
+        """
+        Queue a job
+        Args:
+            name: Job name, a registered handler
+            payload: Keyword arguments of the handler, JSON serializable
+            key: Idempotency key, a job is created once per key
+            user_bid: The user allowed to read the job status
+        Returns:
+            str: job id
+        """
+        handler = _handlers.get(name)
+        if handler is None:
+            raise ValueError(f"no handler for job {name}")
+        now = time.time()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "name": name,
+            "payload": payload or {},
+            "key": key,
+            "user_bid": user_bid,
+            "status": JOB_STATUS_QUEUED,
+            "attempts": 0,
+            "max_attempts": handler.max_attempts or self.max_attempts,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "run_at": now,
+        }
+        job, created = self.backend.create(job, self.ttl)
+        with self._lock:
+            if created:
+                self.enqueued += 1
+            else:
+                self.deduplicated += 1
+        if self.worker_threads > 0:
+            self.start_workers(app, self.worker_threads)
+        return job["job_id"]
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self.backend.get(job_id)
+
+    def run_next(self, app: Flask, timeout: float = 0) -> bool:
+        """
+        Take and run one job
+        Returns:
+            bool: False if no job was ready within the timeout
+        """
+        job = self.backend.take(timeout, self.lease)
+        if job is None:
+            return False
+        job["attempts"] += 1
+        job["status"] = JOB_STATUS_RUNNING
+        job["updated_at"] = time.time()
+        self.backend.save(job, self.ttl)
+        with self._lock:
+            self._running.add(job["job_id"])
+        try:
+            handler = _handlers.get(job["name"])
+            if handler is None:
+                raise ValueError(f"no handler for job {job['name']}")
+            with app.app_context():
+                handler.func(app, **job["payload"])
+            job["status"] = JOB_STATUS_SUCCEEDED
+            job["error"] = None
+            counter = "succeeded"
+        except Exception as e:
+            job["error"] = str(e)
+            if job["attempts"] < job["max_attempts"]:
+                delay = min(
+                    self.backoff * 2 ** (job["attempts"] - 1), MAX_BACKOFF_SECONDS
+                )
+                job["status"] = JOB_STATUS_RETRYING
+                job["run_at"] = time.time() + delay
+                counter = "retried"
+                app.logger.warning(
+                    f"job {job['name']} {job['job_id']} attempt {job['attempts']} "
+                    f"failed, retry in {delay}s: {e}"
+                )
+            else:
+                job["status"] = JOB_STATUS_FAILED
+                counter = "failed"
+                app.logger.error(
+                    f"job {job['name']} {job['job_id']} failed after "
+                    f"{job['attempts']} attempts: {e}",
+                    exc_info=True,
+                )
+        job["updated_at"] = time.time()
+        with self._lock:
+            self._running.discard(job["job_id"])
+            setattr(self, counter, getattr(self, counter) + 1)
+        self.backend.save(job, self.ttl)
+        return True
+
+    def start_workers(self, app: Flask, threads: int) -> None:
+        """
+        Start the worker threads and the lease renewal of this process once
+        """
+        # keyed by pid so forked workers start their own threads
+        if self._workers_pid == os.getpid():
+            return
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self._app = app
+            self._running = set()
+            for i in range(threads):
+                threading.Thread(
+                    target=self._work, name=f"job-worker-{i}", daemon=True
+                ).start()
+            threading.Thread(
+                target=self._renew_leases, name="job-leases", daemon=True
+            ).start()
+
+    def _work(self) -> None:
+        while True:
+            try:
+                self.run_next(self._app, self.poll_interval)
+            except Exception as e:
+                # e.g. Redis unreachable, the job stays leased and is retried
+                self._app.logger.error(f"job worker error: {e}")
+                time.sleep(self.poll_interval)
+
+    def _renew_leases(self) -> None:
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                job_ids = list(self._running)
+            try:
+                self.backend.renew(job_ids, self.lease)
+            except Exception as e:
+                self._app.logger.warning(f"job lease renewal failed: {e}")
+
+    def stats(self) -> dict:
+        try:
+            depth = self.backend.depth()
+        except Exception:
+            depth = {}
+        return {
+            "backend": type(self.backend).__name__,
+            "workers": self.worker_threads if self._workers_pid else 0,
+            **depth,
+            "enqueued": self.enqueued,
+            "deduplicated": self.deduplicated,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue(app: Flask) -> JobQueue:
+    """
+    Get the job queue of the process, in Redis unless JOB_BACKEND is memory
+    or Redis is not configured
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                from flaskr import dao
+
+                redis = getattr(dao, "redis_client", None)
+                if get_config("JOB_BACKEND") == "memory" or redis is None:
+                    backend = MemoryJobBackend()
+                else:
+                    backend = RedisJobBackend(
+                        redis, (app.config.get("REDIS_KEY_PREFIX") or "")
+                    )
+                _job_queue = JobQueue(backend)
+    return _job_queue
+
+
+def enqueue_job(
+    app: Flask,
+    name: str,
+    payload: dict = None,
+    key: Optional[str] = None,
+    user_bid: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Queue a job, see JobQueue.enqueue
+    Side work must not fail the request that queues it, so backend errors
+    are logged and None is returned
+    """
+    job_queue = get_job_queue(app)
+    try:
+        return job_queue.enqueue(app, name, payload, key, user_bid)
+    except Exception as e:
+        if name not in _handlers:
+            raise
+        app.logger.error(f"failed to enqueue job {name}: {e}", exc_info=True)
+        return None
+
+
+def get_job(app: Flask, job_id: str) -> Optional[dict]:
+    """
+    Get a job by id, None if unknown or expired
+    """
+    return get_job_queue(app).get(job_id)
+
+
+def get_job_stats(app: Flask) -> dict:
+    """
+    Get stats of the job queue of this process
+    """
+    return get_job_queue(app).stats()
@@ -0,0 +1,218 @@
+"""
+Write-behind queue
+
+Rows that nobody reads back on the request path, e.g. audit logs, are put
+into an in-process queue and inserted by a background thread in batches,
+one bulk INSERT every batch_size rows or flush_interval seconds.
+
+usage:
+    queue = get_write_behind_queue("risk_control_result", RiskControlResult)
+    queue.put(app, {"chat_id": ..., ...})
+
+The queue is bounded, rows put into a full queue are dropped and counted.
+Pending rows are flushed when the process exits.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from flask import Flask
+
+from flaskr.common.config import get_config
+
+
+class WriteBehindQueue:
+    """
+    Bounded queue of rows of one model, written by a daemon thread
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        maxsize: int = 10000,
+    ):
+        self.name = name
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.maxsize = maxsize
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._app: Optional[Flask] = None
+        self._thread_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # rows taken from the queue by the writer for its next batch
+        self._pending: list[dict] = []
+        # serializes batches of the writer thread and explicit flushes
+        self._write_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+    def put(self, app: Flask, row: dict) -> bool:
+        """
+        Queue a row for insert
+        Returns:
+            bool: False if the queue is full and the row was dropped
+        """
+        self._app = app
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            app.logger.warning(f"write behind queue {self.name} full, row dropped")
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def _ensure_writer(self) -> None:
+        # keyed by pid so forked workers start their own writer
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            if self._thread_pid is not None:
+                # rows inherited from the parent are written by the parent
+                self._queue = queue.Queue(maxsize=self.maxsize)
+                self._pending = []
+            self._thread_pid = os.getpid()
+            thread = threading.Thread(
+                target=self._run, name=f"write-behind-{self.name}", daemon=True
+            )
+            thread.start()
+
+    def _hold(self, row: dict) -> int:
+        with self._lock:
+            self._pending.append(row)
+            return len(self._pending)
+
+    def _run(self) -> None:
+        while True:
+            # wait for the first row, then give the batch flush_interval to fill
+            held = self._hold(self._queue.get())
+            deadline = time.monotonic() + self.flush_interval
+            while held < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    held = self._hold(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write_pending()
+
+    def _write_pending(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            self._write(rows)
+
+    def _write(self, rows: list[dict]) -> None:
+        if not rows:
+            return
+        from flaskr.dao import db
+
+        app = self._app
+        try:
+            with app.app_context():
+                db.session.execute(self.model.__table__.insert(), rows)
+                db.session.commit()
+            with self._lock:
+                self.written += len(rows)
+                self.batches += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += len(rows)
+            app.logger.error(
+                f"write behind queue {self.name} failed to insert {len(rows)} rows: {e}"
+            )
+
+    def flush(self) -> None:
+        """
+        Write the rows held by the writer and all queued rows now,
+        in the calling thread
+        """
+        self._write_pending()
+        while True:
+            rows = []
+            try:
+                while len(rows) < self.batch_size:
+                    rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not rows:
+                return
+            with self._write_lock:
+                self._write(rows)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "depth": self._queue.qsize() + len(self._pending),
+            "maxsize": self.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+_queues: dict[str, WriteBehindQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_behind_queue(name: str, model) -> WriteBehindQueue:
+    """
+    Get or create a named write-behind queue, sized by the WRITE_BEHIND_* config
+    Args:
+        name: Queue name, also used in stats
+        model: Model class of the rows
+    Returns:
+        WriteBehindQueue: the queue
+    """
+    with _queues_lock:
+        write_queue = _queues.get(name)
+        if write_queue is None:
+            write_queue = WriteBehindQueue(
+                name,
+                model,
+                batch_size=int(get_config("WRITE_BEHIND_BATCH_SIZE")),
+                flush_interval=int(get_config("WRITE_BEHIND_FLUSH_INTERVAL_MS")) / 1000,
+                maxsize=int(get_config("WRITE_BEHIND_QUEUE_SIZE")),
+            )
+            _queues[name] = write_queue
+        return write_queue
+
+
+def get_write_behind_stats() -> list[dict]:
+    """
+    Get stats of all write-behind queues of this process
+    """
+    with _queues_lock:
+        queues = list(_queues.values())
+    return [write_queue.stats() for write_queue in queues]
+
+
+@atexit.register
+def flush_write_behind_queues() -> None:
+    """
+    Write the rows still queued, called when the process exits
+    """
+    with _queues_lock:
+        queues = list(_queues.values())
+    for write_queue in queues:
+        if write_queue._app is not None and write_queue._thread_pid == os.getpid():
+            write_queue.flush()
@@ -4,3 +4,5 @@ TEXT_NOT_ALLOWED = "Please check the input content"
 NICKNAME_NOT_ALLOWED = "Oops, illegal nickname."
 BACKGROUND_NOT_ALLOWED = "Oops, illegal background."
 START_TIME_NOT_ALLOWED = "Start time cannot be later than end time"
+JOB_NOT_FOUND = "Job not found"
+NO_PERMISSION = "No permission"
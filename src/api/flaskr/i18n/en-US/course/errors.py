@@ -3,3 +3,4 @@ LESSON_CANNOT_BE_RESET = "Lesson cannot be reset"
 LESSON_NOT_FOUND = "Lesson not found"
 LESSON_NOT_FOUND_IN_COURSE = "Lesson not found in course"
 COURSE_NOT_PURCHASED = "Course not purchased, please purchase the course first"
+RUN_QUEUE_FULL = "Too many requests are waiting, please try again later"
@@ -4,3 +4,5 @@ TEXT_NOT_ALLOWED = "请检查输入内容"
 NICKNAME_NOT_ALLOWED = "你输入的是不合规的昵称哦。"
 BACKGROUND_NOT_ALLOWED = "你输入的是不合规的背景哦。"
 START_TIME_NOT_ALLOWED = "开始时间不能晚于结束时间"
+JOB_NOT_FOUND = "任务不存在"
+NO_PERMISSION = "没有权限"
@@ -3,3 +3,4 @@ LESSON_CANNOT_BE_RESET = "课程不能重置"
 LESSON_NOT_FOUND = "没有找到课程"
 LESSON_NOT_FOUND_IN_COURSE = "没有找到课程"
 COURSE_NOT_PURCHASED = "课程未购买,请先购买课程"
+RUN_QUEUE_FULL = "等待中的请求过多，请稍后再试"
@@ -6,6 +6,8 @@ from .dicts import register_dict_handler
 from .order import register_order_handler
 from .callback import register_callback_handler
 from .test import register_test_routes
+from .monitor import register_monitor_handler
+from .job import register_job_handler
 
 
 def register_route(app):
@@ -18,4 +20,6 @@ def register_route(app):
     app = register_order_handler(app, prefix + "/order")
     app = register_callback_handler(app, prefix + "/callback")
     app = register_test_routes(app, prefix + "/test")
+    app = register_monitor_handler(app, prefix + "/monitor")
+    app = register_job_handler(app, prefix + "/job")
     return app
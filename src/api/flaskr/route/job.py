@@ -0,0 +1,45 @@
+from flask import Flask, request
+
+from .common import make_common_response
+from ..dao.jobs import get_job
+from ..service.common.models import raise_error
+
+
+def register_job_handler(app: Flask, path_prefix: str) -> Flask:
+    @app.route(path_prefix + "/<job_id>", methods=["GET"])
+    def get_job_api(job_id: str):
+        """
+        获取后台任务状态
+        ---
+        tags:
+          - 任务
+        parameters:
+          - name: job_id
+            in: path
+            type: string
+            required: true
+        responses:
+            200:
+                description: name, status (queued, running, retrying, succeeded, failed), attempts and last error of the job
+        """
+        job = get_job(app, job_id)
+        if not job or job.get("user_bid") not in (None, request.user.user_id):
+            raise_error("COMMON.JOB_NOT_FOUND")
+        return make_common_response(
+            {
+                key: job[key]
+                for key in (
+                    "job_id",
+                    "name",
+                    "status",
+                    "attempts",
+                    "max_attempts",
+                    "error",
+                    "created_at",
+                    "updated_at",
+                    "run_at",
+                )
+            }
+        )
+
+    return app
@@ -0,0 +1,115 @@
+from functools import wraps
+
+from flask import Flask, request
+
+from .common import make_common_response
+from ..service.common.models import raise_error
+from ..dao.cache import get_cache_stats
+from ..dao.write_behind import get_write_behind_stats
+from ..api.llm.router import get_router
+from ..api.llm.accounting import get_trace_exporter
+from ..common.log import get_feishu_log_stats
+from ..dao.jobs import get_job_stats
+
+
+def admin_required(func):
+    """
+    The stats expose internals of the service, only admins may read them
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        user = getattr(request, "user", None)
+        if not user or not user.is_admin:
+            raise_error("COMMON.NO_PERMISSION")
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def register_monitor_handler(app: Flask, path_prefix: str) -> Flask:
+    @app.route(path_prefix + "/cache-stats", methods=["GET"])
+    @admin_required
+    def get_cache_stats_api():
+        """
+        获取当前进程的缓存统计
+        ---
+        tags:
+          - 监控
+        responses:
+            200:
+                description: size, hits, misses, evictions of each in-process cache
+        """
+        return make_common_response(get_cache_stats())
+
+    @app.route(path_prefix + "/write-behind-stats", methods=["GET"])
+    @admin_required
+    def get_write_behind_stats_api():
+        """
+        获取当前进程的异步批量写入队列统计
+        ---
+        tags:
+          - 监控
+        responses:
+            200:
+                description: queue depth, written, dropped and failed rows of each write-behind queue
+        """
+        return make_common_response(get_write_behind_stats())
+
+    @app.route(path_prefix + "/llm-router-stats", methods=["GET"])
+    @admin_required
+    def get_llm_router_stats_api():
+        """
+        获取当前进程的 LLM 服务商健康状态
+        ---
+        tags:
+          - 监控
+        responses:
+            200:
+                description: circuit state, EWMA time to first token, requests and errors of each provider and model
+        """
+        return make_common_response(get_router().stats())
+
+    @app.route(path_prefix + "/trace-exporter-stats", methods=["GET"])
+    @admin_required
+    def get_trace_exporter_stats_api():
+        """
+        获取当前进程的 Langfuse 后台导出队列统计
+        ---
+        tags:
+          - 监控
+        responses:
+            200:
+                description: depth, submitted, exported, dropped and failed generations of the exporter
+        """
+        return make_common_response(get_trace_exporter().stats())
+
+    @app.route(path_prefix + "/log-alert-stats", methods=["GET"])
+    @admin_required
+    def get_log_alert_stats_api():
+        """
+        获取当前进程的飞书错误告警统计
+        ---
+        tags:
+          - 监控
+        responses:
+            200:
+                description: received, deduplicated, dropped and sent error logs of the Feishu alerts
+        """
+        return make_common_response(get_feishu_log_stats())
+
+    @app.route(path_prefix + "/job-stats", methods=["GET"])
+    @admin_required
+    def get_job_stats_api():
+        """
+        获取后台任务队列统计
+        ---
+        tags:
+          - 监控
+        responses:
+            200:
+                description: ready, delayed and running jobs of the backend, enqueued, succeeded, retried and failed jobs of this process
+        """
+        return make_common_response(get_job_stats(app))
+
+    return app
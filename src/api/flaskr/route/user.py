@@ -9,6 +9,7 @@ from flaskr.service.profile.funcs import (
 )
 from ..service.user import (
     validate_user,
+    revoke_token,
     update_user_info,
     generate_temp_user,
     generation_img_chk,
@@ -30,17 +31,21 @@ from flaskr.i18n import set_language
 thread_local = threading.local()
 
 
+def get_request_token():
+    token = request.cookies.get("token", None)
+    if not token:
+        token = request.args.get("token", None)
+    if not token:
+        token = request.headers.get("Token", None)
+    if not token and request.method.upper() == "POST" and request.is_json:
+        token = request.get_json().get("token", None)
+    return token
+
+
 def optional_token_validation(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        token = request.cookies.get("token", None)
-        if not token:
-            token = request.args.get("token", None)
-        if not token:
-            token = request.headers.get("Token", None)
-        if not token and request.method.upper() == "POST" and request.is_json:
-            token = request.get_json().get("token", None)
-
+        token = get_request_token()
         if token:
             token = str(token)
             user = validate_user(current_app, token)
@@ -65,14 +70,7 @@ def register_user_handler(app: Flask, path_prefix: str) -> Flask:
         ):
             return
 
-        token = request.cookies.get("token", None)
-        if not token:
-            token = request.args.get("token", None)
-        if not token:
-            token = request.headers.get("Token", None)
-        if not token and request.method.upper() == "POST" and request.is_json:
-            token = request.get_json().get("token", None)
-        token = str(token)
+        token = str(get_request_token())
         if not token and request.endpoint in by_pass_login_func:
             return
         user = validate_user(app, token)
@@ -104,6 +102,30 @@ def register_user_handler(app: Flask, path_prefix: str) -> Flask:
         """
         return make_common_response(request.user)
 
+    @app.route(path_prefix + "/logout", methods=["POST"])
+    def logout():
+        """
+        logout, the token can not be used anymore
+        ---
+        tags:
+            - user
+        responses:
+            200:
+                description: logout success
+                content:
+                    application/json:
+                        schema:
+                            properties:
+                                code:
+                                    type: integer
+                                    description: return code
+                                message:
+                                    type: string
+                                    description: return information
+        """
+        revoke_token(app, str(get_request_token()))
+        return make_common_response(True)
+
     @app.route(path_prefix + "/update_info", methods=["POST"])
     def update_info():
         """
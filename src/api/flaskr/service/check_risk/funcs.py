@@ -1,5 +1,5 @@
 from flask import Flask
-from ...dao import db
+from ...dao.write_behind import get_write_behind_queue
 from .models import RiskControlResult
 from flaskr.api.check import check_text, CHECK_RESULT_REJECT, CHECK_RESULT_PASS
 from flaskr.service.common.models import raise_error
@@ -7,6 +7,11 @@ from datetime import datetime
 from flaskr.api.check.dto import CheckResultDTO
 
 
+_risk_control_result_queue = get_write_behind_queue(
+    "risk_control_result", RiskControlResult
+)
+
+
 def add_risk_control_result(
     app: Flask,
     chat_id,
@@ -18,20 +23,23 @@ def add_risk_control_result(
     is_pass,
     check_strategy,
 ):
-    with app.app_context():
-        risk_control_result = RiskControlResult(
-            chat_id=chat_id,
-            user_id=user_id,
-            text=text,
-            check_vendor=check_vendor,
-            check_result=check_result,
-            check_resp=check_resp,
-            is_pass=is_pass,
-            check_strategy=check_strategy,
-        )
-        db.session.add(risk_control_result)
-        db.session.commit()
-        return risk_control_result.id
+    """
+    Queue a risk control result, it is inserted in a batch in the background
+    so the learner's request does not wait for its own transaction
+    """
+    _risk_control_result_queue.put(
+        app,
+        {
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "text": text,
+            "check_vendor": check_vendor,
+            "check_result": check_result,
+            "check_resp": check_resp,
+            "is_pass": is_pass,
+            "check_strategy": check_strategy,
+        },
+    )
 
 
 def check_text_with_risk_control(
@@ -58,6 +58,7 @@ ERROR_CODE = {
     "COURSE.LESSON_CANNOT_BE_RESET": 4002,
     "COURSE.LESSON_NOT_FOUND": 4003,
     "COURSE.LESSON_NOT_FOUND_IN_COURSE": 4004,
+    "COURSE.RUN_QUEUE_FULL": 4005,
     # pay error
     "PAY.PAY_CHANNEL_NOT_SUPPORT": 5001,
     # file error
@@ -72,6 +73,8 @@ ERROR_CODE = {
     # params error
     "COMMON.PARAMS_ERROR": 2001,
     "COMMON.TEXT_NOT_ALLOWED": 2002,
+    "COMMON.JOB_NOT_FOUND": 2003,
+    "COMMON.NO_PERMISSION": 2004,
     # Admin errors
     "ADMIN.VIEW_NOT_FOUND": 7001,
     # LLM errors
@@ -1,6 +1,4 @@
-import queue
 import threading
-import asyncio
 import inspect
 from typing import Generator, Union, AsyncGenerator
 from enum import Enum
@@ -11,11 +9,9 @@ from flaskr.service.shifu.consts import (
     BLOCK_TYPE_MDERRORMESSAGE_VALUE,
 )
 from markdown_flow import (
-    MarkdownFlow,
     ProcessMode,
     LLMProvider,
     BlockType,
-    InteractionParser,
 )
 from flask import Flask
 from flaskr.dao import db
@@ -25,6 +21,7 @@ from flaskr.service.shifu.shifu_struct_manager import (
     OutlineItemDtoWithMdflow,
     get_outline_item_dto_with_mdflow,
 )
+from flaskr.service.shifu.shifu_mdflow_funcs import ParsedMdflow, get_parsed_mdflow
 from flaskr.service.shifu.models import (
     DraftBlock,
     PublishedBlock,
@@ -57,7 +54,8 @@ from flaskr.service.learn.learn_dtos import (
     OutlineItemUpdateDTO,
     LearnStatus,
 )
-from flaskr.api.llm import invoke_llm
+from flaskr.api.llm import ainvoke_llm
+from flaskr.api.llm.aio import iter_async, run_async
 from flaskr.service.learn.handle_input_ask import handle_input_ask
 from flaskr.service.profile.funcs import save_user_profiles, ProfileToSave
 from flaskr.service.profile.profile_manage import (
@@ -69,6 +67,13 @@ from flaskr.service.learn.check_text import check_text_with_llm_response
 from flaskr.service.learn.llmsetting import LLMSettings
 from flaskr.service.learn.utils_v2 import init_generated_block
 from flaskr.service.learn.exceptions import PaidException
+from flaskr.service.learn.shared_block import (
+    get_shared_block_content,
+    get_shared_block_key,
+    is_shared_block,
+    set_shared_block_content,
+)
+from flaskr.common.config import get_config
 from flaskr.i18n import _
 
 context_local = threading.local()
@@ -84,6 +89,7 @@ class RunScriptInfo:
     outline_bid: str
     block_position: int
     mdflow: str
+    parsed_mdflow: ParsedMdflow
 
     def __init__(
         self,
@@ -91,11 +97,13 @@ class RunScriptInfo:
         outline_bid: str,
         block_position: int,
         mdflow: str,
+        parsed_mdflow: ParsedMdflow = None,
     ):
         self.attend = attend
         self.outline_bid = outline_bid
         self.block_position = block_position
         self.mdflow = mdflow
+        self.parsed_mdflow = parsed_mdflow
 
 
 class RUNLLMProvider(LLMProvider):
@@ -128,7 +136,7 @@ class RUNLLMProvider(LLMProvider):
         last_message = messages[-1]
         prompt = last_message.get("content", "")
 
-        res = invoke_llm(
+        res = ainvoke_llm(
             self.app,
             self.trace_args.get("user_id", ""),
             self.trace,
@@ -141,7 +149,7 @@ class RUNLLMProvider(LLMProvider):
         )
         # Collect all stream responses and concatenate the results
         content_parts = []
-        for response in res:
+        async for response in res:
             if response.result:
                 content_parts.append(response.result)
         return "".join(content_parts)
@@ -158,7 +166,7 @@ class RUNLLMProvider(LLMProvider):
 
         # Check if there's a system message
 
-        res = invoke_llm(
+        res = ainvoke_llm(
             self.app,
             self.trace_args["user_id"],
             self.trace,
@@ -169,7 +177,7 @@ class RUNLLMProvider(LLMProvider):
             generation_name="run_llm",
             temperature=self.llm_settings.temperature,
         )
-        for i in res:
+        async for i in res:
             if i.result:
                 yield i.result
 
@@ -179,19 +187,7 @@ class RunScriptContextV2:
     attend_id: str
     is_paid: bool
 
-    def _collect_async_generator(self, async_gen):
-        """Helper method to collect results from an async generator"""
-
-        async def _collect():
-            results = []
-            async for item in async_gen:
-                results.append(item)
-            return results
-
-        return asyncio.run(_collect())
-
     preview_mode: bool
-    _q: queue.Queue
     _outline_item_info: ShifuOutlineItemDto
     _struct: HistoryItem
     _user_info: User
@@ -235,6 +231,7 @@ class RunScriptContextV2:
         self.current_outline_item = None
         self._run_type = RunType.INPUT
         self._can_continue = True
+        self._parsed_mdflows: dict[str, ParsedMdflow] = {}
 
         if preview_mode:
             self._outline_model = DraftOutlineItem
@@ -245,16 +242,7 @@ class RunScriptContextV2:
             self._block_model = PublishedBlock
             self._shifu_model = PublishedShifu
         # get current attend
-        self._q = queue.Queue()
-        self._q.put(struct)
-        while not self._q.empty():
-            item = self._q.get()
-            if item.bid == outline_item_info.bid:
-                self._current_outline_item = item
-                break
-            if item.children:
-                for child in item.children:
-                    self._q.put(child)
+        self._current_outline_item = struct.find(outline_item_info.bid)
         self._current_attend = self._get_current_attend(self._outline_item_info.bid)
         self._trace_args = {}
         self._trace_args["user_id"] = user_info.user_id
@@ -331,16 +319,7 @@ class RunScriptContextV2:
     # get the outline items to start or complete
     def _get_next_outline_item(self) -> list[OutlineItemUpdateDTO]:
         res = []
-        q = queue.Queue()
-        q.put(self._struct)
-        outline_ids = []
-        while not q.empty():
-            item: HistoryItem = q.get()
-            if item.type == "outline":
-                outline_ids.append(item.bid)
-            if item.children:
-                for child in item.children:
-                    q.put(child)
+        outline_ids = [item.bid for item in self._struct.get_outline_items()]
         outline_item_info_db: list[tuple[str, bool, str]] = (
             db.session.query(
                 self._outline_model.outline_item_bid,
@@ -363,8 +342,6 @@ class RunScriptContextV2:
         def _mark_sub_node_completed(
             outline_item_info: HistoryItem, res: list[OutlineItemUpdateDTO]
         ):
-            q = queue.Queue()
-            q.put(self._struct)
             if self._is_leaf_outline_item(outline_item_info):
                 res.append(
                     OutlineItemUpdateDTO(
@@ -383,49 +360,39 @@ class RunScriptContextV2:
                         has_children=True,
                     )
                 )
-            while not q.empty():
-                item: HistoryItem = q.get()
-                if item.children and outline_item_info.bid in [
-                    child.bid for child in item.children
-                ]:
-                    index = [child.bid for child in item.children].index(
-                        outline_item_info.bid
-                    )
-                    while index < len(item.children) - 1:
-                        # not sub node
-                        current_node = item.children[index + 1]
-                        if outline_item_hidden_map.get(current_node.bid, True):
-                            index += 1
-                            continue
-                        while (
-                            current_node.children
-                            and current_node.children[0].type == "outline"
-                        ):
-                            res.append(
-                                OutlineItemUpdateDTO(
-                                    outline_bid=current_node.bid,
-                                    title=outline_item_title_map.get(
-                                        current_node.bid, ""
-                                    ),
-                                    status=LearnStatus.IN_PROGRESS,
-                                    has_children=True,
-                                )
-                            )
-                            current_node = current_node.children[0]
-                        res.append(
-                            OutlineItemUpdateDTO(
-                                outline_bid=current_node.bid,
-                                title=outline_item_title_map.get(current_node.bid, ""),
-                                status=LearnStatus.IN_PROGRESS,
-                                has_children=False,
-                            )
+            item: HistoryItem = self._struct.get_parent(outline_item_info.bid)
+            if item is None:
+                return
+            index = [child.bid for child in item.children].index(outline_item_info.bid)
+            while index < len(item.children) - 1:
+                # not sub node
+                current_node = item.children[index + 1]
+                if outline_item_hidden_map.get(current_node.bid, True):
+                    index += 1
+                    continue
+                while (
+                    current_node.children and current_node.children[0].type == "outline"
+                ):
+                    res.append(
+                        OutlineItemUpdateDTO(
+                            outline_bid=current_node.bid,
+                            title=outline_item_title_map.get(current_node.bid, ""),
+                            status=LearnStatus.IN_PROGRESS,
+                            has_children=True,
                         )
-                        return
-                    if index == len(item.children) - 1 and item.type == "outline":
-                        _mark_sub_node_completed(item, res)
-                if item.children and item.children[0].type == "outline":
-                    for child in item.children:
-                        q.put(child)
+                    )
+                    current_node = current_node.children[0]
+                res.append(
+                    OutlineItemUpdateDTO(
+                        outline_bid=current_node.bid,
+                        title=outline_item_title_map.get(current_node.bid, ""),
+                        status=LearnStatus.IN_PROGRESS,
+                        has_children=False,
+                    )
+                )
+                return
+            if index == len(item.children) - 1 and item.type == "outline":
+                _mark_sub_node_completed(item, res)
 
         def _mark_sub_node_start(
             outline_item_info: HistoryItem, res: list[OutlineItemUpdateDTO]
@@ -564,27 +531,26 @@ class RunScriptContextV2:
         self._input = input
 
     def _get_outline_struct(self, outline_item_id: str) -> HistoryItem:
-        q = queue.Queue()
-        q.put(self._struct)
-        outline_struct = None
-        while not q.empty():
-            item = q.get()
-            if item.bid == outline_item_id:
-                outline_struct = item
-                break
-            if item.children:
-                for child in item.children:
-                    q.put(child)
-        return outline_struct
+        return self._struct.find(outline_item_id)
 
-    def _get_run_script_info(self, attend: LearnProgressRecord) -> RunScriptInfo:
-        outline_item_id = attend.outline_item_bid
-        outline_item_info: OutlineItemDtoWithMdflow = get_outline_item_dto_with_mdflow(
-            self.app, outline_item_id, self._preview_mode
-        )
+    def _get_parsed_mdflow(self, outline_item_id: str) -> ParsedMdflow:
+        # the content row is loaded once per context, the parse is shared
+        parsed_mdflow = self._parsed_mdflows.get(outline_item_id)
+        if parsed_mdflow is None:
+            outline_item_info: OutlineItemDtoWithMdflow = (
+                get_outline_item_dto_with_mdflow(
+                    self.app, outline_item_id, self._preview_mode
+                )
+            )
+            parsed_mdflow = get_parsed_mdflow(
+                outline_item_info.outline_bid, outline_item_info.mdflow
+            )
+            self._parsed_mdflows[outline_item_id] = parsed_mdflow
+        return parsed_mdflow
 
-        mddoc = MarkdownFlow(outline_item_info.mdflow)
-        block_list = mddoc.get_all_blocks()
+    def _get_run_script_info(self, attend: LearnProgressRecord) -> RunScriptInfo:
+        parsed_mdflow = self._get_parsed_mdflow(attend.outline_item_bid)
+        block_list = parsed_mdflow.blocks
         self.app.logger.info(
             f"attend position: {attend.block_position} blocks:{len(block_list)}"
         )
@@ -592,9 +558,10 @@ class RunScriptContextV2:
             return None
         return RunScriptInfo(
             attend=attend,
-            outline_bid=outline_item_info.outline_bid,
+            outline_bid=parsed_mdflow.outline_bid,
             block_position=attend.block_position,
-            mdflow=outline_item_info.mdflow,
+            mdflow=parsed_mdflow.mdflow,
+            parsed_mdflow=parsed_mdflow,
         )
 
     def _get_run_script_info_by_block_id(self, block_id: str) -> RunScriptInfo:
@@ -647,13 +614,13 @@ class RunScriptContextV2:
             return
         llm_settings = self.get_llm_settings(run_script_info.outline_bid)
         system_prompt = self.get_system_prompt(run_script_info.outline_bid)
-        mdflow = MarkdownFlow(
-            run_script_info.mdflow,
-            llm_provider=RUNLLMProvider(
+        parsed_mdflow = run_script_info.parsed_mdflow
+        mdflow = parsed_mdflow.create_markdown_flow(
+            RUNLLMProvider(
                 app, system_prompt, llm_settings, self._trace, self._trace_args
-            ),
+            )
         )
-        block_list = mdflow.get_all_blocks()
+        block_list = parsed_mdflow.blocks
 
         if self._input_type == "ask":
             if self._last_position == -1:
@@ -679,9 +646,7 @@ class RunScriptContextV2:
             app, self._user_info.user_id, self._outline_item_info.shifu_bid
         )
         variable_definition: list[ProfileItemDefinition] = (
-            get_profile_item_definition_list(
-                app, self._user_info.user_id, self._outline_item_info.shifu_bid
-            )
+            get_profile_item_definition_list(app, self._outline_item_info.shifu_bid)
         )
         variable_definition_key_id_map: dict[str, str] = {
             p.profile_key: p.profile_id for p in variable_definition
@@ -704,8 +669,7 @@ class RunScriptContextV2:
                 self._current_attend.status = LEARN_STATUS_IN_PROGRESS
                 db.session.flush()
                 return
-            interaction_parser: InteractionParser = InteractionParser()
-            parsed_interaction = interaction_parser.parse(block.content)
+            parsed_interaction = parsed_mdflow.get_interaction(block.index)
             generated_block: LearnGeneratedBlock = (
                 LearnGeneratedBlock.query.filter(
                     LearnGeneratedBlock.progress_record_bid
@@ -815,7 +779,7 @@ class RunScriptContextV2:
                 self._current_attend.block_position += 1
                 db.session.flush()
                 return
-            validate_result = asyncio.run(
+            validate_result = run_async(
                 mdflow.process(
                     run_script_info.block_position,
                     ProcessMode.COMPLETE,
@@ -928,8 +892,7 @@ class RunScriptContextV2:
                 block_index=block.index,
             )
             if block.block_type == BlockType.INTERACTION:
-                interaction_parser: InteractionParser = InteractionParser()
-                parsed_interaction = interaction_parser.parse(block.content)
+                parsed_interaction = parsed_mdflow.get_interaction(block.index)
                 if (
                     parsed_interaction.get("buttons")
                     and len(parsed_interaction.get("buttons")) > 0
@@ -967,6 +930,21 @@ class RunScriptContextV2:
             else:
                 generated_block.type = BLOCK_TYPE_MDCONTENT_VALUE
                 generated_content = ""
+                shared_key = None
+                if (
+                    not self._preview_mode
+                    and get_config("LEARN_SHARED_BLOCK_ENABLED")
+                    and is_shared_block(block)
+                ):
+                    shared_key = get_shared_block_key(
+                        parsed_mdflow,
+                        run_script_info.block_position,
+                        system_prompt,
+                        llm_settings,
+                    )
+                shared_content = (
+                    get_shared_block_content(app, shared_key) if shared_key else None
+                )
 
                 async def process_stream():
                     # Run in STREAM mode; mdflow.process may return a coroutine or an async generator
@@ -1009,7 +987,12 @@ class RunScriptContextV2:
                         # Fallback: convert to string to avoid leaking object reprs
                         yield str(result) if result else ""
 
-                res = self._collect_async_generator(process_stream())
+                if shared_content is not None:
+                    # generated for an earlier learner, replayed line by line
+                    res = shared_content.splitlines(keepends=True)
+                else:
+                    # chunks are forwarded as they arrive from the LLM event loop
+                    res = iter_async(process_stream())
                 for i in res:
                     generated_content += i
                     yield RunMarkdownFlowDTO(
@@ -1024,6 +1007,8 @@ class RunScriptContextV2:
                     type=GeneratedType.BREAK,
                     content="",
                 )
+                if shared_key and shared_content is None and generated_content:
+                    set_shared_block_content(app, shared_key, generated_content)
                 generated_block.generated_content = generated_content
                 db.session.add(generated_block)
                 self._can_continue = True
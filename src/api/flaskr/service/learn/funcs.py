@@ -280,17 +280,7 @@ def get_study_record(
         if not shifu_struct:
             return ret
 
-        q = queue.Queue()
-        q.put(shifu_struct)
-        lesson_info: HistoryItem = None
-        while not q.empty():
-            item: HistoryItem = q.get()
-            if item.bid == lesson_id:
-                lesson_info = item
-                break
-            if item.children:
-                for child in item.children:
-                    q.put(child)
+        lesson_info: HistoryItem = shifu_struct.find(lesson_id)
         if not lesson_info:
             return ret
 
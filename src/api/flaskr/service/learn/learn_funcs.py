@@ -1,8 +1,13 @@
+import hashlib
+import json
+import threading
 from decimal import Decimal
 from markdown_flow import (
     InteractionParser,
 )
-from flask import Flask, request
+from flask import Flask, request, current_app, has_app_context
+from sqlalchemy import event, inspect
+from werkzeug.http import parse_etags
 from flaskr.service.learn.learn_dtos import (
     LearnShifuInfoDTO,
     LearnOutlineItemInfoDTO,
@@ -19,15 +24,19 @@ from flaskr.service.shifu.models import (
     PublishedShifu,
     DraftOutlineItem,
     PublishedOutlineItem,
-    LogDraftStruct,
-    LogPublishedStruct,
 )
 from flaskr.service.learn.models import LearnProgressRecord, LearnGeneratedBlock
 from flaskr.service.common import raise_error
 from flaskr.service.shifu.utils import get_shifu_res_url
 from flaskr.service.shifu.shifu_history_manager import HistoryItem
 from flaskr.service.order.models import Order, BannerInfo
-from flaskr.i18n import _
+from flaskr.i18n import _, get_current_language
+from flaskr.dao.cache import get_cache, invalidate_on_commit, subscribe_invalidation
+from flaskr.common.config import get_config
+from flaskr.service.shifu.shifu_struct_manager import (
+    get_shifu_struct,
+    get_shifu_struct_id,
+)
 from flaskr.service.order.consts import (
     ORDER_STATUS_SUCCESS,
     LEARN_STATUS_LOCKED,
@@ -36,7 +45,6 @@ from flaskr.service.order.consts import (
     LEARN_STATUS_COMPLETED,
     LEARN_STATUS_RESET,
 )
-import queue
 from flaskr.dao import db
 from flaskr.service.lesson.const import LESSON_TYPE_NORMAL
 from flaskr.service.shifu.consts import (
@@ -92,100 +100,225 @@ def get_shifu_info(app: Flask, shifu_bid: str, preview_mode: bool) -> LearnShifu
         )
 
 
+LEARN_PROGRESS_CACHE_TOPIC = "learn_progress"
+
+_LEARN_PROGRESS_EXPIRE = 300
+
+# (version, {outline_item_bid: status}) per (shifu, user),
+# dropped when a progress record changes
+_learn_progress_cache = get_cache(
+    LEARN_PROGRESS_CACHE_TOPIC,
+    maxsize=int(get_config("LEARN_PROGRESS_CACHE_SIZE")),
+    ttl=_LEARN_PROGRESS_EXPIRE,
+)
+# invalidation bumps the version of a key, maps of an older version are
+# stale, also the ones a slow reader puts back after the invalidation;
+# a version outlives every map stored with it
+_learn_progress_versions = get_cache(
+    "learn_progress_version",
+    maxsize=4 * int(get_config("LEARN_PROGRESS_CACHE_SIZE")),
+    ttl=2 * _LEARN_PROGRESS_EXPIRE,
+)
+_all_learn_progress_version = 0
+_learn_progress_versions_lock = threading.Lock()
+# (show_banner, show_lesson_banner) per shifu, banners are only edited in the database
+_banner_info_cache = get_cache("banner_info", maxsize=1024, ttl=60)
+
+
+def _get_learn_progress_key(shifu_bid: str, user_bid: str) -> str:
+    return f"{shifu_bid}:{user_bid}"
+
+
+def _get_learn_progress_version(key: str) -> tuple[int, int]:
+    return _all_learn_progress_version, _learn_progress_versions.get(key, 0)
+
+
+def _evict_learn_progress(key: str):
+    global _all_learn_progress_version
+    with _learn_progress_versions_lock:
+        if key is None:
+            _all_learn_progress_version += 1
+        else:
+            _learn_progress_versions.set(key, _learn_progress_versions.get(key, 0) + 1)
+    if key is None:
+        _learn_progress_cache.clear()
+    else:
+        _learn_progress_cache.delete(key)
+
+
+subscribe_invalidation(LEARN_PROGRESS_CACHE_TOPIC, _evict_learn_progress)
+
+
+def invalidate_learn_progress(app: Flask, shifu_bid: str, user_bid: str):
+    """
+    Drop the cached progress map of a learner in every worker once the
+    current transaction commits, for progress records changed without the
+    ORM, e.g. by a bulk update
+    """
+    invalidate_on_commit(
+        app, LEARN_PROGRESS_CACHE_TOPIC, _get_learn_progress_key(shifu_bid, user_bid)
+    )
+
+
+@event.listens_for(LearnProgressRecord, "after_insert")
+@event.listens_for(LearnProgressRecord, "after_update")
+@event.listens_for(LearnProgressRecord, "after_delete")
+def _invalidate_learn_progress(mapper, connection, target: LearnProgressRecord):
+    if not has_app_context():
+        return
+    app = current_app._get_current_object()
+    user_bids = {target.user_bid}
+    # records may be moved to another user, the bulk move of merged accounts
+    # in migrate_user_study_record invalidates both users itself
+    user_bids.update(inspect(target).attrs.user_bid.history.deleted or [])
+    for user_bid in user_bids:
+        invalidate_learn_progress(app, target.shifu_bid, user_bid)
+
+
+def _get_learn_progress_map(
+    app: Flask, shifu_bid: str, user_bid: str
+) -> dict[str, int]:
+    """
+    Get {outline_item_bid: status} of the user's current progress records
+    """
+    key = _get_learn_progress_key(shifu_bid, user_bid)
+    version = _get_learn_progress_version(key)
+    cached = _learn_progress_cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    progress_records = (
+        LearnProgressRecord.query.with_entities(
+            LearnProgressRecord.outline_item_bid, LearnProgressRecord.status
+        )
+        .filter(
+            LearnProgressRecord.user_bid == user_bid,
+            LearnProgressRecord.shifu_bid == shifu_bid,
+            LearnProgressRecord.status != LEARN_STATUS_RESET,
+            LearnProgressRecord.deleted == 0,
+        )
+        .order_by(LearnProgressRecord.id.asc())
+        .all()
+    )
+    # the newest record wins, as in the record lookups of the run context
+    progress_map = {
+        outline_item_bid: status for outline_item_bid, status in progress_records
+    }
+    _learn_progress_cache.set(key, (version, progress_map))
+    return progress_map
+
+
+def _get_banner_flags(shifu_bid: str) -> tuple[bool, bool]:
+    flags = _banner_info_cache.get(shifu_bid)
+    if flags is None:
+        banner_info = BannerInfo.query.filter(
+            BannerInfo.course_id == shifu_bid,
+            BannerInfo.deleted == 0,
+        ).first()
+        flags = (
+            bool(banner_info and banner_info.show_banner == 1),
+            bool(banner_info and banner_info.show_lesson_banner == 1),
+        )
+        _banner_info_cache.set(shifu_bid, flags)
+    return flags
+
+
 def get_outline_item_tree(
     app: Flask, shifu_bid: str, user_bid: str, preview_mode: bool
 ) -> LearnOutlineItemsWithBannerInfoDTO:
+    return get_outline_item_tree_with_etag(app, shifu_bid, user_bid, preview_mode)[1]
+
+
+def get_outline_item_tree_with_etag(
+    app: Flask,
+    shifu_bid: str,
+    user_bid: str,
+    preview_mode: bool,
+    if_none_match: str = None,
+) -> tuple[str, LearnOutlineItemsWithBannerInfoDTO | None]:
+    """
+    Get the outline item tree with the user's progress
+    Args:
+        app: Flask application instance
+        shifu_bid: Shifu bid
+        user_bid: User bid
+        preview_mode: Preview mode
+        if_none_match: Optional, ETag the client already has
+    Returns:
+        (etag, tree), tree is None when the etag equals if_none_match
+    """
     with app.app_context():
         is_paid = preview_mode
         if preview_mode:
             outline_item_model = DraftOutlineItem
-            struct_model = LogDraftStruct
             shifu_model = DraftShifu
         else:
             outline_item_model = PublishedOutlineItem
-            struct_model = LogPublishedStruct
             shifu_model = PublishedShifu
         if not is_paid:
-            shifu = (
-                shifu_model.query.filter(
-                    shifu_model.shifu_bid == shifu_bid, shifu_model.deleted == 0
-                )
+            shifu_price = (
+                shifu_model.query.with_entities(shifu_model.price)
+                .filter(shifu_model.shifu_bid == shifu_bid, shifu_model.deleted == 0)
                 .order_by(shifu_model.id.desc())
-                .first()
+                .limit(1)
+                .scalar()
             )
-            if not shifu:
+            if shifu_price is None:
                 raise_error("SHIFU.SHIFU_NOT_FOUND")
-            if shifu.price == 0:
+            if shifu_price == Decimal(0):
                 is_paid = True
             else:
-                buy_record = (
-                    Order.query.filter(
+                buy_record_id = (
+                    Order.query.with_entities(Order.id)
+                    .filter(
                         Order.user_bid == user_bid,
                         Order.shifu_bid == shifu_bid,
                         Order.status == ORDER_STATUS_SUCCESS,
                     )
-                    .order_by(Order.id.desc())
-                    .first()
+                    .limit(1)
+                    .scalar()
                 )
-                if not buy_record:
-                    is_paid = False
-                else:
-                    is_paid = True
-        struct = (
-            struct_model.query.filter(
-                struct_model.shifu_bid == shifu_bid, struct_model.deleted == 0
-            )
-            .order_by(struct_model.id.desc())
-            .first()
-        )
-        if not struct:
-            raise_error("SHIFU.SHIFU_STRUCT_NOT_FOUND")
-        struct = HistoryItem.from_json(struct.struct)
-        outline_items: list[HistoryItem] = []
-        q = queue.Queue()
-        q.put(struct)
-        while not q.empty():
-            item: HistoryItem = q.get()
-            if item.type == "outline":
-                outline_items.append(item)
-            if item.children:
-                for child in item.children:
-                    q.put(child)
-        outline_items_ids = [i.id for i in outline_items]
-        outline_items_bids = [i.bid for i in outline_items]
+                is_paid = buy_record_id is not None
+        struct_id = get_shifu_struct_id(app, shifu_bid, preview_mode)
+        progress_map = _get_learn_progress_map(app, shifu_bid, user_bid)
+        add_banner, add_lesson_banner = _get_banner_flags(shifu_bid)
+        etag = hashlib.md5(
+            json.dumps(
+                [
+                    struct_id,
+                    preview_mode,
+                    is_paid,
+                    add_banner,
+                    add_lesson_banner,
+                    get_current_language(),
+                    sorted(progress_map.items()),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+        if if_none_match and parse_etags(if_none_match).contains_weak(etag):
+            return etag, None
+
+        struct = get_shifu_struct(app, shifu_bid, preview_mode, struct_id)
+        outline_items: list[HistoryItem] = struct.get_outline_items()
         outline_items_dbs = outline_item_model.query.filter(
-            outline_item_model.id.in_(outline_items_ids),
+            outline_item_model.id.in_([i.id for i in outline_items]),
             outline_item_model.deleted == 0,
         ).all()
-        progress_records = LearnProgressRecord.query.filter(
-            LearnProgressRecord.user_bid == user_bid,
-            LearnProgressRecord.shifu_bid == shifu_bid,
-            LearnProgressRecord.outline_item_bid.in_(outline_items_bids),
-            LearnProgressRecord.status != LEARN_STATUS_RESET,
-            LearnProgressRecord.deleted == 0,
-        ).all()
-        progress_records_map: dict[str, LearnProgressRecord] = {
-            i.outline_item_bid: i for i in progress_records
+        outline_items_map: dict[int, DraftOutlineItem | PublishedOutlineItem] = {
+            i.id: i for i in outline_items_dbs
         }
 
         def build_outline_item_tree(item: HistoryItem):
-            outline_item: DraftOutlineItem | PublishedOutlineItem = next(
-                (i for i in outline_items_dbs if i.id == item.id), None
-            )
+            outline_item = outline_items_map.get(item.id)
             if not outline_item or outline_item.hidden == 1:
                 return None
-            progress_record = progress_records_map.get(
-                outline_item.outline_item_bid, None
-            )
-            if not progress_record:
+            status = progress_map.get(outline_item.outline_item_bid, None)
+            if status is None:
                 if is_paid:
                     status = LEARN_STATUS_NOT_STARTED
                 elif outline_item.type == LESSON_TYPE_NORMAL:
                     status = LEARN_STATUS_LOCKED
                 else:
                     status = LEARN_STATUS_NOT_STARTED
-            else:
-                status = progress_record.status
             outline_item_info = LearnOutlineItemInfoDTO(
                 bid=outline_item.outline_item_bid,
                 position=outline_item.position,
@@ -206,38 +339,15 @@ def get_outline_item_tree(
             if outline_item_info:
                 outline_items.append(outline_item_info)
         banner_info_dto = None
-
-        banner_info = BannerInfo.query.filter(
-            BannerInfo.course_id == shifu_bid,
-            BannerInfo.deleted == 0,
-        ).first()
-        add_banner = banner_info and banner_info.show_banner == 1
-        add_lesson_banner = banner_info and banner_info.show_lesson_banner == 1
-
-        if not add_banner and not add_lesson_banner:
-            return LearnOutlineItemsWithBannerInfoDTO(
-                banner_info=banner_info_dto,
-                outline_items=outline_items,
+        if add_banner and not is_paid:
+            banner_info_dto = LearnBannerInfoDTO(
+                title=_("BANNER.BANNER_TITLE"),
+                pop_up_title=_("BANNER.BANNER_POP_UP_TITLE"),
+                pop_up_content=_("BANNER.BANNER_POP_UP_CONTENT"),
+                pop_up_confirm_text=_("BANNER.BANNER_POP_UP_CONFIRM_TEXT"),
+                pop_up_cancel_text=_("BANNER.BANNER_POP_UP_CANCEL_TEXT"),
             )
-        is_paid = shifu.price == Decimal(0)
-        if not is_paid:
-            buy_record = Order.query.filter(
-                Order.user_bid == user_bid,
-                Order.shifu_bid == shifu_bid,
-                Order.status == ORDER_STATUS_SUCCESS,
-            ).first()
-            is_paid = buy_record and buy_record.status == ORDER_STATUS_SUCCESS
-
-        if not is_paid:
-            if add_banner:
-                banner_info_dto = LearnBannerInfoDTO(
-                    title=_("BANNER.BANNER_TITLE"),
-                    pop_up_title=_("BANNER.BANNER_POP_UP_TITLE"),
-                    pop_up_content=_("BANNER.BANNER_POP_UP_CONTENT"),
-                    pop_up_confirm_text=_("BANNER.BANNER_POP_UP_CONFIRM_TEXT"),
-                    pop_up_cancel_text=_("BANNER.BANNER_POP_UP_CANCEL_TEXT"),
-                )
-        return LearnOutlineItemsWithBannerInfoDTO(
+        return etag, LearnOutlineItemsWithBannerInfoDTO(
             banner_info=banner_info_dto,
             outline_items=outline_items,
         )
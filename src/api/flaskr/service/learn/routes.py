@@ -4,12 +4,13 @@ from flaskr.framework.plugin.inject import inject
 from flaskr.route.common import make_common_response, bypass_token_validation
 from flaskr.service.learn.learn_funcs import (
     get_shifu_info,
-    get_outline_item_tree,
+    get_outline_item_tree_with_etag,
     get_learn_record,
     handle_reaction,
     reset_learn_record,
 )
 from flaskr.service.learn.runscript_v2 import run_script
+from flaskr.service.learn.sse import sse_compression_accepted
 
 
 @inject
@@ -71,7 +72,14 @@ def register_learn_routes(app: Flask, path_prefix: str = "/api/learn") -> Flask:
               name: preview_mode
               type: string
               required: false
+            - in: header
+              name: If-None-Match
+              type: string
+              required: false
+              description: ETag of a tree the client already has
         responses:
+            304:
+                description: outline item tree not modified
             200:
                 description: get outline item tree success
                 content:
@@ -95,8 +103,19 @@ def register_learn_routes(app: Flask, path_prefix: str = "/api/learn") -> Flask:
         )
         preview_mode = True if preview_mode.lower() == "true" else False
         user_bid = request.user.user_id
-        return make_common_response(
-            get_outline_item_tree(app, shifu_bid, user_bid, preview_mode)
+        etag, outline_item_tree = get_outline_item_tree_with_etag(
+            app,
+            shifu_bid,
+            user_bid,
+            preview_mode,
+            request.headers.get("If-None-Match"),
+        )
+        if outline_item_tree is None:
+            return "", 304, {"ETag": f'"{etag}"'}
+        return (
+            make_common_response(outline_item_tree),
+            200,
+            {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"},
         )
 
     @app.route(path_prefix + "/shifu/<shifu_bid>/run/<outline_bid>", methods=["PUT"])
@@ -151,6 +170,10 @@ def register_learn_routes(app: Flask, path_prefix: str = "/api/learn") -> Flask:
             f"run outline item, shifu_bid: {shifu_bid}, outline_bid: {outline_bid}, preview_mode: {preview_mode}"
         )
         preview_mode = True if preview_mode.lower() == "true" else False
+        compress = sse_compression_accepted(request.headers.get("Accept-Encoding"))
+        headers = {"Cache-Control": "no-cache"}
+        if compress:
+            headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
         try:
             return Response(
                 run_script(
@@ -162,8 +185,10 @@ def register_learn_routes(app: Flask, path_prefix: str = "/api/learn") -> Flask:
                     input_type=input_type,
                     reload_generated_block_bid=reload_generated_block_bid,
                     preview_mode=preview_mode,
+                    compress=compress,
+                    last_event_id=request.headers.get("Last-Event-ID"),
                 ),
-                headers={"Cache-Control": "no-cache"},
+                headers=headers,
                 mimetype="text/event-stream",
             )
         except Exception as e:
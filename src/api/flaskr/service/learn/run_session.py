@@ -0,0 +1,381 @@
+"""
+Run sessions
+
+The runs of one user are serialized across workers by a lease in Redis
+instead of a blocking lock:
+
+- the lease is taken with SET NX and renewed by a heartbeat thread while the
+  run streams, a crashed worker loses it after RUN_LEASE_TTL_SECONDS
+- a request with the same input as the run in flight, e.g. a double click
+  or a reconnect, attaches to that run and receives its frames
+- a request with another input is queued in a Redis stream and runs when the
+  requests before it are done, at most RUN_QUEUE_SIZE requests wait
+- every frame of a run is appended to the output stream of the user and
+  sent with its entry id as SSE `id:`. A client reconnecting with
+  Last-Event-ID resumes after the last frame it received.
+- the run is driven by a background thread, it goes on when the client
+  disconnects and a reconnect resumes it
+"""
+
+import hashlib
+import json
+import queue
+import threading
+import uuid
+from typing import Callable, Generator, Iterable, Optional
+
+from flask import Flask
+
+from flaskr.common.config import get_config
+from flaskr.common.log import thread_local as log_local
+from flaskr.i18n import _, get_current_language, set_language
+from flaskr.service.learn.learn_dtos import GeneratedType, RunMarkdownFlowDTO
+from flaskr.service.learn.sse import encode_frame
+
+# SSE comment sent while a request waits, keeps proxies from closing the stream
+KEEPALIVE_FRAME = b": queued\n\n"
+
+
+def _fingerprint(request: dict) -> str:
+    return hashlib.sha1(
+        json.dumps(request, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _str(value) -> Optional[str]:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class _Heartbeat:
+    """
+    Renews the lease and the current run marker until stopped
+    """
+
+    def __init__(self, session: "RunSession", lease):
+        self.session = session
+        self.lease = lease
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="run-session-heartbeat", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        interval = self.session.lease_ttl / 3
+        while not self._stopped.wait(interval):
+            try:
+                self.lease.reacquire()
+                self.session.redis.pexpire(
+                    self.session.current_key, self.session.lease_ttl_ms
+                )
+            except Exception as e:
+                self.session.app.logger.warning(
+                    f"run session {self.session.user_bid} lease renewal failed: {e}"
+                )
+
+
+class RunSession:
+    """
+    Serializes the runs of one user, see the module docstring
+    """
+
+    def __init__(self, app: Flask, user_bid: str, redis):
+        self.app = app
+        self.user_bid = user_bid
+        self.redis = redis
+        prefix = (
+            (app.config.get("REDIS_KEY_PREFIX") or "") + "run_session:" + user_bid + ":"
+        )
+        self.lease_key = prefix + "lease"
+        self.inputs_key = prefix + "inputs"
+        self.output_key = prefix + "output"
+        self.current_key = prefix + "current"
+        self.waiter_prefix = prefix + "waiter:"
+        self.lease_ttl = int(get_config("RUN_LEASE_TTL_SECONDS"))
+        self.lease_ttl_ms = self.lease_ttl * 1000
+        self.queue_size = int(get_config("RUN_QUEUE_SIZE"))
+        self.output_size = int(get_config("RUN_OUTPUT_BUFFER_SIZE"))
+        self.poll_interval = 1.0
+
+    def stream(
+        self,
+        request: dict,
+        run: Callable[[], Iterable[bytes]],
+        last_event_id: Optional[str] = None,
+    ) -> Generator[bytes, None, None]:
+        """
+        Frames of the run of a request
+        Args:
+            request: the run arguments, requests with equal arguments share a run
+            run: starts the run, returns its SSE frames
+            last_event_id: id of the last frame a reconnecting client received
+        """
+        if last_event_id:
+            yield from self._resume(last_event_id)
+            return
+        fingerprint = _fingerprint(request)
+        current = self._get_current()
+        if current and current["fingerprint"] == fingerprint:
+            yield from self._follow(current["run_id"], current["start_id"])
+            return
+        run_id = uuid.uuid4().hex
+        lease = self.redis.lock(
+            self.lease_key, timeout=self.lease_ttl, thread_local=False
+        )
+        entry_id = None
+        try:
+            if self.redis.xlen(self.inputs_key) >= self.queue_size:
+                yield from self._queue_full_frames(request)
+                return
+            entry_id = self.redis.xadd(
+                self.inputs_key, {"run": run_id, "fingerprint": fingerprint}
+            )
+            attached = yield from self._wait_turn(run_id, entry_id, lease, fingerprint)
+            if attached:
+                return
+            self.redis.xdel(self.inputs_key, entry_id)
+            entry_id = None
+            yield from self._run(run_id, fingerprint, lease, run)
+        finally:
+            if entry_id is not None:
+                self.redis.xdel(self.inputs_key, entry_id)
+                self.redis.delete(self.waiter_prefix + run_id)
+
+    def _queue_full_frames(self, request: dict) -> Generator[bytes, None, None]:
+        self.app.logger.warning(f"run session {self.user_bid} queue full")
+        for dto_type, content in [
+            (GeneratedType.CONTENT, str(_("COURSE.RUN_QUEUE_FULL"))),
+            (GeneratedType.BREAK, ""),
+        ]:
+            yield encode_frame(
+                RunMarkdownFlowDTO(
+                    outline_bid=request.get("outline_bid") or "",
+                    generated_block_bid="",
+                    type=dto_type,
+                    content=content,
+                )
+            )
+
+    def _wait_turn(self, run_id: str, entry_id, lease, fingerprint: str):
+        """
+        Wait until the entry is first in the queue and the lease is taken.
+        Returns True if an equal run started meanwhile and was followed instead.
+        """
+        last_output_id = "$"
+        while True:
+            self.redis.set(self.waiter_prefix + run_id, 1, px=self.lease_ttl_ms)
+            head = self.redis.xrange(self.inputs_key, count=1)
+            if head and head[0][0] == entry_id and lease.acquire(blocking=False):
+                return False
+            current = self._get_current()
+            if current and current["fingerprint"] == fingerprint:
+                yield from self._follow(current["run_id"], current["start_id"])
+                return True
+            if head and head[0][0] != entry_id and current is None:
+                self._drop_abandoned(head[0])
+            yield KEEPALIVE_FRAME
+            # wakes up as soon as the running request writes, e.g. its end
+            result = self.redis.xread(
+                {self.output_key: last_output_id},
+                count=100,
+                block=int(self.poll_interval * 1000),
+            )
+            if result:
+                last_output_id = result[0][1][-1][0]
+
+    def _drop_abandoned(self, head) -> None:
+        # a waiter whose worker died stops refreshing its key
+        head_id, fields = head
+        waiter_key = self.waiter_prefix + _str(fields.get(b"run"))
+        if not self.redis.get(waiter_key):
+            self.app.logger.warning(
+                f"run session {self.user_bid} drops abandoned request {_str(head_id)}"
+            )
+            self.redis.xdel(self.inputs_key, head_id)
+
+    def _run(
+        self, run_id: str, fingerprint: str, lease, run: Callable
+    ) -> Generator[bytes, None, None]:
+        heartbeat = _Heartbeat(self, lease)
+        try:
+            start_id = self._append({"run": run_id, "start": 1})
+            self.redis.set(
+                self.current_key,
+                json.dumps(
+                    {
+                        "run_id": run_id,
+                        "fingerprint": fingerprint,
+                        "start_id": _str(start_id),
+                    }
+                ),
+                px=self.lease_ttl_ms,
+            )
+            heartbeat.start()
+        except Exception:
+            self._end(run_id, heartbeat, lease)
+            raise
+
+        def _on_frame(frame: bytes) -> bytes:
+            entry_id = self._append({"run": run_id, "data": frame})
+            if entry_id is None:
+                return frame
+            return b"id: " + entry_id + b"\n" + frame
+
+        yield from detach(
+            self.app,
+            run,
+            on_frame=_on_frame,
+            on_end=lambda: self._end(run_id, heartbeat, lease),
+        )
+
+    def _end(self, run_id: str, heartbeat: _Heartbeat, lease) -> None:
+        heartbeat.stop()
+        self._append({"run": run_id, "end": 1})
+        current = self._get_current()
+        if current and current["run_id"] == run_id:
+            self.redis.delete(self.current_key)
+        try:
+            lease.release()
+        except Exception as e:
+            self.app.logger.warning(
+                f"run session {self.user_bid} lease release failed: {e}"
+            )
+
+    def _append(self, fields: dict) -> Optional[bytes]:
+        try:
+            entry_id = self.redis.xadd(
+                self.output_key, fields, maxlen=self.output_size, approximate=True
+            )
+            # kept a while after the last run for late resumes
+            self.redis.expire(self.output_key, self.lease_ttl * 20)
+        except Exception as e:
+            # the run goes on, only followers and resumes miss the frame
+            self.app.logger.warning(f"run session {self.user_bid} append failed: {e}")
+            return None
+        return entry_id if isinstance(entry_id, bytes) else entry_id.encode()
+
+    def _get_current(self) -> Optional[dict]:
+        value = self.redis.get(self.current_key)
+        return json.loads(value) if value else None
+
+    def _resume(self, last_event_id: str) -> Generator[bytes, None, None]:
+        entries = self.redis.xrange(self.output_key, last_event_id, last_event_id)
+        if not entries:
+            self.app.logger.info(
+                f"run session {self.user_bid} nothing to resume after {last_event_id}"
+            )
+            return
+        yield from self._follow(_str(entries[0][1].get(b"run")), last_event_id)
+
+    def _follow(self, run_id: str, after_id: str) -> Generator[bytes, None, None]:
+        """
+        Frames of a run written after an entry, until the run ends
+        """
+        last_id = after_id
+        while True:
+            result = self.redis.xread(
+                {self.output_key: last_id},
+                count=100,
+                block=int(self.poll_interval * 1000),
+            )
+            if not result:
+                current = self._get_current()
+                if current is None or current["run_id"] != run_id:
+                    # the run is gone without an end entry, e.g. trimmed
+                    return
+                continue
+            for entry_id, fields in result[0][1]:
+                last_id = entry_id
+                if _str(fields.get(b"run")) != run_id:
+                    continue
+                if b"end" in fields:
+                    return
+                if b"data" in fields:
+                    yield b"id: " + entry_id + b"\n" + fields[b"data"]
+
+
+_END = object()
+
+
+def detach(
+    app: Flask,
+    run: Callable[[], Iterable[bytes]],
+    on_frame: Callable[[bytes], bytes] = None,
+    on_end: Callable[[], None] = None,
+) -> Generator[bytes, None, None]:
+    """
+    Frames of a run driven by a background thread. When the client goes away
+    the run goes on to its end, so generated content is kept instead of
+    rolled back, and a reconnecting client can resume it.
+    Args:
+        run: starts the run, returns its SSE frames
+        on_frame: called in the run thread for every frame, returns the frame
+            sent to the client
+        on_end: called in the run thread when the run is done
+    """
+    frames: queue.Queue = queue.Queue()
+    attached = threading.Event()
+    attached.set()
+    language = get_current_language()
+    log_context = {
+        key: getattr(log_local, key)
+        for key in ("request_id", "url", "client_ip")
+        if hasattr(log_local, key)
+    }
+
+    def _drive() -> None:
+        set_language(language)
+        for key, value in log_context.items():
+            setattr(log_local, key, value)
+        try:
+            for frame in run():
+                if on_frame is not None:
+                    frame = on_frame(frame)
+                if attached.is_set():
+                    frames.put(frame)
+        except Exception as e:
+            app.logger.error(f"detached run failed: {e}", exc_info=True)
+        finally:
+            try:
+                if on_end is not None:
+                    on_end()
+            finally:
+                frames.put(_END)
+
+    thread = threading.Thread(target=_drive, name="run-script", daemon=True)
+    thread.start()
+    try:
+        while True:
+            frame = frames.get()
+            if frame is _END:
+                return
+            yield frame
+    finally:
+        attached.clear()
+        if thread.is_alive():
+            app.logger.info("client gone, the run goes on in the background")
+
+
+def stream_run(
+    app: Flask,
+    user_bid: str,
+    request: dict,
+    run: Callable[[], Iterable[bytes]],
+    last_event_id: Optional[str] = None,
+) -> Generator[bytes, None, None]:
+    """
+    Frames of a run in the run session of the user, without Redis the run is
+    only detached from the client
+    """
+    from flaskr import dao
+
+    redis = getattr(dao, "redis_client", None)
+    if redis is None:
+        yield from detach(app, run)
+        return
+    yield from RunSession(app, user_bid, redis).stream(request, run, last_event_id)
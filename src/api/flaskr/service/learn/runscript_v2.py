@@ -5,14 +5,10 @@ from flask import Flask
 from flaskr.service.common.models import AppException, raise_error
 from flaskr.service.user.models import User
 from flaskr.i18n import _
-import json
 
 
 from flaskr.service.learn.learn_dtos import RunMarkdownFlowDTO
-from flaskr.dao import db, redis_client
-from flaskr.service.learn.utils import (
-    make_script_dto,
-)
+from flaskr.dao import db
 from flaskr.service.shifu.shifu_struct_manager import (
     get_shifu_dto,
     get_outline_item_dto,
@@ -27,7 +23,8 @@ from flaskr.service.order.consts import ORDER_STATUS_SUCCESS
 from flaskr.service.learn.context_v2 import RunScriptContextV2
 from flaskr.service.learn.input_funcs import BreakException
 from flaskr.service.learn.learn_dtos import GeneratedType
-import datetime
+from flaskr.service.learn.sse import SSEWriter
+from flaskr.service.learn.run_session import stream_run
 
 
 def run_script_inner(
@@ -119,13 +116,6 @@ def run_script_inner(
             app.logger.info("GeneratorExit")
 
 
-def fmt(o):
-    if isinstance(o, datetime.datetime):
-        return o.isoformat()
-    else:
-        return o.__json__()
-
-
 def run_script(
     app: Flask,
     shifu_bid: str,
@@ -135,90 +125,84 @@ def run_script(
     input_type: str = None,
     reload_generated_block_bid: str = None,
     preview_mode: bool = False,
-) -> Generator[str, None, None]:
-    timeout = 5 * 60
-    blocking_timeout = 1
-    lock_key = app.config.get("REDIS_KEY_PREFIX") + ":run_script:" + user_bid
-    lock = redis_client.lock(
-        lock_key, timeout=timeout, blocking_timeout=blocking_timeout
+    compress: bool = False,
+    last_event_id: str = None,
+) -> Generator[bytes, None, None]:
+    """
+    SSE frames of a run, see SSEWriter for coalescing and compression and
+    RunSession for how concurrent runs of a user are serialized
+    """
+    writer = SSEWriter.from_config(compress=compress)
+    request = {
+        "shifu_bid": shifu_bid,
+        "outline_bid": outline_bid,
+        "input": input,
+        "input_type": input_type,
+        "reload_generated_block_bid": reload_generated_block_bid,
+        "preview_mode": preview_mode,
+    }
+    yield from writer.encode(
+        stream_run(
+            app,
+            user_bid,
+            request,
+            lambda: writer.frames(
+                _run_script_events(app, user_bid=user_bid, **request)
+            ),
+            last_event_id=last_event_id,
+        )
     )
-    if lock.acquire(blocking=True):
-        try:
-            res = run_script_inner(
-                app=app,
-                user_bid=user_bid,
-                shifu_bid=shifu_bid,
+
+
+def _run_script_events(
+    app: Flask,
+    shifu_bid: str,
+    outline_bid: str,
+    user_bid: str,
+    input: str | dict = None,
+    input_type: str = None,
+    reload_generated_block_bid: str = None,
+    preview_mode: bool = False,
+) -> Generator[RunMarkdownFlowDTO | str, None, None]:
+    try:
+        yield from run_script_inner(
+            app=app,
+            user_bid=user_bid,
+            shifu_bid=shifu_bid,
+            outline_bid=outline_bid,
+            input=input,
+            input_type=input_type,
+            reload_generated_block_bid=reload_generated_block_bid,
+            preview_mode=preview_mode,
+        )
+    except Exception as e:
+        app.logger.error("run_script error")
+        app.logger.error(e)
+        error_info = {
+            "name": type(e).__name__,
+            "description": str(e),
+            "traceback": traceback.format_exc(),
+        }
+
+        if isinstance(e, AppException):
+            app.logger.info(error_info)
+            yield RunMarkdownFlowDTO(
                 outline_bid=outline_bid,
-                input=input,
-                input_type=input_type,
-                reload_generated_block_bid=reload_generated_block_bid,
-                preview_mode=preview_mode,
+                generated_block_bid="",
+                type=GeneratedType.CONTENT,
+                content=str(e),
             )
-            for item in res:
-                yield (
-                    "data: "
-                    + json.dumps(item, default=fmt, ensure_ascii=False)
-                    + "\n\n".encode("utf-8").decode("utf-8")
-                )
-        except Exception as e:
-            app.logger.error("run_script error")
-            app.logger.error(e)
-            error_info = {
-                "name": type(e).__name__,
-                "description": str(e),
-                "traceback": traceback.format_exc(),
-            }
-
-            if isinstance(e, AppException):
-                app.logger.info(error_info)
-                yield (
-                    "data: "
-                    + json.dumps(
-                        RunMarkdownFlowDTO(
-                            outline_bid=outline_bid,
-                            generated_block_bid="",
-                            type=GeneratedType.CONTENT,
-                            content=str(e),
-                        ),
-                        default=fmt,
-                        ensure_ascii=False,
-                    )
-                    + "\n\n".encode("utf-8").decode("utf-8")
-                )
-            else:
-                app.logger.error(error_info)
-                yield (
-                    "data: "
-                    + json.dumps(
-                        RunMarkdownFlowDTO(
-                            outline_bid=outline_bid,
-                            generated_block_bid="",
-                            type=GeneratedType.CONTENT,
-                            content=str(_("COMMON.UNKNOWN_ERROR")),
-                        ),
-                        default=fmt,
-                        ensure_ascii=False,
-                    )
-                    + "\n\n".encode("utf-8").decode("utf-8")
-                )
-            yield (
-                "data: "
-                + json.dumps(
-                    RunMarkdownFlowDTO(
-                        outline_bid=outline_bid,
-                        generated_block_bid="",
-                        type=GeneratedType.BREAK,
-                        content=None,
-                    ),
-                    default=fmt,
-                    ensure_ascii=False,
-                )
-                + "\n\n".encode("utf-8").decode("utf-8")
+        else:
+            app.logger.error(error_info)
+            yield RunMarkdownFlowDTO(
+                outline_bid=outline_bid,
+                generated_block_bid="",
+                type=GeneratedType.CONTENT,
+                content=str(_("COMMON.UNKNOWN_ERROR")),
             )
-        finally:
-            lock.release()
-        return
-    else:
-        app.logger.warning("lockfail")
-        yield make_script_dto("text_end", "", None)
-    return
+        yield RunMarkdownFlowDTO(
+            outline_bid=outline_bid,
+            generated_block_bid="",
+            type=GeneratedType.BREAK,
+            content=None,
+        )
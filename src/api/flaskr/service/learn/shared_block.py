@@ -0,0 +1,106 @@
+"""
+Shared content of variable-free blocks
+
+A content block without profile variables renders the same prompt for every
+learner, so its generation only depends on the published content, the
+system prompt and the LLM settings. With LEARN_SHARED_BLOCK_ENABLED the
+first learner's generation is stored and replayed to every later learner of
+the same published version, from process memory or Redis.
+
+The key contains the content hash of the outline item, a publish that
+changes the content starts new generations and the old ones expire.
+"""
+
+import hashlib
+from typing import Optional
+
+from flask import Flask
+from markdown_flow import BlockType
+from markdown_flow.models import Block
+
+from flaskr.common.config import get_config
+from flaskr.dao.cache import get_cache
+from flaskr.service.learn.llmsetting import LLMSettings
+from flaskr.service.shifu.shifu_mdflow_funcs import ParsedMdflow
+
+SHARED_BLOCK_CACHE_TOPIC = "shared_block"
+
+_shared_block_cache = get_cache(
+    SHARED_BLOCK_CACHE_TOPIC,
+    maxsize=int(get_config("LEARN_SHARED_BLOCK_CACHE_SIZE")),
+    ttl=int(get_config("LEARN_SHARED_BLOCK_EXPIRE")),
+)
+
+
+def is_shared_block(block: Block) -> bool:
+    """
+    Whether the generation of a block is the same for every learner
+    """
+    return block.block_type == BlockType.CONTENT and not block.variables
+
+
+def get_shared_block_key(
+    parsed_mdflow: ParsedMdflow,
+    block_index: int,
+    system_prompt: Optional[str],
+    llm_settings: LLMSettings,
+) -> str:
+    digest = hashlib.md5(
+        "\0".join(
+            [
+                parsed_mdflow.mdflow,
+                system_prompt or "",
+                llm_settings.model,
+                str(llm_settings.temperature),
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+    return f"{parsed_mdflow.outline_bid}:{digest}:{block_index}"
+
+
+def _get_redis_key(app: Flask, key: str) -> str:
+    return (app.config.get("REDIS_KEY_PREFIX") or "") + "shared_block:" + key
+
+
+def get_shared_block_content(app: Flask, key: str) -> Optional[str]:
+    """
+    Get the stored generation of a shared block, None if not generated yet
+    """
+    from flaskr import dao
+
+    content = _shared_block_cache.get(key)
+    if content is not None:
+        return content
+    redis = getattr(dao, "redis_client", None)
+    if redis is None:
+        return None
+    try:
+        value = redis.get(_get_redis_key(app, key))
+    except Exception as e:
+        app.logger.warning(f"get shared block failed: {key} {e}")
+        return None
+    if value is None:
+        return None
+    content = value.decode("utf-8") if isinstance(value, bytes) else value
+    _shared_block_cache.set(key, content)
+    return content
+
+
+def set_shared_block_content(app: Flask, key: str, content: str) -> None:
+    """
+    Store the generation of a shared block for the later learners
+    """
+    from flaskr import dao
+
+    _shared_block_cache.set(key, content)
+    redis = getattr(dao, "redis_client", None)
+    if redis is None:
+        return
+    try:
+        redis.set(
+            _get_redis_key(app, key),
+            content,
+            ex=int(get_config("LEARN_SHARED_BLOCK_EXPIRE")),
+        )
+    except Exception as e:
+        app.logger.warning(f"set shared block failed: {key} {e}")
@@ -0,0 +1,267 @@
+"""
+SSE writer of run script streams
+
+Turns the RunMarkdownFlowDTO stream of a run into `data:` frames:
+
+- content deltas of the same generated block are coalesced into one frame
+  until SSE_COALESCE_BYTES bytes are pending or SSE_COALESCE_MS passed since
+  the first pending delta. A delta arriving after a quiet period is sent at
+  once, so slow streams get no added latency. The DTO stream is read by a
+  thread, so held content is sent when the interval runs out even if the
+  next delta is late.
+- frames are encoded with orjson
+- with SSE_COMPRESSION enabled and a client accepting gzip, the stream is
+  gzip compressed and flushed after every frame
+
+Other frames (breaks, interactions, variable and outline updates) flush the
+pending content first and are sent as they arrive.
+"""
+
+import datetime
+import queue
+import threading
+import time
+import zlib
+from typing import Callable, Generator, Iterable, Optional
+
+import orjson
+
+from flaskr.common.config import get_config
+from flaskr.common.log import thread_local as log_local
+from flaskr.i18n import get_current_language, set_language
+from flaskr.service.learn.learn_dtos import GeneratedType, RunMarkdownFlowDTO
+
+
+def _default(o):
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    return o.__json__()
+
+
+def encode_frame(item) -> bytes:
+    """
+    Encode one DTO as a `data:` frame
+    """
+    return b"data: " + orjson.dumps(item, default=_default) + b"\n\n"
+
+
+_END = object()
+# no item arrived before the held content is due
+_TICK = object()
+
+
+class _IterSource:
+    """
+    Items read in the calling thread, used without a flush timer
+    """
+
+    def __init__(self, items: Iterable):
+        self._iterator = iter(items)
+
+    def get(self, timeout: Optional[float]):
+        return next(self._iterator, _END)
+
+    def close(self) -> None:
+        pass
+
+
+class _ThreadedSource:
+    """
+    Items read by a thread, get() returns _TICK when none arrived within
+    the timeout. The thread runs with the language and log context of the
+    thread that created it.
+    """
+
+    def __init__(self, items: Iterable):
+        self._items = items
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = threading.Event()
+        language = get_current_language()
+        log_context = {
+            key: getattr(log_local, key)
+            for key in ("request_id", "url", "client_ip")
+            if hasattr(log_local, key)
+        }
+
+        def _read() -> None:
+            set_language(language)
+            for key, value in log_context.items():
+                setattr(log_local, key, value)
+            try:
+                for item in self._items:
+                    if self._closed.is_set():
+                        break
+                    self._queue.put((item, None))
+            except BaseException as e:
+                self._queue.put((_END, e))
+                return
+            finally:
+                if self._closed.is_set() and hasattr(self._items, "close"):
+                    self._items.close()
+            self._queue.put((_END, None))
+
+        self._thread = threading.Thread(target=_read, name="sse-source", daemon=True)
+        self._thread.start()
+
+    def get(self, timeout: Optional[float]):
+        try:
+            item, error = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return _TICK
+        if error is not None:
+            raise error
+        return item
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+class SSEWriter:
+    def __init__(
+        self,
+        coalesce_interval: float = 0.03,
+        coalesce_bytes: int = 256,
+        compress: bool = False,
+        clock: Callable[[], float] = time.monotonic,
+        flush_timer: bool = True,
+    ):
+        """
+        Args:
+            coalesce_interval: seconds content deltas are held, 0 disables coalescing
+            coalesce_bytes: pending content size that is sent at once
+            compress: gzip the stream
+            flush_timer: read the items in a thread and send held content
+                when the interval runs out, without it held content waits
+                for the next item
+        """
+        self.coalesce_interval = coalesce_interval
+        self.coalesce_bytes = coalesce_bytes
+        self.compress = compress
+        self.clock = clock
+        self.flush_timer = flush_timer
+        self.frame_count = 0
+
+    @classmethod
+    def from_config(cls, compress: bool = False) -> "SSEWriter":
+        return cls(
+            coalesce_interval=int(get_config("SSE_COALESCE_MS")) / 1000,
+            coalesce_bytes=int(get_config("SSE_COALESCE_BYTES")),
+            compress=compress,
+        )
+
+    def stream(self, items: Iterable) -> Generator[bytes, None, None]:
+        """
+        Frames of a DTO stream, compressed if enabled
+        """
+        return self.encode(self.frames(items))
+
+    def encode(self, chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+        """
+        Compress written chunks if enabled, flushed after every chunk
+        """
+        if not self.compress:
+            yield from chunks
+            return
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+    def frames(self, items: Iterable) -> Generator[bytes, None, None]:
+        """
+        Uncompressed frames of a DTO stream, str and bytes items are sent as
+        they are
+        """
+        if self.coalesce_interval > 0 and self.flush_timer:
+            source = _ThreadedSource(items)
+        else:
+            source = _IterSource(items)
+        try:
+            yield from self._coalesce(source)
+        finally:
+            source.close()
+
+    def _coalesce(self, source) -> Generator[bytes, None, None]:
+        pending: list[str] = []
+        pending_size = 0
+        pending_since = 0.0
+        pending_dto: Optional[RunMarkdownFlowDTO] = None
+        last_sent = float("-inf")
+
+        def _flush() -> bytes:
+            nonlocal pending, pending_size, pending_dto
+            frame = encode_frame(
+                {
+                    "outline_bid": pending_dto.outline_bid,
+                    "generated_block_bid": pending_dto.generated_block_bid,
+                    "type": GeneratedType.CONTENT.value,
+                    "content": "".join(pending),
+                }
+            )
+            pending, pending_size, pending_dto = [], 0, None
+            self.frame_count += 1
+            return frame
+
+        while True:
+            timeout = None
+            if pending_dto is not None:
+                timeout = max(
+                    0.0, pending_since + self.coalesce_interval - self.clock()
+                )
+            item = source.get(timeout)
+            if item is _END:
+                break
+            now = self.clock()
+            if item is _TICK:
+                if pending_dto is not None:
+                    last_sent = now
+                    yield _flush()
+                continue
+            if (
+                self.coalesce_interval > 0
+                and isinstance(item, RunMarkdownFlowDTO)
+                and item.type == GeneratedType.CONTENT
+                and isinstance(item.content, str)
+            ):
+                if pending_dto is not None and (
+                    pending_dto.generated_block_bid != item.generated_block_bid
+                    or pending_dto.outline_bid != item.outline_bid
+                ):
+                    yield _flush()
+                    last_sent = now
+                if pending_dto is None:
+                    if now - last_sent >= self.coalesce_interval:
+                        # first delta after a quiet period, nothing to wait for
+                        self.frame_count += 1
+                        last_sent = now
+                        yield encode_frame(item)
+                        continue
+                    pending_dto, pending_since = item, now
+                pending.append(item.content)
+                pending_size += len(item.content.encode("utf-8"))
+                if (
+                    pending_size >= self.coalesce_bytes
+                    or now - pending_since >= self.coalesce_interval
+                ):
+                    last_sent = now
+                    yield _flush()
+                continue
+            if pending_dto is not None:
+                yield _flush()
+            last_sent = now
+            self.frame_count += 1
+            if isinstance(item, bytes):
+                yield item
+            elif isinstance(item, str):
+                yield item.encode("utf-8")
+            else:
+                yield encode_frame(item)
+        if pending_dto is not None:
+            yield _flush()
+
+
+def sse_compression_accepted(accept_encoding: Optional[str]) -> bool:
+    """
+    Whether a run stream is gzip compressed for a client
+    """
+    return bool(get_config("SSE_COMPRESSION")) and "gzip" in (accept_encoding or "")
@@ -23,6 +23,7 @@ from flaskr.api.doc.feishu import send_notify
 from .models import Order, PingxxOrder
 from flask import Flask
 from ...dao import db, redis_client
+from ...dao.jobs import enqueue_job, job_handler
 from ..common.models import (
     raise_error,
 )
@@ -149,7 +150,11 @@ class AICourseBuyRecordDTO:
         }
 
 
+ORDER_FEISHU_JOB = "order.feishu_notify"
+
+
 # to do : add to plugins
+@job_handler(ORDER_FEISHU_JOB)
 def send_order_feishu(app: Flask, record_id: str):
     order_info = query_buy_record(app, record_id)
     if order_info is None:
@@ -514,7 +519,12 @@ def success_buy_record_from_pingxx(app: Flask, charge_id: str, body: dict):
                             app.logger.error("update user state error:{}".format(e))
                         buy_record.status = ORDER_STATUS_SUCCESS
                         db.session.commit()
-                        send_order_feishu(app, buy_record.order_bid)
+                        enqueue_job(
+                            app,
+                            ORDER_FEISHU_JOB,
+                            {"record_id": buy_record.order_bid},
+                            key=f"{ORDER_FEISHU_JOB}:{buy_record.order_bid}",
+                        )
                         return query_buy_record(app, buy_record.order_bid)
                     else:
                         app.logger.error(
@@ -548,7 +558,12 @@ def success_buy_record(app: Flask, record_id: str):
                 user_info.user_state = USER_STATE_PAID
             buy_record.status = ORDER_STATUS_SUCCESS
             db.session.commit()
-            send_order_feishu(app, buy_record.order_bid)
+            enqueue_job(
+                app,
+                ORDER_FEISHU_JOB,
+                {"record_id": buy_record.order_bid},
+                key=f"{ORDER_FEISHU_JOB}:{buy_record.order_bid}",
+            )
             return query_buy_record(app, record_id)
         else:
             app.logger.error("record:{} not found".format(record_id))
@@ -1,5 +1,8 @@
-from flask import Flask
+import json
 
+from flask import Flask, current_app, g, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
 
 from .constants import SYS_USER_LANGUAGE
 from .models import UserProfile
@@ -16,6 +19,7 @@ from flaskr.api.check import (
 )
 from flaskr.util.uuid import generate_id
 from flaskr.service.common import raise_error
+from flaskr.common.config import get_config
 from flaskr.service.profile.profile_manage import get_profile_item_definition_list
 from flaskr.service.profile.models import (
     PROFILE_TYPE_INPUT_SELECT,
@@ -68,6 +72,168 @@ def _language_display_value(language_code: str) -> str:
     return _LANGUAGE_BASE_DISPLAY.get(base_code, language_code)
 
 
+# Per user profile snapshot
+#
+# {"language": ..., "by_id": {profile_id: value}, "by_key": {profile_key: value}}
+# is kept in Redis and memoized on flask.g for the current request. Writes to
+# UserProfile rows or to the user language drop the memo right away and bump
+# the Redis version of the user once they are committed, until then this
+# session skips Redis. Snapshots are stored under the version read before the
+# rows were loaded, so a slow reader can only write a version nobody reads.
+
+
+def _get_user_profile_version_key(app: Flask, user_id: str) -> str:
+    return (
+        (app.config.get("REDIS_KEY_PREFIX") or "") + "user_profile_version:" + user_id
+    )
+
+
+def _get_user_profile_snapshot_key(app: Flask, user_id: str, version: int) -> str:
+    return (
+        (app.config.get("REDIS_KEY_PREFIX") or "")
+        + "user_profile:"
+        + user_id
+        + ":"
+        + str(version)
+    )
+
+
+def _get_user_profile_memo(user_id: str) -> dict:
+    # {"snapshot": ..., "profiles": {course_id: profiles}} of the current request
+    if not has_app_context():
+        return {"profiles": {}}
+    if "user_profiles" not in g:
+        g.user_profiles = {}
+    return g.user_profiles.setdefault(user_id, {"profiles": {}})
+
+
+def _forget_user_profile_memo(user_ids) -> None:
+    if has_app_context() and "user_profiles" in g:
+        for user_id in user_ids:
+            g.user_profiles.pop(user_id, None)
+
+
+def _get_dirty_user_profiles() -> set:
+    return db.session.info.setdefault("dirty_user_profiles", set())
+
+
+def _build_user_profile_snapshot(user_id: str, session: Session = None) -> dict:
+    session = session or db.session
+    user_profiles = (
+        session.query(UserProfile)
+        .filter_by(user_id=user_id)
+        .order_by(UserProfile.id)
+        .all()
+    )
+    user_info = session.query(User).filter(User.user_id == user_id).first()
+    by_id = {}
+    by_key = {}
+    for user_profile in user_profiles:
+        # the oldest row wins, as the scans over the query result did before
+        by_id.setdefault(user_profile.profile_id, user_profile.profile_value)
+        by_key.setdefault(user_profile.profile_key, user_profile.profile_value)
+    return {
+        "language": get_user_language(user_info) if user_info else None,
+        "by_id": by_id,
+        "by_key": by_key,
+    }
+
+
+def _get_user_profile_snapshot(app: Flask, user_id: str) -> dict:
+    from flaskr import dao
+
+    memo = _get_user_profile_memo(user_id)
+    snapshot = memo.get("snapshot")
+    if snapshot is not None:
+        return snapshot
+    redis = getattr(dao, "redis_client", None)
+    # uncommitted changes of this session must not be read from or put into Redis
+    shared = redis is not None and user_id not in _get_dirty_user_profiles()
+    key = None
+    if shared:
+        try:
+            version = int(redis.get(_get_user_profile_version_key(app, user_id)) or 0)
+            key = _get_user_profile_snapshot_key(app, user_id, version)
+            cached = redis.get(key)
+            if cached:
+                snapshot = json.loads(cached)
+        except Exception as e:
+            app.logger.warning(f"get user profile snapshot failed: {user_id} {e}")
+    if snapshot is None and key is not None:
+        # a new transaction, the one of the request may predate the version
+        # read above, e.g. in a long running run thread
+        with Session(db.engine) as session:
+            snapshot = _build_user_profile_snapshot(user_id, session)
+        expire = int(get_config("USER_PROFILE_CACHE_EXPIRE"))
+        try:
+            redis.set(key, json.dumps(snapshot), ex=expire)
+            # the version outlives every snapshot stored under it
+            redis.expire(_get_user_profile_version_key(app, user_id), expire * 2)
+        except Exception as e:
+            app.logger.warning(f"set user profile snapshot failed: {user_id} {e}")
+    if snapshot is None:
+        snapshot = _build_user_profile_snapshot(user_id)
+    memo["snapshot"] = snapshot
+    return snapshot
+
+
+def _bump_user_profile_versions(app: Flask, user_ids: set) -> None:
+    from flaskr import dao
+
+    redis = getattr(dao, "redis_client", None)
+    if redis is None or not user_ids:
+        return
+    expire = int(get_config("USER_PROFILE_CACHE_EXPIRE")) * 2
+    try:
+        for user_id in user_ids:
+            version_key = _get_user_profile_version_key(app, user_id)
+            redis.incr(version_key)
+            redis.expire(version_key, expire)
+    except Exception as e:
+        app.logger.warning(f"bump user profile versions failed: {user_ids} {e}")
+
+
+def _invalidate_user_profiles(user_id: str) -> None:
+    """
+    Drop the cached profiles of a user, called by the mapper events below
+    for every write through the ORM, e.g. save_user_profile(s)
+    """
+    if not has_app_context() or not user_id:
+        return
+    _forget_user_profile_memo([user_id])
+    _get_dirty_user_profiles().add(user_id)
+
+
+@event.listens_for(UserProfile, "after_insert")
+@event.listens_for(UserProfile, "after_update")
+@event.listens_for(UserProfile, "after_delete")
+def _invalidate_user_profile(mapper, connection, target: UserProfile):
+    _invalidate_user_profiles(target.user_id)
+    # rows may be moved to another user, e.g. when accounts are merged
+    for user_id in inspect(target).attrs.user_id.history.deleted or []:
+        _invalidate_user_profiles(user_id)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_user_language(mapper, connection, target: User):
+    if inspect(target).attrs.user_language.history.has_changes():
+        _invalidate_user_profiles(target.user_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_user_profiles(session: Session):
+    user_ids = session.info.pop("dirty_user_profiles", None)
+    if user_ids and has_app_context():
+        _bump_user_profile_versions(current_app._get_current_object(), user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_user_profiles(session: Session):
+    user_ids = session.info.pop("dirty_user_profiles", None)
+    if user_ids:
+        _forget_user_profile_memo(user_ids)
+
+
 def check_text_content(
     app: Flask,
     user_id: str,
@@ -286,35 +452,21 @@ def get_user_profiles(app: Flask, user_id: str, course_id: str) -> dict:
     Returns:
         dict: User profiles
     """
-    profiles_items = get_profile_item_definition_list(app, course_id)
-    user_profiles = UserProfile.query.filter_by(user_id=user_id).all()
-    user_info = User.query.filter(User.user_id == user_id).first()
-    result = {}
-
-    language_code = get_user_language(user_info) if user_info else None
-    result[SYS_USER_LANGUAGE] = _language_display_value(language_code)
-
-    for profile_item in profiles_items:
-        user_profile = next(
-            (
-                item
-                for item in user_profiles
-                if item.profile_id == profile_item.profile_id
-            ),
-            None,
-        )
-        if not user_profile:
-            user_profile = next(
-                (
-                    item
-                    for item in user_profiles
-                    if item.profile_key == profile_item.profile_key
-                ),
-                None,
-            )
-        if user_profile:
-            result[profile_item.profile_key] = user_profile.profile_value
-    return result
+    memo = _get_user_profile_memo(user_id)["profiles"]
+    result = memo.get(course_id)
+    if result is None:
+        snapshot = _get_user_profile_snapshot(app, user_id)
+        by_id = snapshot["by_id"]
+        by_key = snapshot["by_key"]
+        result = {SYS_USER_LANGUAGE: _language_display_value(snapshot["language"])}
+        for profile_item in get_profile_item_definition_list(app, course_id):
+            if profile_item.profile_id in by_id:
+                result[profile_item.profile_key] = by_id[profile_item.profile_id]
+            elif profile_item.profile_key in by_key:
+                result[profile_item.profile_key] = by_key[profile_item.profile_key]
+        memo[course_id] = result
+    # callers add their own keys, e.g. sys_user_input
+    return dict(result)
 
 
 def get_user_profile_labels(
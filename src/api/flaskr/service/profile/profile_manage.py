@@ -1,5 +1,8 @@
-from flask import Flask
+import threading
+from flask import Flask, current_app, has_app_context
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 from .models import (
     ProfileItem,
     ProfileItemValue,
@@ -25,6 +28,13 @@ from .dtos import (
     ProfileOptionListDto,
 )
 from flaskr.i18n import _, get_current_language
+from flaskr.dao.cache import (
+    ensure_invalidation_listener,
+    get_cache,
+    invalidate_on_commit,
+    subscribe_invalidation,
+)
+from flaskr.common.config import get_config
 
 from .models import (
     CONST_PROFILE_TYPE_TEXT,
@@ -93,6 +103,84 @@ def convert_profile_item_to_profile_item_definition(
     )
 
 
+PROFILE_ITEM_CACHE_TOPIC = "profile_item"
+
+# definition lists per (parent_id, type, language), only edited by creators,
+# the ttl bounds how long an invalidation missed by the listener is served
+_profile_item_cache = get_cache(
+    PROFILE_ITEM_CACHE_TOPIC,
+    maxsize=int(get_config("PROFILE_ITEM_CACHE_SIZE")),
+    ttl=int(get_config("PROFILE_ITEM_CACHE_TTL")),
+)
+# invalidation bumps the version of a parent, entries of an older version are
+# stale, also the ones a slow reader puts back after the invalidation
+_profile_item_versions: dict[str, int] = {}
+_system_profile_item_version = 0
+_profile_item_versions_lock = threading.Lock()
+
+
+def _get_profile_item_version(parent_id: str) -> tuple[int, int]:
+    return _system_profile_item_version, _profile_item_versions.get(parent_id, 0)
+
+
+def _bump_profile_item_version(parent_id: str):
+    global _system_profile_item_version
+    with _profile_item_versions_lock:
+        # system items (parent_id "") are part of every list
+        if not parent_id:
+            _system_profile_item_version += 1
+        else:
+            _profile_item_versions[parent_id] = (
+                _profile_item_versions.get(parent_id, 0) + 1
+            )
+
+
+subscribe_invalidation(PROFILE_ITEM_CACHE_TOPIC, _bump_profile_item_version)
+
+
+@event.listens_for(ProfileItem, "after_insert")
+@event.listens_for(ProfileItem, "after_update")
+@event.listens_for(ProfileItem, "after_delete")
+def _invalidate_profile_items(mapper, connection, target: ProfileItem):
+    """
+    Covers save_profile_item, update_profile_item, delete_profile_item and
+    the quick add used by the shifu editor
+    """
+    if not has_app_context():
+        return
+    parent_id = target.parent_id or ""
+    db.session.info.setdefault("dirty_profile_items", set()).add(parent_id)
+    invalidate_on_commit(
+        current_app._get_current_object(), PROFILE_ITEM_CACHE_TOPIC, parent_id
+    )
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _clear_dirty_profile_items(session: Session):
+    session.info.pop("dirty_profile_items", None)
+
+
+def _load_profile_item_definition_list(
+    app: Flask, parent_id: str, type: str
+) -> list[ProfileItemDefinition]:
+    query = ProfileItem.query.filter(
+        ProfileItem.parent_id.in_([parent_id, ""]), ProfileItem.status == 1
+    )
+    if type == CONST_PROFILE_TYPE_TEXT:
+        query = query.filter(ProfileItem.profile_type == PROFILE_TYPE_INPUT_TEXT)
+    elif type == CONST_PROFILE_TYPE_OPTION:
+        query = query.filter(ProfileItem.profile_type == PROFILE_TYPE_INPUT_SELECT)
+    elif type == "all":
+        query = query
+    app.logger.info(type)
+    profile_item_list = query.order_by(ProfileItem.profile_index.asc()).all()
+    return [
+        convert_profile_item_to_profile_item_definition(profile_item)
+        for profile_item in profile_item_list
+    ]
+
+
 # get profile item definition list
 # type: all, text, option
 # parent_id: scenario_id, profile_id
@@ -101,24 +189,21 @@ def convert_profile_item_to_profile_item_definition(
 def get_profile_item_definition_list(
     app: Flask, parent_id: str, type: str = "all"
 ) -> list[ProfileItemDefinition]:
+    if has_app_context():
+        dirty = db.session.info.get("dirty_profile_items", ())
+        if parent_id in dirty or "" in dirty:
+            # the caller changed the items and has not committed yet
+            return _load_profile_item_definition_list(app, parent_id, type)
     with app.app_context():
-        query = ProfileItem.query.filter(
-            ProfileItem.parent_id.in_([parent_id, ""]), ProfileItem.status == 1
-        )
-        if type == CONST_PROFILE_TYPE_TEXT:
-            query = query.filter(ProfileItem.profile_type == PROFILE_TYPE_INPUT_TEXT)
-        elif type == CONST_PROFILE_TYPE_OPTION:
-            query = query.filter(ProfileItem.profile_type == PROFILE_TYPE_INPUT_SELECT)
-        elif type == "all":
-            query = query
-        app.logger.info(type)
-        profile_item_list = query.order_by(ProfileItem.profile_index.asc()).all()
-        if profile_item_list:
-            return [
-                convert_profile_item_to_profile_item_definition(profile_item)
-                for profile_item in profile_item_list
-            ]
-        return []
+        ensure_invalidation_listener(app)
+        key = (parent_id, type, get_current_language())
+        version = _get_profile_item_version(parent_id)
+        cached = _profile_item_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return list(cached[1])
+        definitions = _load_profile_item_definition_list(app, parent_id, type)
+        _profile_item_cache.set(key, (version, tuple(definitions)))
+        return definitions
 
 
 def get_profile_item_definition_option_list(
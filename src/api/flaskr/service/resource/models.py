@@ -13,6 +13,13 @@ class Resource(db.Model):
     oss_bucket = Column(String(255), nullable=False, comment="OSS bucket")
     oss_name = Column(String(255), nullable=False, comment="OSS name")
     url = Column(String(255), nullable=False, comment="Resource URL")
+    content_hash = Column(
+        String(64),
+        nullable=False,
+        default="",
+        index=True,
+        comment="SHA-256 of the resource content",
+    )
     status = Column(Integer, nullable=False, comment="Resource status")
     is_deleted = Column(Integer, nullable=False, comment="Is deleted")
     created_by = Column(String(36), nullable=False, comment="Created by")
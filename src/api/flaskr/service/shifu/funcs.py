@@ -7,18 +7,31 @@ Author: yfge
 Date: 2025-08-07
 """
 
-from ...dao import redis_client as redis, db
+from ...dao import db
+from ...dao.cache import (
+    ensure_invalidation_listener,
+    get_cache,
+    invalidate_on_commit,
+    subscribe_invalidation,
+)
+from ...dao.jobs import enqueue_job, job_handler
 from .models import FavoriteScenario, AiCourseAuth
-from ..common.models import raise_error, raise_error_with_args
+from ..common.models import AppException, raise_error, raise_error_with_args
 from ...common.config import get_config
 import oss2
+from oss2.models import PartInfo
 import uuid
+import hashlib
 import json
 import requests
-from io import BytesIO
+from typing import Iterable, Iterator, Optional
+from flask import current_app, has_app_context
+from sqlalchemy import event
 from urllib.parse import urlparse
 import re
+import tempfile
 import time
+import threading
 from .models import DraftShifu
 from ...service.resource.models import Resource
 from aliyunsdkcore.client import AcsClient
@@ -101,26 +114,6 @@ def mark_or_unmark_favorite_shifu(app, user_id: str, shifu_id: str, is_favorite:
         return unmark_favorite_shifu(app, user_id, shifu_id)
 
 
-def get_content_type(filename):
-    """
-    Get the content type of a file.
-
-    Args:
-        filename: The filename to get the content type of
-    Returns:
-        The content type of the file
-    """
-
-    extension = filename.rsplit(".", 1)[1].lower()
-    if extension in ["jpg", "jpeg"]:
-        return "image/jpeg"
-    elif extension == "png":
-        return "image/png"
-    elif extension == "gif":
-        return "image/gif"
-    raise_error("FILE.FILE_TYPE_NOT_SUPPORT")
-
-
 def _warm_up_cdn(app, url: str, ALI_API_ID: str, ALI_API_SECRET: str, endpoint: str):
     """
     Warm up a CDN URL.
@@ -209,18 +202,88 @@ def _warm_up_cdn(app, url: str, ALI_API_ID: str, ALI_API_SECRET: str, endpoint:
         return False
 
 
-def _upload_to_oss(app, file_content, file_id: str, content_type: str) -> str:
+CDN_WARM_UP_JOB = "cdn.warm_up"
+
+
+@job_handler(CDN_WARM_UP_JOB, max_attempts=3)
+def _warm_up_cdn_job(app, url: str, config_prefix: str):
     """
-    Upload a file to OSS.
+    Warm up a CDN URL as a background job.
+    The credentials are read from the <config_prefix>_ENDPOINT,
+    _ACCESS_KEY_ID and _ACCESS_KEY_SECRET config, not stored with the job.
 
     Args:
         app: Flask application instance
-        file_content: The content of the file
-        file_id: The ID of the file
-        content_type: The content type of the file
+        url: The URL to warm up
+        config_prefix: e.g. ALIBABA_CLOUD_OSS_COURSES
+    """
+    if not _warm_up_cdn(
+        app,
+        url,
+        get_config(config_prefix + "_ACCESS_KEY_ID"),
+        get_config(config_prefix + "_ACCESS_KEY_SECRET"),
+        get_config(config_prefix + "_ENDPOINT"),
+    ):
+        raise RuntimeError(f"CDN warm-up of {url} failed")
+
+
+# magic numbers of the accepted file types, matched against the first bytes
+_CONTENT_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+_SNIFF_BYTES = 8
+# read size of uploaded files and downloads
+_CHUNK_SIZE = 64 * 1024
+# attempts of one part of a multipart upload
+_UPLOAD_PART_ATTEMPTS = 3
+
+
+def sniff_content_type(head: bytes) -> str:
+    """
+    Get the content type of a file from its first bytes.
+
+    Args:
+        head: The first bytes of the file
 
     Returns:
-        str: The URL of the uploaded file
+        str: The content type, raises FILE.FILE_TYPE_NOT_SUPPORT if not accepted
+    """
+    for signature, content_type in _CONTENT_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    raise_error("FILE.FILE_TYPE_NOT_SUPPORT")
+
+
+class UploadedObject:
+    """
+    Result of a streamed upload, resource is set when a resource with the
+    same content existed and its object is reused instead of uploading
+    """
+
+    def __init__(
+        self,
+        url: str,
+        bucket_name: str,
+        content_type: str,
+        content_hash: str,
+        resource: Resource = None,
+    ):
+        self.url = url
+        self.bucket_name = bucket_name
+        self.content_type = content_type
+        self.content_hash = content_hash
+        self.resource = resource
+
+
+def _get_courses_bucket(app) -> tuple[oss2.Bucket, str, str]:
+    """
+    Get the OSS bucket of course files.
+
+    Returns:
+        tuple: bucket, base URL of its files, bucket name
     """
     endpoint = get_config("ALIBABA_CLOUD_OSS_COURSES_ENDPOINT")
     ALI_API_ID = get_config("ALIBABA_CLOUD_OSS_COURSES_ACCESS_KEY_ID")
@@ -238,48 +301,229 @@ def _upload_to_oss(app, file_content, file_id: str, content_type: str) -> str:
         )
 
     auth = oss2.Auth(ALI_API_ID, ALI_API_SECRET)
-    bucket = oss2.Bucket(auth, endpoint, BUCKET_NAME)
+    return oss2.Bucket(auth, endpoint, BUCKET_NAME), FILE_BASE_URL, BUCKET_NAME
+
 
-    bucket.put_object(
-        file_id,
-        file_content,
-        headers={"Content-Type": content_type},
+def _upload_part(bucket, file_id: str, upload_id: str, part_number: int, data):
+    # a failed part is sent again, the parts before it are kept
+    for attempt in range(1, _UPLOAD_PART_ATTEMPTS + 1):
+        try:
+            result = bucket.upload_part(file_id, upload_id, part_number, data)
+            return PartInfo(part_number, result.etag)
+        except oss2.exceptions.RequestError:
+            if attempt == _UPLOAD_PART_ATTEMPTS:
+                raise
+
+
+def _find_resource_by_hash(content_hash: str) -> Resource:
+    return (
+        Resource.query.filter(
+            Resource.content_hash == content_hash,
+            Resource.is_deleted == 0,
+        )
+        .order_by(Resource.id.asc())
+        .first()
+    )
+
+
+def _read_spool(spool) -> Iterator[bytes]:
+    try:
+        yield from _read_chunks(spool)
+    finally:
+        spool.close()
+
+
+def _read_claimed_duplicate(
+    app, chunks: Iterable[bytes], expected_hash: str
+) -> tuple[Optional[UploadedObject], Iterable[bytes]]:
+    """
+    Read a file whose client-supplied hash matches an existing resource
+    before anything is sent to OSS.
+
+    The content is spooled to a temporary file and hashed, only a file
+    with the claimed content is a duplicate. The content of any other file
+    is returned to be uploaded.
+
+    Returns:
+        tuple: the existing object or None, the chunks left to upload
+    """
+    existing = _find_resource_by_hash(expected_hash)
+    if not existing:
+        return None, chunks
+    max_size = int(get_config("UPLOAD_MAX_SIZE_MB")) * 1024 * 1024
+    spool = tempfile.SpooledTemporaryFile(
+        max_size=int(get_config("UPLOAD_PART_SIZE_KB")) * 1024
+    )
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise_error("FILE.FILE_SIZE_EXCEED")
+            digest.update(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    if digest.hexdigest() != expected_hash:
+        app.logger.info(f"upload claimed {expected_hash} but has other content")
+        return None, _read_spool(spool)
+    content_type = sniff_content_type(spool.read(_SNIFF_BYTES))
+    spool.close()
+    app.logger.info(f"upload has the content of {existing.url}, nothing is stored")
+    return (
+        UploadedObject(
+            existing.url, existing.oss_bucket, content_type, expected_hash, existing
+        ),
+        (),
     )
 
-    url = FILE_BASE_URL + "/" + file_id
 
-    _warm_up_cdn(app, url, ALI_API_ID, ALI_API_SECRET, endpoint)
+def _upload_stream_to_oss(
+    app,
+    chunks: Iterable[bytes],
+    file_id: str,
+    dedupe: bool = True,
+    expected_hash: str = "",
+) -> UploadedObject:
+    """
+    Upload a file to OSS while it is read, without holding it in memory.
+
+    Parts of UPLOAD_PART_SIZE_KB are sent as a multipart upload, a file
+    smaller than one part with a single put. Files over UPLOAD_MAX_SIZE_MB
+    are rejected. The content type is sniffed from the first bytes.
+    With dedupe a file whose content hash matches an existing resource is
+    not stored again and the object of the resource is returned. The hash
+    of a file smaller than one part is known before anything is sent; for
+    larger files expected_hash, the hash claimed by the client, lets a
+    duplicate be detected before the multipart upload starts.
+    Objects are never overwritten, file_id must be a new key.
+
+    Args:
+        app: Flask application instance
+        chunks: The content of the file
+        file_id: The ID of the file, a key not used before
+        dedupe: Return the existing object of the same content
+        expected_hash: Optional, SHA-256 of the content claimed by the client
+
+    Returns:
+        UploadedObject: The uploaded file
+    """
+    if dedupe and expected_hash:
+        existing, chunks = _read_claimed_duplicate(app, chunks, expected_hash)
+        if existing:
+            return existing
+    bucket, base_url, bucket_name = _get_courses_bucket(app)
+    max_size = int(get_config("UPLOAD_MAX_SIZE_MB")) * 1024 * 1024
+    part_size = int(get_config("UPLOAD_PART_SIZE_KB")) * 1024
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    size = 0
+    content_type = None
+    upload_id = None
+    parts = []
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise_error("FILE.FILE_SIZE_EXCEED")
+            digest.update(chunk)
+            buffer += chunk
+            if content_type is None and len(buffer) >= _SNIFF_BYTES:
+                content_type = sniff_content_type(bytes(buffer[:_SNIFF_BYTES]))
+            while len(buffer) >= part_size:
+                if upload_id is None:
+                    upload_id = bucket.init_multipart_upload(
+                        file_id, headers={"Content-Type": content_type}
+                    ).upload_id
+                parts.append(
+                    _upload_part(
+                        bucket, file_id, upload_id, len(parts) + 1, buffer[:part_size]
+                    )
+                )
+                del buffer[:part_size]
+        if content_type is None:
+            content_type = sniff_content_type(bytes(buffer))
+        content_hash = digest.hexdigest()
+
+        existing = _find_resource_by_hash(content_hash) if dedupe else None
+        if existing:
+            app.logger.info(f"upload of {file_id} has the content of {existing.url}")
+            return UploadedObject(
+                existing.url, existing.oss_bucket, content_type, content_hash, existing
+            )
+        if upload_id is None:
+            bucket.put_object(
+                file_id, bytes(buffer), headers={"Content-Type": content_type}
+            )
+        else:
+            if buffer:
+                parts.append(
+                    _upload_part(bucket, file_id, upload_id, len(parts) + 1, buffer)
+                )
+            bucket.complete_multipart_upload(file_id, upload_id, parts)
+            upload_id = None
+    finally:
+        if upload_id is not None:
+            # rejected, failed or a duplicate, the uploaded parts are dropped
+            try:
+                bucket.abort_multipart_upload(file_id, upload_id)
+            except Exception as e:
+                app.logger.warning(f"abort multipart upload of {file_id} failed: {e}")
+
+    url = base_url + "/" + file_id
+    enqueue_job(
+        app, CDN_WARM_UP_JOB, {"url": url, "config_prefix": "ALIBABA_CLOUD_OSS_COURSES"}
+    )
+    return UploadedObject(url, bucket_name, content_type, content_hash)
+
 
-    return url, BUCKET_NAME
+def _read_chunks(stream) -> Iterator[bytes]:
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
 
 
-def upload_file(app, user_id: str, resource_id: str, file) -> str:
+def upload_file(
+    app, user_id: str, resource_id: str, file, content_hash: str = ""
+) -> str:
     """
     Upload a file to OSS.
 
+    Every upload is stored under a new key, an update points the resource
+    at it. Objects are shared by the resources of the same content, so
+    they are never overwritten.
+
     Args:
         app: Flask application instance
         user_id: User ID
-        resource_id: Resource ID
+        resource_id: Resource ID, empty for a new resource
         file: The file to upload
+        content_hash: Optional, SHA-256 of the file computed by the client
 
     Returns:
         str: The URL of the uploaded file
     """
     with app.app_context():
-        isUpdate = False
-        if resource_id == "":
-            file_id = str(uuid.uuid4()).replace("-", "")
-        else:
-            isUpdate = True
-            file_id = resource_id
-
-        content_type = get_content_type(file.filename)
-        url, BUCKET_NAME = _upload_to_oss(app, file, file_id, content_type)
+        file_id = str(uuid.uuid4()).replace("-", "")
+        uploaded = _upload_stream_to_oss(
+            app,
+            _read_chunks(file.stream),
+            file_id,
+            expected_hash=(content_hash or "").strip().lower(),
+        )
 
-        if isUpdate:
-            resource = Resource.query.filter_by(resource_id=file_id).first()
+        if resource_id != "":
+            resource = Resource.query.filter_by(resource_id=resource_id).first()
             resource.name = file.filename
+            resource.oss_bucket = uploaded.bucket_name
+            resource.oss_name = uploaded.bucket_name
+            resource.url = uploaded.url
+            resource.content_hash = uploaded.content_hash
             resource.updated_by = user_id
             db.session.commit()
         else:
@@ -287,9 +531,10 @@ def upload_file(app, user_id: str, resource_id: str, file) -> str:
                 resource_id=file_id,
                 name=file.filename,
                 type=0,
-                oss_bucket=BUCKET_NAME,
-                oss_name=BUCKET_NAME,
-                url=url,
+                oss_bucket=uploaded.bucket_name,
+                oss_name=uploaded.bucket_name,
+                url=uploaded.url,
+                content_hash=uploaded.content_hash,
                 status=0,
                 is_deleted=0,
                 created_by=user_id,
@@ -298,7 +543,7 @@ def upload_file(app, user_id: str, resource_id: str, file) -> str:
             db.session.add(resource)
             db.session.commit()
 
-        return url
+        return uploaded.url
 
 
 def upload_url(app, user_id: str, url: str) -> str:
@@ -335,36 +580,33 @@ def upload_url(app, user_id: str, url: str) -> str:
             }
 
             app.logger.info(f"Downloading image from URL: {clean_url}")
-            response = requests.get(clean_url, headers=headers, timeout=10)
-            response.raise_for_status()
-
-            content_type = response.headers.get("Content-Type", "")
-            if not content_type.startswith("image/"):
-                app.logger.error(f"Invalid content type: {content_type}")
-                raise_error("FILE.FILE_TYPE_NOT_SUPPORT")
-
-            file_content = BytesIO(response.content)
+            file_id = str(uuid.uuid4()).replace("-", "")
+            with requests.get(
+                clean_url, headers=headers, timeout=10, stream=True
+            ) as response:
+                response.raise_for_status()
+                content_length = response.headers.get("Content-Length")
+                max_size = int(get_config("UPLOAD_MAX_SIZE_MB")) * 1024 * 1024
+                if content_length and int(content_length) > max_size:
+                    raise_error("FILE.FILE_SIZE_EXCEED")
+                # the download is piped into the upload
+                uploaded = _upload_stream_to_oss(
+                    app, response.iter_content(_CHUNK_SIZE), file_id
+                )
 
             filename = parsed_url.path.split("/")[-1]
             if "." not in filename:
-                ext = content_type.split("/")[-1]
-                if ext in ["jpeg", "png", "gif"]:
-                    filename = f"{filename}.{ext}"
-                else:
-                    filename = f"{filename}.jpg"
-
-            content_type = get_content_type(filename)
-            file_id = str(uuid.uuid4()).replace("-", "")
-
-            url, BUCKET_NAME = _upload_to_oss(app, file_content, file_id, content_type)
+                ext = uploaded.content_type.split("/")[-1]
+                filename = f"{filename}.{'jpg' if ext == 'jpeg' else ext}"
 
             resource = Resource(
                 resource_id=file_id,
                 name=filename,
                 type=0,
-                oss_bucket=BUCKET_NAME,
-                oss_name=BUCKET_NAME,
-                url=url,
+                oss_bucket=uploaded.bucket_name,
+                oss_name=uploaded.bucket_name,
+                url=uploaded.url,
+                content_hash=uploaded.content_hash,
                 status=0,
                 is_deleted=0,
                 created_by=user_id,
@@ -373,8 +615,10 @@ def upload_url(app, user_id: str, url: str) -> str:
             db.session.add(resource)
             db.session.commit()
 
-            return url
+            return uploaded.url
 
+        except AppException:
+            raise
         except requests.RequestException as e:
             app.logger.error(
                 f"Failed to download image from URL: {url}, error: {str(e)}"
@@ -385,6 +629,124 @@ def upload_url(app, user_id: str, url: str) -> str:
             raise_error("FILE.FILE_UPLOAD_FAILED")
 
 
+SHIFU_PERMISSION_CACHE_TOPIC = "shifu_permission"
+# the creator has all the permissions
+CREATOR_AUTH_TYPES = frozenset(["view", "edit", "publish"])
+
+# permission map {shifu_bid: auth types} per user, built once from the
+# created shifus and the shares of the user
+_shifu_permission_cache = get_cache(
+    SHIFU_PERMISSION_CACHE_TOPIC,
+    maxsize=int(get_config("SHIFU_PERMISSION_CACHE_SIZE")),
+    ttl=int(get_config("SHIFU_PERMISSION_CACHE_EXPIRE")),
+)
+# invalidation bumps the version of a user, entries of an older version are
+# stale, also the ones a slow reader puts back after the invalidation
+_shifu_permission_versions: dict[str, int] = {}
+_all_shifu_permission_version = 0
+_shifu_permission_versions_lock = threading.Lock()
+
+
+def _get_shifu_permission_version(user_id: str) -> tuple[int, int]:
+    return _all_shifu_permission_version, _shifu_permission_versions.get(user_id, 0)
+
+
+def _evict_shifu_permissions(user_id: Optional[str]):
+    global _all_shifu_permission_version
+    with _shifu_permission_versions_lock:
+        if user_id is None:
+            _all_shifu_permission_version += 1
+        else:
+            _shifu_permission_versions[user_id] = (
+                _shifu_permission_versions.get(user_id, 0) + 1
+            )
+    if user_id is None:
+        _shifu_permission_cache.clear()
+    else:
+        _shifu_permission_cache.delete(user_id)
+
+
+subscribe_invalidation(SHIFU_PERMISSION_CACHE_TOPIC, _evict_shifu_permissions)
+
+
+def invalidate_shifu_permissions(app, user_id: str):
+    """
+    Drop the cached permission map of a user in every worker once the
+    current transaction commits, e.g. after a shifu is shared or unshared.
+    """
+    invalidate_on_commit(app, SHIFU_PERMISSION_CACHE_TOPIC, user_id)
+
+
+@event.listens_for(DraftShifu, "after_insert")
+def _invalidate_created_shifu_permissions(mapper, connection, target: DraftShifu):
+    if not has_app_context():
+        return
+    # a new version of a shifu already in the map changes nothing
+    cached = _shifu_permission_cache.get(target.created_user_bid)
+    if cached and cached[1].get(target.shifu_bid) == CREATOR_AUTH_TYPES:
+        return
+    invalidate_shifu_permissions(
+        current_app._get_current_object(), target.created_user_bid
+    )
+
+
+@event.listens_for(AiCourseAuth, "after_insert")
+@event.listens_for(AiCourseAuth, "after_update")
+@event.listens_for(AiCourseAuth, "after_delete")
+def _invalidate_shared_shifu_permissions(mapper, connection, target: AiCourseAuth):
+    if not has_app_context():
+        return
+    invalidate_shifu_permissions(current_app._get_current_object(), target.user_id)
+
+
+def _load_shifu_permissions(user_id: str) -> dict[str, frozenset]:
+    permissions = {}
+    auths = (
+        AiCourseAuth.query.filter(AiCourseAuth.user_id == user_id)
+        .order_by(AiCourseAuth.id.desc())
+        .all()
+    )
+    # the first share of a shifu wins, as a single lookup would find it
+    for auth in auths:
+        try:
+            auth_types = json.loads(auth.auth_type)
+        except (json.JSONDecodeError, TypeError):
+            auth_types = []
+        if not isinstance(auth_types, list):
+            auth_types = []
+        permissions[auth.course_id] = frozenset(auth_types)
+    created = (
+        db.session.query(DraftShifu.shifu_bid)
+        .filter(DraftShifu.created_user_bid == user_id)
+        .distinct()
+    )
+    for (shifu_bid,) in created:
+        permissions[shifu_bid] = CREATOR_AUTH_TYPES
+    return permissions
+
+
+def get_shifu_permissions(app, user_id: str) -> dict[str, frozenset]:
+    """
+    Get the permissions of a user to all shifus.
+
+    Args:
+        app: Flask application instance
+        user_id: User ID
+
+    Returns:
+        dict: shifu_bid to the auth types of the user, shared with the cache
+    """
+    version = _get_shifu_permission_version(user_id)
+    cached = _shifu_permission_cache.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    with app.app_context():
+        ensure_invalidation_listener(app)
+        permissions = _load_shifu_permissions(user_id)
+    _shifu_permission_cache.set(user_id, (version, permissions))
+    return permissions
+
+
 def shifu_permission_verification(
     app,
     user_id: str,
@@ -403,49 +765,7 @@ def shifu_permission_verification(
     Returns:
         bool: True if the user has the permission
     """
-    with app.app_context():
-        cache_key = (
-            get_config("REDIS_KEY_PREFIX")
-            + "shifu_permission:"
-            + user_id
-            + ":"
-            + shifu_id
-        )
-        cache_key_expire = int(get_config("SHIFU_PERMISSION_CACHE_EXPIRE"))
-        cache_result = redis.get(cache_key)
-        if cache_result is not None:
-            try:
-                cached_auth_types = json.loads(cache_result)
-                return auth_type in cached_auth_types
-            except (json.JSONDecodeError, TypeError):
-                redis.delete(cache_key)
-        # If it is not in the cache, query the database
-        shifu = DraftShifu.query.filter(
-            DraftShifu.shifu_bid == shifu_id,
-            DraftShifu.created_user_bid == user_id,
-        ).first()
-        if shifu:
-            # The creator has all the permissions
-            # Cache all permissions
-            all_auth_types = ["view", "edit", "publish"]
-            redis.set(cache_key, json.dumps(all_auth_types), cache_key_expire)
-            return True
-        else:
-            # Collaborators need to verify specific permissions
-            auth = AiCourseAuth.query.filter(
-                AiCourseAuth.course_id == shifu_id, AiCourseAuth.user_id == user_id
-            ).first()
-            if auth:
-                try:
-                    auth_types = json.loads(auth.auth_type)
-                    # Check whether the passed-in auth_type is in the array
-                    result = auth_type in auth_types
-                    redis.set(cache_key, auth_type, cache_key_expire)
-                    return result
-                except (json.JSONDecodeError, TypeError):
-                    return False
-            else:
-                return False
+    return auth_type in get_shifu_permissions(app, user_id).get(shifu_id, ())
 
 
 def get_video_info(app, user_id: str, url: str) -> dict:
@@ -33,7 +33,10 @@ from flaskr.service.lesson.const import (
     LESSON_TYPE_TRIAL,
     LESSON_TYPE_BRANCH_HIDDEN,
 )
-from flaskr.service.shifu.shifu_history_manager import HistoryItem
+from flaskr.service.shifu.shifu_history_manager import (
+    HistoryItem,
+    invalidate_shifu_struct,
+)
 from flaskr.service.profile.profile_manage import (
     get_profile_item_definition_list,
 )
@@ -414,6 +417,7 @@ def migrate_shifu_draft_to_shifu_draft_v2(app, shifu_bid: str):
         shifu_log_published_struct.created_user_bid = user_id
         shifu_log_published_struct.created_at = now_time
         db.session.add(shifu_log_published_struct)
+        invalidate_shifu_struct(app, shifu_bid)
         db.session.commit()
         plugin_manager.is_enabled = True
 
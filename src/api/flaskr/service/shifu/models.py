@@ -720,6 +720,15 @@ class PublishedOutlineItem(db.Model):
         Text, nullable=False, default="", comment="Ask agent LLM system prompt"
     )
     content = Column(Text, nullable=False, default="", comment="MarkdownFlow content")
+    summary = Column(
+        Text, nullable=False, default="", comment="Section summary for ask agent"
+    )
+    summary_hash = Column(
+        String(32),
+        nullable=False,
+        default="",
+        comment="MD5 of the prompt and model the summary was generated from",
+    )
     deleted = Column(
         SmallInteger,
         nullable=False,
@@ -450,7 +450,7 @@ def register_shifu_routes(app: Flask, path_prefix="/api/shifu"):
                                     description: publish url
         """
         user_id = request.user.user_id
-        return make_common_response(publish_shifu_draft(app, user_id, shifu_bid))
+        return make_common_response(publish_shifu_draft(app, user_id, shifu_bid).url)
 
     @app.route(path_prefix + "/shifus/<shifu_bid>/preview", methods=["POST"])
     @ShifuTokenValidation(ShifuPermission.VIEW)
@@ -1098,6 +1098,16 @@ def register_shifu_routes(app: Flask, path_prefix="/api/shifu"):
               type: file
               required: true
               description: documents
+            - in: formData
+              name: resource_id
+              type: string
+              required: false
+              description: resource id to update
+            - in: formData
+              name: content_hash
+              type: string
+              required: false
+              description: SHA-256 of the file, lets a known file skip the upload
         responses:
             200:
                 description: upload success
@@ -1120,9 +1130,12 @@ def register_shifu_routes(app: Flask, path_prefix="/api/shifu"):
         if resource_id is None:
             resource_id = ""
         user_id = request.user.user_id
+        content_hash = request.values.get("content_hash", "")
         if not file:
             raise_param_error("file")
-        return make_common_response(upload_file(app, user_id, resource_id, file))
+        return make_common_response(
+            upload_file(app, user_id, resource_id, file, content_hash)
+        )
 
     @app.route(path_prefix + "/url-upfile", methods=["POST"])
     def upload_url_api():
@@ -52,6 +52,33 @@ def __get_block_list_internal(outline_id: str) -> list[DraftBlock]:
     return blocks
 
 
+def __get_block_lists_internal(outline_ids: list[str]) -> dict[str, list[DraftBlock]]:
+    """
+    Latest blocks of several outlines in one query, by outline bid
+    """
+    if not outline_ids:
+        return {}
+    sub_query = (
+        db.session.query(db.func.max(DraftBlock.id))
+        .filter(
+            DraftBlock.outline_item_bid.in_(outline_ids),
+        )
+        .group_by(DraftBlock.outline_item_bid, DraftBlock.block_bid)
+    )
+    blocks = (
+        DraftBlock.query.filter(
+            DraftBlock.id.in_(sub_query),
+            DraftBlock.deleted == 0,
+        )
+        .order_by(DraftBlock.position.asc())
+        .all()
+    )
+    result = {outline_id: [] for outline_id in outline_ids}
+    for block in blocks:
+        result[block.outline_item_bid].append(block)
+    return result
+
+
 def get_block_list(app, user_id: str, outline_id: str) -> list[BlockDTO]:
     """
     Get block list
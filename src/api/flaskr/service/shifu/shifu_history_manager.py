@@ -37,16 +37,19 @@ format:
 """
 
 from flask import Flask
-from typing import Generic, TypeVar, List
-from pydantic import BaseModel
+from typing import Generic, TypeVar, List, Optional
+from pydantic import BaseModel, PrivateAttr
 from .models import LogDraftStruct
 from flaskr.dao import db
+from flaskr.dao.cache import invalidate_on_commit
 from flaskr.util import generate_id
 import queue
 from datetime import datetime
 
 T = TypeVar("T", bound="HistoryItem")
 
+SHIFU_STRUCT_CACHE_TOPIC = "shifu_struct"
+
 
 class HistoryItem(BaseModel, Generic[T]):
     """
@@ -57,7 +60,10 @@ class HistoryItem(BaseModel, Generic[T]):
     bid: str
     id: int
     type: str
+    # content hash of the published row, empty in draft structs
+    hash: str = ""
     children: List["HistoryItem"] = []
+    _index: Optional["HistoryIndex"] = PrivateAttr(default=None)
 
     def to_json(self):
         """
@@ -72,6 +78,117 @@ class HistoryItem(BaseModel, Generic[T]):
         """
         return cls.model_validate_json(json)
 
+    def is_leaf_outline(self) -> bool:
+        """
+        outline is a leaf when it has blocks as children or has no children
+        """
+        if self.type != "outline":
+            return False
+        return not self.children or self.children[0].type == "block"
+
+    def get_index(self) -> "HistoryIndex":
+        """
+        Get the index of the tree rooted at this item
+        it is built on first use, so the tree must not be modified afterwards
+        """
+        if self._index is None:
+            self._index = HistoryIndex(self)
+        return self._index
+
+    def find(self, bid: str) -> Optional["HistoryItem"]:
+        """
+        Find a node by bid
+        """
+        return self.get_index().by_bid.get(bid)
+
+    def find_by_id(self, type: str, id: int) -> Optional["HistoryItem"]:
+        """
+        Find a node by type and id
+        ids are only unique inside one type (shifu, outline, block)
+        """
+        return self.get_index().by_id.get((type, id))
+
+    def get_parent(self, bid: str) -> Optional["HistoryItem"]:
+        """
+        Get the parent of a node, None for the root or unknown bid
+        """
+        return self.get_index().parents.get(bid)
+
+    def get_path(self, bid: str) -> Optional[List["HistoryItem"]]:
+        """
+        Get the path from the root to a node (both included)
+        """
+        index = self.get_index()
+        node = index.by_bid.get(bid)
+        if node is None:
+            return None
+        path = [node]
+        parent = index.parents.get(node.bid)
+        while parent is not None:
+            path.append(parent)
+            parent = index.parents.get(parent.bid)
+        path.reverse()
+        return path
+
+    def get_outline_items(self) -> List["HistoryItem"]:
+        """
+        Get all outline nodes in pre-order
+        """
+        return self.get_index().outlines
+
+    def get_leaf_outline_items(self) -> List["HistoryItem"]:
+        """
+        Get the leaf outline nodes (lessons) in pre-order
+        """
+        return self.get_index().leaf_outlines
+
+    def get_next_leaf_outline_item(self, bid: str) -> Optional["HistoryItem"]:
+        """
+        Get the leaf outline that follows the given leaf outline in pre-order
+        """
+        index = self.get_index()
+        position = index.leaf_positions.get(bid)
+        if position is None or position + 1 >= len(index.leaf_outlines):
+            return None
+        return index.leaf_outlines[position + 1]
+
+
+class HistoryIndex:
+    """
+    Lookup tables of a HistoryItem tree
+    by_bid: bid -> node
+    by_id: (type, id) -> node
+    parents: bid -> parent node
+    outlines: all outline nodes in pre-order
+    leaf_outlines: leaf outline nodes in pre-order
+    leaf_positions: bid -> position in leaf_outlines
+    """
+
+    def __init__(self, root: HistoryItem):
+        self.by_bid: dict[str, HistoryItem] = {}
+        self.by_id: dict[tuple[str, int], HistoryItem] = {}
+        self.parents: dict[str, HistoryItem] = {}
+        self.outlines: List[HistoryItem] = []
+        self.leaf_outlines: List[HistoryItem] = []
+        self.leaf_positions: dict[str, int] = {}
+        # iterative pre-order walk, children pushed in reverse to keep their order
+        stack: List[tuple[HistoryItem, Optional[HistoryItem]]] = [(root, None)]
+        while stack:
+            item, parent = stack.pop()
+            if item.bid in self.by_bid:
+                continue
+            self.by_bid[item.bid] = item
+            self.by_id.setdefault((item.type, item.id), item)
+            if parent is not None:
+                self.parents[item.bid] = parent
+            if item.type == "outline":
+                self.outlines.append(item)
+                if item.is_leaf_outline():
+                    self.leaf_positions[item.bid] = len(self.leaf_outlines)
+                    self.leaf_outlines.append(item)
+            for child in reversed(item.children):
+                stack.append((child, item))
+
 
 class HistoryInfo(BaseModel):
     """
@@ -90,6 +207,17 @@ class HistoryInfo(BaseModel):
     id: int
 
 
+def invalidate_shifu_struct(app: Flask, shifu_bid: str):
+    """
+    Drop the cached struct trees of a shifu in all processes
+    after the current transaction commits
+    Args:
+        app: Flask application instance
+        shifu_bid: Shifu bid
+    """
+    invalidate_on_commit(app, SHIFU_STRUCT_CACHE_TOPIC, shifu_bid)
+
+
 def get_shifu_history(app, shifu_bid: str) -> HistoryItem:
     """
     Get shifu history
@@ -138,6 +266,7 @@ def __save_shifu_history(
     )
     db.session.add(shifu_history)
     db.session.flush()
+    invalidate_shifu_struct(app, shifu_bid)
 
 
 def save_shifu_history(app: Flask, user_id: str, shifu_bid: str, id: int):
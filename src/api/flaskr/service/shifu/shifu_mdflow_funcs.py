@@ -1,10 +1,87 @@
-from markdown_flow import MarkdownFlow
+import hashlib
+from typing import Optional
+
+from markdown_flow import MarkdownFlow, InteractionParser, LLMProvider
+from markdown_flow.models import Block
 from flask import Flask
 from flaskr.service.shifu.models import DraftOutlineItem
 from flaskr.service.common import raise_error
 from flaskr.dao import db
+from flaskr.dao.cache import get_cache, subscribe_invalidation, invalidate_on_commit
+from flaskr.common.config import get_config
 from flaskr.service.shifu.dtos import MdflowDTOParseResult
 
+OUTLINE_MDFLOW_CACHE_TOPIC = "outline_mdflow"
+
+
+class ParsedMdflow:
+    """
+    Parsed mdflow of an outline item.
+    Instances are shared between requests and must be treated as read-only.
+    """
+
+    outline_bid: str
+    mdflow: str
+    blocks: list[Block]
+
+    def __init__(self, outline_bid: str, mdflow: str):
+        self.outline_bid = outline_bid
+        self.mdflow = mdflow
+        self.blocks = MarkdownFlow(mdflow).get_all_blocks()
+        self._interactions: dict[int, dict] = {}
+
+    def get_interaction(self, block_index: int) -> dict:
+        """
+        Get the InteractionParser result of an interaction block
+        """
+        parsed = self._interactions.get(block_index)
+        if parsed is None:
+            parsed = InteractionParser().parse(self.blocks[block_index].content)
+            self._interactions[block_index] = parsed
+        return parsed
+
+    def create_markdown_flow(
+        self, llm_provider: Optional[LLMProvider] = None
+    ) -> MarkdownFlow:
+        """
+        Create a MarkdownFlow for one run.
+        MarkdownFlow keeps per-run prompt state, so it is never shared,
+        only the parsed blocks are.
+        """
+        markdown_flow = MarkdownFlow(self.mdflow, llm_provider=llm_provider)
+        markdown_flow._blocks = self.blocks
+        return markdown_flow
+
+
+_outline_mdflow_cache = get_cache(
+    OUTLINE_MDFLOW_CACHE_TOPIC, maxsize=int(get_config("OUTLINE_MDFLOW_CACHE_SIZE"))
+)
+
+
+def _evict_outline_mdflow(outline_bid: Optional[str]):
+    if outline_bid is None:
+        _outline_mdflow_cache.clear()
+        return
+    _outline_mdflow_cache.delete_where(lambda key: key[0] == outline_bid)
+
+
+subscribe_invalidation(OUTLINE_MDFLOW_CACHE_TOPIC, _evict_outline_mdflow)
+
+
+def get_parsed_mdflow(outline_bid: str, mdflow: str) -> ParsedMdflow:
+    """
+    Get the parsed mdflow of an outline item
+    The cache is keyed by outline bid and content hash, so the published
+    content is shared by all learners and edited drafts never hit a stale entry.
+    """
+    content_hash = hashlib.md5((mdflow or "").encode("utf-8")).hexdigest()
+    key = (outline_bid, content_hash)
+    parsed = _outline_mdflow_cache.get(key)
+    if parsed is None:
+        parsed = ParsedMdflow(outline_bid, mdflow or "")
+        _outline_mdflow_cache.set(key, parsed)
+    return parsed
+
 
 def get_shifu_mdflow(app: Flask, shifu_bid: str, outline_bid: str) -> str:
     """
@@ -41,6 +118,7 @@ def save_shifu_mdflow(
             raise_error("SHIFU.OUTLINE_ITEM_NOT_FOUND")
         outline_item.content = content
         outline_item.updated_user_bid = user_id
+        invalidate_on_commit(app, OUTLINE_MDFLOW_CACHE_TOPIC, outline_bid)
         db.session.commit()
 
 
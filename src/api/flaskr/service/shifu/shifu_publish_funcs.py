@@ -10,6 +10,8 @@ Date: 2025-08-07
 from flaskr.service.shifu.shifu_draft_funcs import get_latest_shifu_draft
 from flaskr.service.common import raise_error
 from flaskr.dao import db
+from flaskr.dao.jobs import enqueue_job, job_handler
+from sqlalchemy import insert
 from flaskr.service.shifu.models import (
     PublishedShifu,
     PublishedOutlineItem,
@@ -22,18 +24,27 @@ from flaskr.service.shifu.shifu_outline_funcs import (
     build_outline_tree,
     ShifuOutlineTreeNode,
 )
-from flaskr.service.shifu.shifu_block_funcs import __get_block_list_internal
-from flaskr.service.shifu.shifu_history_manager import HistoryItem
+from flaskr.service.shifu.shifu_block_funcs import __get_block_lists_internal
+from flaskr.service.shifu.shifu_history_manager import (
+    HistoryItem,
+    invalidate_shifu_struct,
+)
 from flaskr.service.shifu.shifu_struct_manager import get_shifu_outline_tree
+from flaskr.service.shifu.shifu_mdflow_funcs import OUTLINE_MDFLOW_CACHE_TOPIC
+from flaskr.dao.cache import invalidate_on_commit
 from flaskr.common import get_config
 from flaskr.util import generate_id
 from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+import hashlib
 import json
-import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import queue
 from flaskr.service.shifu.shifu_struct_manager import ShifuInfoDto
 from flaskr.api.llm import invoke_llm
+from flaskr.api.llm.rate_limit import get_model_rate_limiter
 from flaskr.api.langfuse import langfuse_client
 from flaskr.util.prompt_loader import load_prompt_template
 from flaskr.service.shifu.consts import (
@@ -41,6 +52,8 @@ from flaskr.service.shifu.consts import (
     BLOCK_TYPE_CONTENT_VALUE,
 )
 
+SHIFU_SUMMARY_JOB = "shifu.summary"
+
 
 def preview_shifu_draft(app, user_id: str, shifu_id: str, variables: dict, skip: bool):
     """
@@ -67,110 +80,225 @@ def preview_shifu_draft(app, user_id: str, shifu_id: str, variables: dict, skip:
         )
 
 
-def publish_shifu_draft(app, user_id: str, shifu_id: str):
+class PublishChanges(BaseModel):
+    """
+    What a publish wrote, by bid
+    outlines and blocks: new or changed rows
+    removed_outlines and removed_blocks: rows of the last publish that are gone
+    summary_outlines: outlines whose summary input changed, None for all
+    url: published shifu url
+    """
+
+    shifu: bool = False
+    outlines: List[str] = []
+    blocks: List[str] = []
+    removed_outlines: List[str] = []
+    removed_blocks: List[str] = []
+    summary_outlines: Optional[List[str]] = []
+    url: str = ""
+
+    def has_changes(self) -> bool:
+        return bool(
+            self.shifu
+            or self.outlines
+            or self.blocks
+            or self.removed_outlines
+            or self.removed_blocks
+        )
+
+
+def publish_shifu_draft(app, user_id: str, shifu_id: str, full: bool = False):
     """
     Publish shifu draft
-    will copy all draft data to published data
+    will copy the changed draft data to published data
     and save history to database
-    and run summary generation in background
-    and return published shifu url
+    and run summary generation of the changed outlines in background
+    and return what was published
+    Every node of the published struct keeps the content hash of its row,
+    rows whose hash is unchanged since the last publish are kept with their ids,
+    only new or changed rows are written and the replaced ones soft-deleted.
     Args:
         app: Flask application instance
         user_id: User ID
         shifu_id: Shifu ID
+        full: rewrite all rows instead of the changed ones
     Returns:
-        str: Shifu published URL
+        PublishChanges: the changed bids and the shifu published URL
     """
     with app.app_context():
         now_time = datetime.now()
         shifu_draft = get_latest_shifu_draft(shifu_id)
         if not shifu_draft:
             raise_error("SHIFU.SHIFU_NOT_FOUND")
-        PublishedShifu.query.filter_by(shifu_bid=shifu_id).update({"deleted": 1})
-        PublishedOutlineItem.query.filter_by(shifu_bid=shifu_id).update({"deleted": 1})
-        PublishedBlock.query.filter_by(shifu_bid=shifu_id).update({"deleted": 1})
-        shifu_published = PublishedShifu()
-        shifu_published.shifu_bid = shifu_id
-        shifu_published.title = shifu_draft.title
-        shifu_published.description = shifu_draft.description
-        shifu_published.avatar_res_bid = shifu_draft.avatar_res_bid
-        shifu_published.keywords = shifu_draft.keywords
-        shifu_published.llm = shifu_draft.llm
-        shifu_published.llm_temperature = shifu_draft.llm_temperature
-        shifu_published.price = shifu_draft.price
-        shifu_published.updated_user_bid = user_id
-        shifu_published.updated_at = now_time
-        db.session.add(shifu_published)
-        db.session.flush()
+        previous = None if full else _get_last_published_struct(shifu_id)
+        previous_nodes = previous.get_index().by_bid if previous else {}
+        changes = PublishChanges(url=get_config("WEB_URL") + "/c/" + shifu_id)
+
+        def reusable_id(type: str, bid: str, row_hash: str, live_ids: set[int]):
+            node = previous_nodes.get(bid)
+            if node and node.type == type and node.hash == row_hash:
+                # a live row, unless it was deleted meanwhile
+                return node.id if node.id in live_ids else None
+            return None
+
+        shifu_row = _published_shifu_row(shifu_draft, shifu_id, user_id, now_time)
+        shifu_hash = _row_hash(shifu_row)
+        shifu_published_id = reusable_id(
+            "shifu", shifu_id, shifu_hash, _live_ids(PublishedShifu, shifu_id)
+        )
+        if shifu_published_id is None:
+            changes.shifu = True
+            PublishedShifu.query.filter_by(shifu_bid=shifu_id).update({"deleted": 1})
+            shifu_published = PublishedShifu(**shifu_row)
+            db.session.add(shifu_published)
+            db.session.flush()
+            shifu_published_id = shifu_published.id
         outline_tree = build_outline_tree(app, shifu_id)
 
-        def publish_outline_item(node: ShifuOutlineTreeNode, history_item: HistoryItem):
-            outline_item = PublishedOutlineItem()
-            draft_outline_item: DraftOutlineItem = node.outline
-            outline_item.shifu_bid = shifu_id
-            outline_item.outline_item_bid = draft_outline_item.outline_item_bid
-            outline_item.title = draft_outline_item.title
-            outline_item.position = draft_outline_item.position
-            outline_item.type = draft_outline_item.type
-            outline_item.hidden = draft_outline_item.hidden
-            outline_item.parent_bid = draft_outline_item.parent_bid
-            outline_item.llm = draft_outline_item.llm
-            outline_item.llm_temperature = draft_outline_item.llm_temperature
-            outline_item.llm_system_prompt = draft_outline_item.llm_system_prompt
-            outline_item.ask_enabled_status = draft_outline_item.ask_enabled_status
-            outline_item.ask_llm = draft_outline_item.ask_llm
-            outline_item.ask_llm_temperature = draft_outline_item.ask_llm_temperature
-            outline_item.ask_llm_system_prompt = (
-                draft_outline_item.ask_llm_system_prompt
+        nodes: list[ShifuOutlineTreeNode] = []
+        stack = list(reversed(outline_tree))
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(reversed(node.children))
+        draft_blocks = __get_block_lists_internal(
+            [node.outline_id for node in nodes if not node.children]
+        )
+
+        # keep the rows whose content is unchanged, copy the others
+        live_outline_ids = _live_ids(PublishedOutlineItem, shifu_id)
+        live_block_ids = _live_ids(PublishedBlock, shifu_id)
+        hashes: dict[str, str] = {}
+        summary_outlines: set[str] = set()
+        kept_outline_ids, kept_block_ids = set(), set()
+        outline_rows, block_rows = [], []
+        for node in nodes:
+            row = _published_outline_item_row(node.outline, shifu_id, user_id, now_time)
+            hashes[node.outline_id] = _row_hash(row)
+            id = reusable_id(
+                "outline", node.outline_id, hashes[node.outline_id], live_outline_ids
             )
-            outline_item.created_user_bid = user_id
-            outline_item.created_at = now_time
-            outline_item.updated_user_bid = user_id
-            outline_item.updated_at = now_time
-            outline_item.prerequisite_item_bids = (
-                draft_outline_item.prerequisite_item_bids
+            if id is None:
+                outline_rows.append(row)
+                changes.outlines.append(node.outline_id)
+                summary_outlines.add(node.outline_id)
+            else:
+                kept_outline_ids.add(id)
+            for block in draft_blocks.get(node.outline_id, []):
+                row = _published_block_row(block, shifu_id, user_id, now_time)
+                hashes[block.block_bid] = _row_hash(row)
+                id = reusable_id(
+                    "block", block.block_bid, hashes[block.block_bid], live_block_ids
+                )
+                if id is None:
+                    block_rows.append(row)
+                    changes.blocks.append(block.block_bid)
+                    summary_outlines.add(node.outline_id)
+                else:
+                    kept_block_ids.add(id)
+        for model, stale_ids in [
+            (PublishedOutlineItem, live_outline_ids - kept_outline_ids),
+            (PublishedBlock, live_block_ids - kept_block_ids),
+        ]:
+            if stale_ids:
+                model.query.filter(model.id.in_(stale_ids)).update(
+                    {"deleted": 1}, synchronize_session=False
+                )
+        changes.removed_outlines = [
+            item.bid
+            for item in previous_nodes.values()
+            if item.type == "outline" and item.bid not in hashes
+        ]
+        changes.removed_blocks = [
+            item.bid
+            for item in previous_nodes.values()
+            if item.type == "block" and item.bid not in hashes
+        ]
+        for bid in changes.removed_blocks:
+            parent = previous.get_parent(bid)
+            if parent is not None and parent.bid in hashes:
+                summary_outlines.add(parent.bid)
+        # the shifu row holds the summary model, a change of it may touch all
+        changes.summary_outlines = (
+            None
+            if changes.shifu
+            else [
+                node.outline_id for node in nodes if node.outline_id in summary_outlines
+            ]
+        )
+        app.logger.info(
+            f"publish {shifu_id}: shifu changed={changes.shifu}, "
+            f"{len(changes.outlines)}/{len(nodes)} outlines and "
+            f"{len(changes.blocks)}/{len(block_rows) + len(kept_block_ids)} blocks "
+            f"written, {len(changes.removed_outlines)} outlines and "
+            f"{len(changes.removed_blocks)} blocks removed"
+        )
+        if not changes.has_changes():
+            # the last published struct is still current
+            db.session.commit()
+            return changes
+
+        # copy the draft rows with one multi-row insert per table
+        if outline_rows:
+            db.session.execute(insert(PublishedOutlineItem), outline_rows)
+        if block_rows:
+            db.session.execute(insert(PublishedBlock), block_rows)
+
+        # the replaced rows are deleted above, so the live rows are the current ones
+        outline_ids = dict(
+            db.session.query(
+                PublishedOutlineItem.outline_item_bid, PublishedOutlineItem.id
             )
-            outline_item.content = draft_outline_item.content
-            db.session.add(outline_item)
-            db.session.flush()
-            outline_item_history_item = HistoryItem(
-                bid=node.outline_id, id=outline_item.id, type="outline", children=[]
+            .filter(
+                PublishedOutlineItem.shifu_bid == shifu_id,
+                PublishedOutlineItem.deleted == 0,
             )
-            history_item.children.append(outline_item_history_item)
-            if node.children and len(node.children) > 0:
+            .all()
+        )
+        block_ids = {
+            (outline_item_bid, block_bid): id
+            for outline_item_bid, block_bid, id in db.session.query(
+                PublishedBlock.outline_item_bid,
+                PublishedBlock.block_bid,
+                PublishedBlock.id,
+            )
+            .filter(PublishedBlock.shifu_bid == shifu_id, PublishedBlock.deleted == 0)
+            .all()
+        }
+
+        def history_of(node: ShifuOutlineTreeNode) -> HistoryItem:
+            outline_history_item = HistoryItem(
+                bid=node.outline_id,
+                id=outline_ids[node.outline_id],
+                type="outline",
+                hash=hashes[node.outline_id],
+                children=[],
+            )
+            if node.children:
                 for child in node.children:
-                    publish_outline_item(child, outline_item_history_item)
+                    outline_history_item.children.append(history_of(child))
             else:
-                draft_blocks: list[DraftBlock] = __get_block_list_internal(
-                    draft_outline_item.outline_item_bid
-                )
-                for block in draft_blocks:
-                    block_item = PublishedBlock()
-                    block_item.shifu_bid = shifu_id
-                    block_item.block_bid = block.block_bid
-                    block_item.position = block.position
-                    block_item.variable_bids = block.variable_bids
-                    block_item.resource_bids = block.resource_bids
-                    block_item.type = block.type
-                    block_item.created_user_bid = user_id
-                    block_item.created_at = now_time
-                    block_item.updated_user_bid = user_id
-                    block_item.updated_at = now_time
-                    block_item.outline_item_bid = draft_outline_item.outline_item_bid
-                    block_item.content = block.content
-                    db.session.add(block_item)
-                    db.session.flush()
-                    block_history_item = HistoryItem(
-                        bid=block.block_bid, id=block_item.id, type="block", children=[]
+                for block in draft_blocks.get(node.outline_id, []):
+                    outline_history_item.children.append(
+                        HistoryItem(
+                            bid=block.block_bid,
+                            id=block_ids[(node.outline_id, block.block_bid)],
+                            type="block",
+                            hash=hashes[block.block_bid],
+                            children=[],
+                        )
                     )
-                    outline_item_history_item.children.append(block_history_item)
-                    db.session.flush()
+            return outline_history_item
 
         history_item = HistoryItem(
-            bid=shifu_id, id=shifu_published.id, type="shifu", children=[]
+            bid=shifu_id,
+            id=shifu_published_id,
+            type="shifu",
+            hash=shifu_hash,
+            children=[],
         )
         for node in outline_tree:
-            publish_outline_item(node, history_item)
+            history_item.children.append(history_of(node))
 
         shifu_log_published_struct = LogPublishedStruct()
         shifu_log_published_struct.struct_bid = generate_id(app)
@@ -179,35 +307,135 @@ def publish_shifu_draft(app, user_id: str, shifu_id: str):
         shifu_log_published_struct.created_user_bid = user_id
         shifu_log_published_struct.created_at = now_time
         db.session.add(shifu_log_published_struct)
+        invalidate_shifu_struct(app, shifu_id)
+        # parsed mdflows of unchanged outlines stay valid
+        for outline_bid in changes.outlines + changes.removed_outlines:
+            invalidate_on_commit(app, OUTLINE_MDFLOW_CACHE_TOPIC, outline_bid)
         db.session.commit()
-        thread = threading.Thread(
-            target=_run_summary_with_error_handling, args=(app, shifu_id)
+        # one summary job per published struct
+        enqueue_job(
+            app,
+            SHIFU_SUMMARY_JOB,
+            {"shifu_id": shifu_id, "outline_bids": changes.summary_outlines},
+            key=f"{SHIFU_SUMMARY_JOB}:{shifu_log_published_struct.struct_bid}",
+            user_bid=user_id,
         )
-        thread.daemon = True  # Ensure thread doesn't prevent app shutdown
-        thread.start()
-        db.session.commit()
-        return get_config("WEB_URL") + "/c/" + shifu_id
+        return changes
+
+
+def _get_last_published_struct(shifu_id: str) -> Optional[HistoryItem]:
+    struct = (
+        LogPublishedStruct.query.with_entities(LogPublishedStruct.struct)
+        .filter(LogPublishedStruct.shifu_bid == shifu_id)
+        .order_by(LogPublishedStruct.id.desc())
+        .limit(1)
+        .scalar()
+    )
+    return HistoryItem.from_json(struct) if struct else None
+
+
+def _live_ids(model, shifu_id: str) -> set[int]:
+    return {
+        id
+        for (id,) in db.session.query(model.id)
+        .filter(model.shifu_bid == shifu_id, model.deleted == 0)
+        .all()
+    }
+
+
+# columns that change with every publish, not part of the content hash
+_AUDIT_COLUMNS = ("created_user_bid", "created_at", "updated_user_bid", "updated_at")
+
+
+def _row_hash(row: dict) -> str:
+    content = {k: v for k, v in row.items() if k not in _AUDIT_COLUMNS}
+    return hashlib.md5(
+        json.dumps(content, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def _published_shifu_row(shifu_draft, shifu_id: str, user_id: str, now_time) -> dict:
+    return {
+        "shifu_bid": shifu_id,
+        "title": shifu_draft.title,
+        "description": shifu_draft.description,
+        "avatar_res_bid": shifu_draft.avatar_res_bid,
+        "keywords": shifu_draft.keywords,
+        "llm": shifu_draft.llm,
+        "llm_temperature": shifu_draft.llm_temperature,
+        "price": shifu_draft.price,
+        "updated_user_bid": user_id,
+        "updated_at": now_time,
+    }
+
+
+def _published_outline_item_row(
+    draft_outline_item: DraftOutlineItem, shifu_id: str, user_id: str, now_time
+) -> dict:
+    return {
+        "shifu_bid": shifu_id,
+        "outline_item_bid": draft_outline_item.outline_item_bid,
+        "title": draft_outline_item.title,
+        "position": draft_outline_item.position,
+        "type": draft_outline_item.type,
+        "hidden": draft_outline_item.hidden,
+        "parent_bid": draft_outline_item.parent_bid,
+        "llm": draft_outline_item.llm,
+        "llm_temperature": draft_outline_item.llm_temperature,
+        "llm_system_prompt": draft_outline_item.llm_system_prompt,
+        "ask_enabled_status": draft_outline_item.ask_enabled_status,
+        "ask_llm": draft_outline_item.ask_llm,
+        "ask_llm_temperature": draft_outline_item.ask_llm_temperature,
+        "ask_llm_system_prompt": draft_outline_item.ask_llm_system_prompt,
+        "created_user_bid": user_id,
+        "created_at": now_time,
+        "updated_user_bid": user_id,
+        "updated_at": now_time,
+        "prerequisite_item_bids": draft_outline_item.prerequisite_item_bids,
+        "content": draft_outline_item.content,
+    }
 
 
-def _run_summary_with_error_handling(app, shifu_id):
+def _published_block_row(
+    block: DraftBlock, shifu_id: str, user_id: str, now_time
+) -> dict:
+    return {
+        "shifu_bid": shifu_id,
+        "block_bid": block.block_bid,
+        "position": block.position,
+        "variable_bids": block.variable_bids,
+        "resource_bids": block.resource_bids,
+        "type": block.type,
+        "created_user_bid": user_id,
+        "created_at": now_time,
+        "updated_user_bid": user_id,
+        "updated_at": now_time,
+        "outline_item_bid": block.outline_item_bid,
+        "content": block.content,
+    }
+
+
+@job_handler(SHIFU_SUMMARY_JOB, max_attempts=3)
+def _run_summary_job(app, shifu_id, outline_bids=None):
     """
-    Run shifu summary generation with error handling
+    Run shifu summary generation as a background job, failed attempts are
+    retried and resume with the sections not summarized yet
     Args:
         app: Flask application instance
         shifu_id: Shifu ID
+        outline_bids: Optional, the outlines changed by the publish, None for all
     """
-    try:
-        get_shifu_summary(app, shifu_id)
-    except Exception as e:
-        app.logger.error(f"Failed to generate shifu summary for {shifu_id}: {str(e)}")
+    get_shifu_summary(app, shifu_id, outline_bids)
 
 
-def get_shifu_summary(app, shifu_id: str):
+def get_shifu_summary(app, shifu_id: str, outline_bids: Optional[list[str]] = None):
     """
     Obtain the shifu summary information
     Args:
         app: Flask application instance
         shifu_id: Shifu ID
+        outline_bids: Optional, only summarize these sections again, the others
+            keep their summary; None summarizes all sections
     """
     with app.app_context():
         shifu: PublishedShifu = (
@@ -230,7 +458,13 @@ def get_shifu_summary(app, shifu_id: str):
 
         # Generate summaries
         outline_summary_map = _generate_summaries(
-            app, outline_tree, all_blocks, lesson_map, summary_prompt_template, shifu
+            app,
+            outline_tree,
+            all_blocks,
+            lesson_map,
+            summary_prompt_template,
+            shifu,
+            outline_bids,
         )
 
         # Generate ask_prompt
@@ -306,9 +540,14 @@ def _generate_summaries(
     outline_item_map: dict[str, PublishedOutlineItem],
     summary_prompt_template,
     shifu: PublishedShifu,
+    outline_bids: Optional[list[str]] = None,
 ) -> dict[str, dict]:
     """
     Generate summaries for all sections
+    Sections outside outline_bids that already have a summary keep it.
+    Sections whose prompt and model are unchanged reuse the summary of an
+    earlier publish. The others run in a bounded thread pool and every
+    finished summary is committed, so an interrupted run resumes where it stopped.
     Args:
         app: Flask application instance
         outline_tree: Outline tree
@@ -316,10 +555,12 @@ def _generate_summaries(
         outline_item_map: Outline item mapping
         summary_prompt_template: Summary template
         shifu: Course information
+        outline_bids: Optional, the sections to summarize again, None for all
     Returns:
         Summary mapping
     """
     outline_summary_map = {}
+    changed = None if outline_bids is None else set(outline_bids)
 
     # Get model configuration
     model_name = shifu.ask_llm or shifu.llm
@@ -327,8 +568,19 @@ def _generate_summaries(
     if not model_name:
         model_name = app.config.get("DEFAULT_LLM_MODEL", "")
 
+    sections = []
     for chapter in outline_tree.outline_items:
         for section in chapter.children:
+            outline_item = outline_item_map.get(section.bid)
+            if not outline_item:
+                continue
+            if (
+                changed is not None
+                and section.bid not in changed
+                and outline_item.summary
+            ):
+                sections.append((chapter, section, outline_item, None, None))
+                continue
             section_blocks = all_blocks.get(section.bid, [])
             content_blocks = [
                 block
@@ -342,32 +594,113 @@ def _generate_summaries(
             final_prompt = summary_prompt_template.format(
                 all_script_content=now_lesson_script_prompts
             )
-
-            summary = _get_summary(
-                app,
-                prompt=final_prompt,
-                model_name=model_name,
-                temperature=temperature,
+            summary_hash = hashlib.md5(
+                f"{model_name}\n{temperature}\n{final_prompt}".encode("utf-8")
+            ).hexdigest()
+            sections.append(
+                (chapter, section, outline_item, final_prompt, summary_hash)
             )
 
-            # Update section information
-            outline_item = outline_item_map.get(section.bid)
-            if outline_item:
-                outline_item.summary = summary
-                outline_item.ask_enabled_status = ASK_MODE_ENABLE
-
-                # Store summary information
-                outline_summary_map[section.bid] = {
-                    "chapter_id": chapter.bid,
-                    "chapter_name": chapter.title,
-                    "section_id": section.bid,
-                    "section_name": section.title,
-                    "content": summary,
-                }
+    # Reuse summaries generated from the same prompt by earlier publishes
+    previous_summaries = _get_previous_summaries(
+        app,
+        [s[2].outline_item_bid for s in sections if s[4] is not None],
+        [s[4] for s in sections if s[4] is not None],
+    )
+    pending = []
+    for chapter, section, outline_item, final_prompt, summary_hash in sections:
+        if summary_hash is None:
+            # unchanged by the publish
+            continue
+        if outline_item.summary and outline_item.summary_hash == summary_hash:
+            continue
+        summary = previous_summaries.get((section.bid, summary_hash))
+        if summary:
+            outline_item.summary = summary
+            outline_item.summary_hash = summary_hash
+        else:
+            pending.append((outline_item, final_prompt, summary_hash))
+    db.session.commit()
+    app.logger.info(
+        f"shifu summary {shifu.shifu_bid}: {len(sections)} sections, "
+        f"{len(pending)} to generate"
+    )
+
+    if pending:
+        max_workers = min(
+            int(app.config.get("SHIFU_SUMMARY_CONCURRENCY")), len(pending)
+        )
+        with ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="shifu-summary"
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _get_summary,
+                    app,
+                    prompt=final_prompt,
+                    model_name=model_name,
+                    temperature=temperature,
+                ): (outline_item, summary_hash)
+                for outline_item, final_prompt, summary_hash in pending
+            }
+            error = None
+            for future in as_completed(futures):
+                outline_item, summary_hash = futures[future]
+                try:
+                    outline_item.summary = future.result()
+                except Exception as e:
+                    app.logger.error(
+                        f"shifu summary {outline_item.outline_item_bid} failed: {e}"
+                    )
+                    error = error or e
+                    continue
+                outline_item.summary_hash = summary_hash
+                db.session.commit()
+            if error:
+                # finished sections are kept, a rerun only generates the rest
+                raise error
+
+    for chapter, section, outline_item, _, _ in sections:
+        outline_item.ask_enabled_status = ASK_MODE_ENABLE
+
+        # Store summary information
+        outline_summary_map[section.bid] = {
+            "chapter_id": chapter.bid,
+            "chapter_name": chapter.title,
+            "section_id": section.bid,
+            "section_name": section.title,
+            "content": outline_item.summary,
+        }
 
     return outline_summary_map
 
 
+def _get_previous_summaries(
+    app, outline_item_bids: list[str], summary_hashes: list[str]
+) -> dict[tuple[str, str], str]:
+    """
+    Get summaries of earlier publishes
+    Returns:
+        {(outline_item_bid, summary_hash): summary}
+    """
+    if not outline_item_bids:
+        return {}
+    rows = (
+        db.session.query(
+            PublishedOutlineItem.outline_item_bid,
+            PublishedOutlineItem.summary_hash,
+            PublishedOutlineItem.summary,
+        )
+        .filter(
+            PublishedOutlineItem.outline_item_bid.in_(outline_item_bids),
+            PublishedOutlineItem.summary_hash.in_(set(summary_hashes)),
+            PublishedOutlineItem.summary != "",
+        )
+        .all()
+    )
+    return {(row[0], row[1]): row[2] for row in rows}
+
+
 def _get_shifu_data(
     app, shifu_id: str
 ) -> tuple[
@@ -470,26 +803,28 @@ def _get_summary(app, prompt, model_name, user_id=None, temperature=0.8):
     Returns:
         Summary text
     """
-    # Create langfuse trace/span
-    trace = langfuse_client.trace(
-        user_id=user_id or "shifu-summary", name="shifu_summary"
-    )
-    span = trace.span(name="shifu_summary", input=prompt)
-    response = invoke_llm(
-        app,
-        user_id or "shifu-summary",
-        span,
-        model_name,
-        prompt,
-        temperature=temperature,
-        generation_name="shifu_summary",
-    )
-    summary = ""
-    for chunk in response:
-        summary += getattr(chunk, "result", "")
-    span.update(output=summary)
-    span.end()
-    return summary
+    get_model_rate_limiter(model_name).acquire()
+    with app.app_context():
+        # Create langfuse trace/span
+        trace = langfuse_client.trace(
+            user_id=user_id or "shifu-summary", name="shifu_summary"
+        )
+        span = trace.span(name="shifu_summary", input=prompt)
+        response = invoke_llm(
+            app,
+            user_id or "shifu-summary",
+            span,
+            model_name,
+            prompt,
+            temperature=temperature,
+            generation_name="shifu_summary",
+        )
+        summary = ""
+        for chunk in response:
+            summary += getattr(chunk, "result", "")
+        span.update(output=summary)
+        span.end()
+        return summary
 
 
 def _build_summary_text(summaries: list[dict], is_learned: bool) -> str:
@@ -21,9 +21,17 @@ from flaskr.service.shifu.models import (
     PublishedOutlineItem,
 )
 
-from flaskr.service.shifu.shifu_history_manager import HistoryItem
+from flaskr.service.shifu.shifu_history_manager import (
+    HistoryItem,
+    SHIFU_STRUCT_CACHE_TOPIC,
+)
 from flaskr.service.common import raise_error
-import queue
+from flaskr.dao.cache import (
+    get_cache,
+    subscribe_invalidation,
+    ensure_invalidation_listener,
+)
+from flaskr.common.config import get_config
 from typing import List, Union
 from pydantic import BaseModel
 from decimal import Decimal
@@ -62,36 +70,94 @@ class ShifuInfoDto(BaseModel):
         return self.model_dump_json(exclude_none=True)
 
 
-def get_shifu_struct(
-    app: Flask, shifu_bid: str, is_preview: bool = False
-) -> HistoryItem:
+# parsed struct trees, keyed by (shifu_bid, is_preview, struct id)
+# a struct row is never updated, so an entry is valid as long as its id is the newest
+_shifu_struct_cache = get_cache(
+    SHIFU_STRUCT_CACHE_TOPIC, maxsize=int(get_config("SHIFU_STRUCT_CACHE_SIZE"))
+)
+
+
+def _evict_shifu_struct(shifu_bid: str):
+    if shifu_bid is None:
+        _shifu_struct_cache.clear()
+    else:
+        _shifu_struct_cache.delete_where(lambda key: key[0] == shifu_bid)
+
+
+subscribe_invalidation(SHIFU_STRUCT_CACHE_TOPIC, _evict_shifu_struct)
+
+
+def get_shifu_struct_cache_stats() -> dict:
     """
-    Get shifu struct
+    Get shifu struct cache stats (size, hits, misses ...)
+    """
+    return _shifu_struct_cache.stats()
+
+
+def get_shifu_struct_id(app: Flask, shifu_bid: str, is_preview: bool = False) -> int:
+    """
+    Get the id of the newest struct of a shifu, it changes whenever the struct does
     Args:
         app: Flask application instance
         shifu_bid: Shifu bid
         is_preview: Is preview
     Returns:
-        HistoryItem: Shifu struct
+        int: struct id
     """
     with app.app_context():
-        app.logger.info(f"get_shifu_struct:{shifu_bid},{is_preview}")
         if is_preview:
             model = LogDraftStruct
         else:
             model = LogPublishedStruct
-        shifu_struct = (
-            model.query.filter(
+        struct_id = (
+            model.query.with_entities(model.id)
+            .filter(
                 model.shifu_bid == shifu_bid,
             )
             .order_by(
                 model.id.desc(),
             )
-            .first()
+            .limit(1)
+            .scalar()
         )
+        if not struct_id:
+            raise_error("SHIFU.SHIFU_NOT_FOUND")
+        return struct_id
+
+
+def get_shifu_struct(
+    app: Flask, shifu_bid: str, is_preview: bool = False, struct_id: int = None
+) -> HistoryItem:
+    """
+    Get shifu struct
+    the returned tree is shared by all requests of the process and must not be modified
+    Args:
+        app: Flask application instance
+        shifu_bid: Shifu bid
+        is_preview: Is preview
+        struct_id: Optional, id from get_shifu_struct_id, saves the lookup
+    Returns:
+        HistoryItem: Shifu struct
+    """
+    with app.app_context():
+        app.logger.info(f"get_shifu_struct:{shifu_bid},{is_preview}")
+        ensure_invalidation_listener(app)
+        if is_preview:
+            model = LogDraftStruct
+        else:
+            model = LogPublishedStruct
+        if not struct_id:
+            struct_id = get_shifu_struct_id(app, shifu_bid, is_preview)
+        cache_key = (shifu_bid, is_preview, struct_id)
+        struct = _shifu_struct_cache.get(cache_key)
+        if struct is not None:
+            return struct
+        shifu_struct = model.query.filter(model.id == struct_id).first()
         if not shifu_struct:
             raise_error("SHIFU.SHIFU_NOT_FOUND")
-        return HistoryItem.from_json(shifu_struct.struct)
+        struct = HistoryItem.from_json(shifu_struct.struct)
+        _shifu_struct_cache.set(cache_key, struct)
+        return struct
 
 
 def get_shifu_outline_tree(
@@ -107,19 +173,8 @@ def get_shifu_outline_tree(
             shifu_model = PublishedShifu
             outline_item_model = PublishedOutlineItem
 
-        shifu_ids = []
-        outline_item_ids = []
-        q = queue.Queue()
-        q.put(struct)
-        while not q.empty():
-            item = q.get()
-            if item.type == "shifu":
-                shifu_ids.append(item.id)
-            elif item.type == "outline":
-                outline_item_ids.append(item.id)
-            if item.children:
-                for child in item.children:
-                    q.put(child)
+        shifu_ids = [struct.id] if struct.type == "shifu" else []
+        outline_item_ids = [item.id for item in struct.get_outline_items()]
         if len(shifu_ids) != 1:
             raise_error("SHIFU.SHIFU_NOT_FOUND")
         shifu: Union[DraftShifu, PublishedShifu] = shifu_model.query.filter(
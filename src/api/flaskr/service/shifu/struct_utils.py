@@ -24,7 +24,8 @@ def find_node_with_parents(
         Optional[list[HistoryItem]]: Path to target node
     """
     if current_path is None:
-        current_path = []
+        # O(depth) lookup through the tree index
+        return root.get_path(target_bid)
     current_path.append(root)
     if root.bid == target_bid:
         return current_path.copy()
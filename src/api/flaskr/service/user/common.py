@@ -1,9 +1,13 @@
 # common user
 
 
+import copy
 import random
 import string
-from flask import Flask
+from typing import Optional
+
+from flask import Flask, current_app, has_app_context
+from sqlalchemy import event
 
 import jwt
 
@@ -12,6 +16,14 @@ from flaskr.api.sms.aliyun import send_sms_code_ali
 from ..common.dtos import UserInfo, UserToken
 from ..common.models import raise_error
 from ...dao import redis_client as redis, db
+from ...dao.cache import (
+    ensure_invalidation_listener,
+    get_cache,
+    invalidate_on_commit,
+    publish_invalidation,
+    subscribe_invalidation,
+)
+from flaskr.common.config import get_config
 from flaskr.i18n import get_i18n_list
 from .auth import get_provider
 from .auth.base import VerificationRequest
@@ -27,6 +39,53 @@ def _user_info_from_legacy(app: Flask, legacy_user: User) -> UserInfo:
     return build_user_info_dto(legacy_user)
 
 
+USER_SESSION_CACHE_TOPIC = "user_session"
+
+# validated UserInfo per (user_id, token), the ttl bounds how long a revocation
+# missed by the pub/sub listener keeps a token alive in a worker
+_user_session_cache = get_cache(
+    USER_SESSION_CACHE_TOPIC,
+    maxsize=int(get_config("USER_SESSION_CACHE_SIZE")),
+    ttl=int(get_config("USER_SESSION_CACHE_TTL")),
+)
+
+
+def _evict_user_session(key: Optional[str]):
+    # keys are "token:<token>" or "user:<user_id>"
+    if key is None:
+        _user_session_cache.clear()
+        return
+    kind, _, value = key.partition(":")
+    if kind == "token":
+        _user_session_cache.delete_where(lambda k: k[1] == value)
+    elif kind == "user":
+        _user_session_cache.delete_where(lambda k: k[0] == value)
+
+
+subscribe_invalidation(USER_SESSION_CACHE_TOPIC, _evict_user_session)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_user_sessions(mapper, connection, target: User):
+    if not has_app_context():
+        return
+    invalidate_on_commit(
+        current_app._get_current_object(),
+        USER_SESSION_CACHE_TOPIC,
+        "user:" + target.user_id,
+    )
+
+
+def revoke_token(app: Flask, token: str):
+    """
+    Revoke a token, e.g. on logout or when it is replaced by a new one.
+    Every worker drops its cached session of the token.
+    """
+    with app.app_context():
+        redis.delete(app.config["REDIS_KEY_PREFIX_USER"] + token)
+        publish_invalidation(app, USER_SESSION_CACHE_TOPIC, "token:" + token)
+
+
 def validate_user(app: Flask, token: str) -> UserInfo:
     with app.app_context():
         if not token:
@@ -34,38 +93,49 @@ def validate_user(app: Flask, token: str) -> UserInfo:
         try:
             if app.config.get("ENVERIMENT", "prod") == "dev":
                 user_id = token
-                user = User.query.filter_by(user_id=user_id).first()
-
-                if user:
-                    return _user_info_from_legacy(app, user)
             else:
                 user_id = jwt.decode(
                     token, app.config["SECRET_KEY"], algorithms=["HS256"]
                 )["user_id"]
-                app.logger.info("user_id:" + user_id)
-
-            app.logger.info("user_id:" + user_id)
-            redis_user_id = redis.get(app.config["REDIS_KEY_PREFIX_USER"] + token)
-            if redis_user_id is None:
-                raise_error("USER.USER_TOKEN_EXPIRED")
-            set_user_id = str(
-                redis_user_id,
-                encoding="utf-8",
-            )
-            if set_user_id == user_id:
-                legacy_user, _ = load_user_with_entity(app, user_id)
-                if legacy_user:
-                    return _user_info_from_legacy(app, legacy_user)
-                else:
-                    raise_error("USER.USER_TOKEN_EXPIRED")
-            else:
-                raise_error("USER.USER_TOKEN_EXPIRED")
+            if not _user_session_cache.ttl:
+                return _validate_user(app, token, user_id)
+            ensure_invalidation_listener(app)
+            user_info = _user_session_cache.get((user_id, token))
+            if user_info is None:
+                user_info = _validate_user(app, token, user_id)
+                _user_session_cache.set((user_id, token), user_info)
+            # callers may change the dto of their request
+            return copy.copy(user_info)
         except jwt.exceptions.ExpiredSignatureError:
             raise_error("USER.USER_TOKEN_EXPIRED")
         except jwt.exceptions.DecodeError:
             raise_error("USER.USER_NOT_FOUND")
 
 
+def _validate_user(app: Flask, token: str, user_id: str) -> UserInfo:
+    if app.config.get("ENVERIMENT", "prod") == "dev":
+        user = User.query.filter_by(user_id=user_id).first()
+        if user:
+            return _user_info_from_legacy(app, user)
+
+    app.logger.info("user_id:" + user_id)
+    redis_user_id = redis.get(app.config["REDIS_KEY_PREFIX_USER"] + token)
+    if redis_user_id is None:
+        raise_error("USER.USER_TOKEN_EXPIRED")
+    set_user_id = str(
+        redis_user_id,
+        encoding="utf-8",
+    )
+    if set_user_id == user_id:
+        legacy_user, _ = load_user_with_entity(app, user_id)
+        if legacy_user:
+            return _user_info_from_legacy(app, legacy_user)
+        else:
+            raise_error("USER.USER_TOKEN_EXPIRED")
+    else:
+        raise_error("USER.USER_TOKEN_EXPIRED")
+
+
 def update_user_info(
     app: Flask,
     user: UserInfo,
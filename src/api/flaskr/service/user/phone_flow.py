@@ -43,6 +43,7 @@ def configure_fix_check_code(value: Optional[str]) -> None:
 def migrate_user_study_record(
     app: Flask, from_user_id: str, to_user_id: str, course_id: Optional[str] = None
 ) -> None:
+    from flaskr.service.learn.learn_funcs import invalidate_learn_progress
     from flaskr.service.learn.models import LearnProgressRecord
 
     app.logger.info(
@@ -92,6 +93,10 @@ def migrate_user_study_record(
             )
         )
     )
+    # the raw updates bypass the mapper events of the records
+    for shifu_bid in {attend.shifu_bid for attend in migrate_attends}:
+        invalidate_learn_progress(app, shifu_bid, from_user_id)
+        invalidate_learn_progress(app, shifu_bid, to_user_id)
     db.session.flush()
 
 
@@ -13,6 +13,7 @@ from .utils import generate_token
 from ...service.common.dtos import USER_STATE_UNREGISTERED, UserToken
 from ...service.user.models import User, UserConversion
 from ...dao import db
+from ...dao.jobs import enqueue_job
 from ...api.wechat import get_wechat_access_token
 import oss2
 from .repository import build_user_info_dto, sync_user_entity_for_legacy
@@ -157,11 +158,13 @@ def upload_user_avatar(app: Flask, user_id: str, avatar) -> str:
             db.session.commit()
             sync_user_entity_for_legacy(app, user)
 
-            from ..shifu.funcs import _warm_up_cdn
+            from ..shifu.funcs import CDN_WARM_UP_JOB
 
-            if not _warm_up_cdn(app, url, ALI_API_ID, ALI_API_SECRET, endpoint):
-                app.logger.warning(
-                    "The user avatar URL is inaccessible, but the URL continues to be returned"
-                )
+            enqueue_job(
+                app,
+                CDN_WARM_UP_JOB,
+                {"url": url, "config_prefix": "ALIBABA_CLOUD_OSS"},
+                user_bid=user_id,
+            )
 
             return url
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Benchmark the per chunk overhead of LLM stream accounting on the request thread.
+
+Modes:
+    inline      string concatenation per chunk, whole prompt and response
+                logged, Langfuse generation created and ended on the request thread
+    accounting  StreamAccounting: chunks in a list, truncated logs, the
+                generation exported by the background exporter
+
+No LLM is called, a stream of pre-built chunks is accounted. Langfuse is a
+real client pointed at an unreachable host, so the request thread pays for
+building the events but nothing is sent. Logs go to /dev/null.
+
+Usage (from src/api):
+    python scripts/bench_llm_accounting.py --chunks 2000 --runs 50
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def _inline(app, span, prompt, chunks):
+    app.logger.info(f"invoke_llm [bench] {prompt}")
+    generation = span.generation(model="bench", input=prompt, name="bench")
+    response_text = ""
+    start_completion_time = None
+    for chunk in chunks:
+        if start_completion_time is None:
+            start_completion_time = datetime.now()
+        response_text += chunk
+    app.logger.info(f"invoke_llm response: {response_text} ")
+    generation.end(
+        input=prompt,
+        output=response_text,
+        metadata={},
+        completion_start_time=start_completion_time,
+    )
+    span.update(output=response_text)
+
+
+def _accounting(app, span, prompt, chunks):
+    from flaskr.api.llm.accounting import StreamAccounting, truncate_log
+
+    app.logger.info(f"invoke_llm [bench] {truncate_log(prompt)}")
+    accounting = StreamAccounting(app, span, "bench", "bench", prompt)
+    for chunk in chunks:
+        accounting.add(chunk)
+    accounting.finish(metadata={}, update_span=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--prompt-size", type=int, default=8000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--modes", default="inline,accounting")
+    args = parser.parse_args()
+
+    from flask import Flask
+    from langfuse import Langfuse
+
+    for name in ("langfuse", "backoff"):
+        logging.getLogger(name).disabled = True
+    app = Flask("bench")
+    app.logger.handlers = [logging.FileHandler(os.devnull)]
+    app.logger.setLevel(logging.INFO)
+    # the llm package resolves the configured providers on import
+    with app.app_context():
+        from flaskr.api.llm.accounting import get_trace_exporter
+    langfuse = Langfuse(
+        public_key="pk-bench",
+        secret_key="sk-bench",
+        host="http://127.0.0.1:9",
+        max_retries=0,
+    )
+    prompt = "p" * args.prompt_size
+    chunks = ["c" * args.chunk_size] * args.chunks
+    modes = {"inline": _inline, "accounting": _accounting}
+
+    for mode in args.modes.split(","):
+        run = modes[mode.strip()]
+        timings = []
+        for _ in range(args.runs):
+            span = langfuse.trace(name="bench").span(name="bench")
+            start = time.perf_counter()
+            run(app, span, prompt, chunks)
+            timings.append(time.perf_counter() - start)
+        get_trace_exporter().flush()
+        per_chunk = [t / args.chunks * 1e6 for t in timings]
+        print(
+            f"{mode:10s} chunks={args.chunks} runs={args.runs} "
+            f"per_chunk_us p50={statistics.median(per_chunk):7.3f} "
+            f"max={max(per_chunk):7.3f} "
+            f"stream_ms p50={statistics.median(timings) * 1000:7.3f}"
+        )
+    langfuse.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Benchmark concurrent LLM streams per process against a local fake OpenAI server.
+
+Modes:
+    sync     the previous behaviour, one blocking openai.Client stream per thread
+    adapter  invoke_llm called from threads, streaming over the shared async client
+    async    ainvoke_llm streams multiplexed on the LLM event loop, no extra threads
+
+Usage (from src/api):
+    python scripts/bench_llm_streams.py --streams 500 --threads 50
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+MODEL = "gpt-bench"
+
+
+class FakeOpenAIServer:
+    """
+    Minimal HTTP/1.1 server speaking the OpenAI chat completions streaming API.
+    It runs in its own process so it does not compete with the client for the GIL.
+    """
+
+    def __init__(self, chunks: int, delay: float):
+        self.chunks = chunks
+        self.delay = delay
+        self.port = None
+        self.active = 0
+        self.peak_active = 0
+
+    def start(self) -> str:
+        sock = socket.socket()
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(4096)
+        self.port = sock.getsockname()[1]
+        process = multiprocessing.Process(target=self._serve, args=(sock,), daemon=True)
+        process.start()
+        sock.close()
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _serve(self, sock):
+        async def _main():
+            server = await asyncio.start_server(self._handle, sock=sock)
+            await server.serve_forever()
+
+        asyncio.run(_main())
+
+    def pop_peak_active(self) -> int:
+        url = f"http://127.0.0.1:{self.port}/v1/stats"
+        with urllib.request.urlopen(url) as response:
+            return json.loads(response.read())["peak_active"]
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                method, path, _ = request_line.decode().split(" ", 2)
+                length = 0
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                if length:
+                    await reader.readexactly(length)
+                if path.endswith("/models"):
+                    await self._send_json(writer, {"data": [{"id": MODEL}]})
+                elif path.endswith("/stats"):
+                    peak, self.peak_active = self.peak_active, self.active
+                    await self._send_json(writer, {"peak_active": peak})
+                else:
+                    await self._send_stream(writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send_json(self, writer, data):
+        body = json.dumps(data).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+
+    async def _send_stream(self, writer):
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                b"Transfer-Encoding: chunked\r\n\r\n"
+            )
+            for i in range(self.chunks + 1):
+                await asyncio.sleep(self.delay)
+                last = i == self.chunks
+                chunk = {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": MODEL,
+                    "choices": []
+                    if last
+                    else [{"index": 0, "delta": {"content": "tok "}}],
+                    "usage": {
+                        "prompt_tokens": 10,
+                        "completion_tokens": self.chunks,
+                        "total_tokens": 10 + self.chunks,
+                    }
+                    if last
+                    else None,
+                }
+                self._write_chunk(writer, f"data: {json.dumps(chunk)}\n\n")
+                await writer.drain()
+            self._write_chunk(writer, "data: [DONE]\n\n")
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            self.active -= 1
+
+    @staticmethod
+    def _write_chunk(writer, data: str):
+        payload = data.encode()
+        writer.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+
+
+def _report(name, elapsed, ttfts, chunks, server, threads):
+    ttfts = sorted(ttfts)
+    print(
+        f"{name:8s} streams={len(ttfts):5d} time={elapsed:7.2f}s "
+        f"streams/s={len(ttfts) / elapsed:8.1f} chunks/s={chunks / elapsed:9.1f} "
+        f"ttft p50={statistics.median(ttfts) * 1000:7.1f}ms "
+        f"p95={ttfts[int(len(ttfts) * 0.95) - 1] * 1000:7.1f}ms "
+        f"peak_concurrent={server.pop_peak_active():5d} threads={threads}"
+    )
+
+
+def bench_sync(llm, args, server):
+    client = llm.openai_client
+
+    def _one():
+        start = time.monotonic()
+        ttft, count = None, 0
+        for res in client.chat.completions.create(
+            model=MODEL,
+            messages=[{"role": "user", "content": "hi"}],
+            stream=True,
+        ):
+            if ttft is None:
+                ttft = time.monotonic() - start
+            if res.choices and res.choices[0].delta.content:
+                count += 1
+        return ttft, count
+
+    return _run_threads(_one, args, server, "sync")
+
+
+def bench_adapter(llm, args, server):
+    from flaskr.api.langfuse import MockClient
+
+    def _one():
+        start = time.monotonic()
+        ttft, count = None, 0
+        for res in llm.invoke_llm(
+            args.app, "bench", MockClient(), MODEL, "hi", temperature=0.3
+        ):
+            if ttft is None:
+                ttft = time.monotonic() - start
+            count += 1
+        return ttft, count
+
+    return _run_threads(_one, args, server, "adapter")
+
+
+def _run_threads(fn, args, server, name):
+    server.pop_peak_active()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(lambda _: fn(), range(args.streams)))
+    elapsed = time.monotonic() - start
+    _report(
+        name,
+        elapsed,
+        [r[0] for r in results],
+        sum(r[1] for r in results),
+        server,
+        args.threads,
+    )
+
+
+def bench_async(llm, args, server):
+    from flaskr.api.langfuse import MockClient
+    from flaskr.api.llm.aio import run_async
+
+    async def _one():
+        start = time.monotonic()
+        ttft, count = None, 0
+        async for res in llm.ainvoke_llm(
+            args.app, "bench", MockClient(), MODEL, "hi", temperature=0.3
+        ):
+            if ttft is None:
+                ttft = time.monotonic() - start
+            count += 1
+        return ttft, count
+
+    async def _all():
+        return await asyncio.gather(*[_one() for _ in range(args.streams)])
+
+    server.pop_peak_active()
+    start = time.monotonic()
+    results = run_async(_all())
+    elapsed = time.monotonic() - start
+    _report(
+        "async",
+        elapsed,
+        [r[0] for r in results],
+        sum(r[1] for r in results),
+        server,
+        1,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02)
+    parser.add_argument(
+        "--modes", default="sync,adapter,async", help="comma separated modes"
+    )
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.chunks, args.delay)
+    base_url = server.start()
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("LLM_MAX_CONNECTIONS", str(max(args.streams, 100)))
+
+    from flask import Flask
+    import logging
+
+    args.app = Flask("bench")
+    args.app.logger.setLevel(logging.ERROR)
+    with args.app.app_context():
+        import flaskr.api.llm as llm
+
+    print(
+        f"fake server {base_url}: {args.chunks} chunks/stream, "
+        f"{args.delay * 1000:.0f}ms between chunks"
+    )
+    modes = {"sync": bench_sync, "adapter": bench_adapter, "async": bench_async}
+    for mode in args.modes.split(","):
+        modes[mode.strip()](llm, args, server)
+
+
+if __name__ == "__main__":
+    main()
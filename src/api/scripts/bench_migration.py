@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+Benchmark the legacy to new table migration in rows per second.
+
+Modes:
+    legacy      the previous engine, OFFSET pagination and a COUNT(*) check plus
+                an INSERT or UPDATE per row
+    setbased    UnifiedMigrationTask: keyset pagination, existing keys fetched
+                with one IN query per batch, multi-row inserts and upserts
+
+Each mode migrates --rows log script rows into an empty target (insert pass)
+and then again into the filled target (update pass). The tables are
+bench_migration_source and bench_migration_target, created and dropped by the
+script, so it can run against a real MySQL database too.
+
+Usage (from src/api):
+    python scripts/bench_migration.py --rows 20000
+    python scripts/bench_migration.py --rows 20000 --database-url mysql://...
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import text  # noqa: E402
+
+SOURCE = "bench_migration_source"
+TARGET = "bench_migration_target"
+
+
+def _create_tables(task):
+    id_column = (
+        "id BIGINT AUTO_INCREMENT PRIMARY KEY"
+        if task.engine.dialect.name == "mysql"
+        else "id INTEGER PRIMARY KEY AUTOINCREMENT"
+    )
+    with task.engine.begin() as conn:
+        for table in (SOURCE, TARGET):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(
+            text(
+                f"""
+                CREATE TABLE {SOURCE} (
+                    {id_column}, log_id VARCHAR(36), attend_id VARCHAR(36),
+                    user_id VARCHAR(36), script_id VARCHAR(36), lesson_id VARCHAR(36),
+                    course_id VARCHAR(36), script_ui_type INT, script_role INT,
+                    script_content TEXT, script_index INT, script_ui_conf TEXT,
+                    interaction_type INT, status INT, created DATETIME, updated DATETIME
+                )
+            """
+            )
+        )
+        conn.execute(
+            text(
+                f"""
+                CREATE TABLE {TARGET} (
+                    {id_column}, generated_block_bid VARCHAR(36),
+                    progress_record_bid VARCHAR(36), user_bid VARCHAR(36),
+                    block_bid VARCHAR(36), outline_item_bid VARCHAR(36),
+                    shifu_bid VARCHAR(36), type INT, role INT, generated_content TEXT,
+                    position INT, block_content_conf TEXT, liked INT, deleted INT,
+                    status INT, created_at DATETIME, updated_at DATETIME
+                )
+            """
+            )
+        )
+        conn.execute(
+            text(f"CREATE INDEX idx_bench_bid ON {TARGET} (generated_block_bid)")
+        )
+
+
+def _fill_source(task, rows):
+    now = datetime.now()
+    with task.engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO {SOURCE} (log_id, attend_id, user_id, script_id,
+                    lesson_id, course_id, script_ui_type, script_role,
+                    script_content, script_index, script_ui_conf, interaction_type,
+                    status, created, updated)
+                VALUES (:log_id, 'attend', 'user', 'script', 'lesson', 'course', 0,
+                    0, :content, 0, '', 0, 1, :now, :now)
+            """
+            ),
+            [
+                {"log_id": f"log-{i:08d}", "content": "x" * 200, "now": now}
+                for i in range(rows)
+            ],
+        )
+
+
+def _legacy(task, table_config):
+    """The previous per row engine"""
+    mapping_func = table_config["mapping"]
+    key_field = table_config["key_field"]
+    target_key = table_config["target_key"]
+    session = task.SessionClass()
+    total = session.execute(text(f"SELECT COUNT(*) FROM {SOURCE}")).scalar()
+    offset = 0
+    while offset < total:
+        records = session.execute(
+            text(f"SELECT * FROM {SOURCE} ORDER BY id ASC LIMIT :n OFFSET :offset"),
+            {"n": task.config.batch_size, "offset": offset},
+        ).fetchall()
+        for record in records:
+            key = getattr(record, key_field)
+            exists = session.execute(
+                text(
+                    f"SELECT COUNT(*) FROM {TARGET} WHERE {target_key} = :key AND deleted = 0"
+                ),
+                {"key": key},
+            ).scalar()
+            mapped = mapping_func(record)
+            if exists:
+                fields = [f for f in mapped if f != target_key]
+                session.execute(
+                    text(
+                        f"UPDATE {TARGET} SET {', '.join(f'{f} = :{f}' for f in fields)} "
+                        f"WHERE {target_key} = :key_value"
+                    ),
+                    {**mapped, "key_value": key},
+                )
+            else:
+                session.execute(
+                    text(
+                        f"INSERT INTO {TARGET} ({', '.join(mapped)}) "
+                        f"VALUES ({', '.join(f':{f}' for f in mapped)})"
+                    ),
+                    mapped,
+                )
+        session.commit()
+        offset += task.config.batch_size
+    session.close()
+
+
+def _setbased(task, table_config):
+    task.force_full_migration = True
+    task._migrate_table(SOURCE, table_config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--modes", default="legacy,setbased")
+    args = parser.parse_args()
+
+    # the command package imports the services, which need the initialized app
+    from app import app  # noqa: F401
+    from flaskr.command.unified_migration_task import (
+        MigrationConfig,
+        UnifiedMigrationTask,
+    )
+
+    logging.getLogger("flaskr.command.unified_migration_task").disabled = True
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{tmp}/bench.db"
+        task = UnifiedMigrationTask(
+            database_url, MigrationConfig(batch_size=args.batch_size)
+        )
+        table_config = dict(
+            task.table_mappings["ai_course_lesson_attendscript"], target=TARGET
+        )
+        modes = {"legacy": _legacy, "setbased": _setbased}
+        stdout = sys.stdout
+        try:
+            for mode in args.modes.split(","):
+                run = modes[mode.strip()]
+                _create_tables(task)
+                _fill_source(task, args.rows)
+                for phase in ("insert", "update"):
+                    # the engine prints its progress per batch
+                    sys.stdout = open(os.devnull, "w")
+                    start = time.perf_counter()
+                    run(task, table_config)
+                    elapsed = time.perf_counter() - start
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                    print(
+                        f"{mode:9s} {phase:6s} rows={args.rows} "
+                        f"seconds={elapsed:8.2f} rows/s={args.rows / elapsed:10.0f}"
+                    )
+        finally:
+            sys.stdout = stdout
+            with task.engine.begin() as conn:
+                for table in (SOURCE, TARGET):
+                    conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            task.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Benchmark publishing a shifu draft in milliseconds per 1k blocks.
+
+Modes:
+    legacy  the previous copy, a flush per published outline and block and one
+            block query per lesson
+    bulk    publish_shifu_draft(full=True): the blocks of all lessons loaded
+            with one query, one multi-row insert per table and the ids read
+            back with one query per table
+    delta   publish_shifu_draft after one block was edited, only the rows
+            whose content hash changed are written
+
+A bench shifu with --chapters x --lessons lessons of --blocks blocks is
+created in the database of the app (.env) and removed again. Statements are
+counted on the engine of the app.
+
+Usage (from src/api):
+    python scripts/bench_publish.py --chapters 10 --lessons 10 --blocks 10
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+SHIFU_BID = "bench_publish_shifu"
+
+
+def _create_draft(args):
+    from flaskr.dao import db
+    from flaskr.service.shifu.models import DraftBlock, DraftOutlineItem, DraftShifu
+
+    db.session.add(DraftShifu(shifu_bid=SHIFU_BID, title="bench", price=Decimal(0)))
+    outlines, blocks = [], []
+    for c in range(args.chapters):
+        chapter_bid = f"{SHIFU_BID}_{c}"
+        outlines.append(
+            dict(
+                outline_item_bid=chapter_bid,
+                shifu_bid=SHIFU_BID,
+                title=f"chapter {c}",
+                position=f"{c + 1:02d}",
+                parent_bid="",
+            )
+        )
+        for lesson in range(args.lessons):
+            lesson_bid = f"{chapter_bid}_{lesson}"
+            outlines.append(
+                dict(
+                    outline_item_bid=lesson_bid,
+                    shifu_bid=SHIFU_BID,
+                    title=f"lesson {lesson}",
+                    position=f"{c + 1:02d}{lesson + 1:02d}",
+                    parent_bid=chapter_bid,
+                )
+            )
+            blocks.extend(
+                dict(
+                    block_bid=f"{lesson_bid}_{b}",
+                    shifu_bid=SHIFU_BID,
+                    outline_item_bid=lesson_bid,
+                    position=b,
+                    content="x" * 500,
+                )
+                for b in range(args.blocks)
+            )
+    db.session.execute(db.insert(DraftOutlineItem), outlines)
+    db.session.execute(db.insert(DraftBlock), blocks)
+    db.session.commit()
+    return len(blocks)
+
+
+def _drop(models):
+    from flaskr.dao import db
+
+    for model in models:
+        model.query.filter_by(shifu_bid=SHIFU_BID).delete()
+    db.session.commit()
+
+
+def _legacy(app, user_id, shifu_id):
+    """The previous copy of the outlines and blocks"""
+    from flaskr.dao import db
+    from flaskr.service.shifu.models import PublishedBlock, PublishedOutlineItem
+    from flaskr.service.shifu.shifu_block_funcs import __get_block_list_internal
+    from flaskr.service.shifu.shifu_outline_funcs import build_outline_tree
+
+    with app.app_context():
+        now_time = datetime.now()
+        PublishedOutlineItem.query.filter_by(shifu_bid=shifu_id).update({"deleted": 1})
+        PublishedBlock.query.filter_by(shifu_bid=shifu_id).update({"deleted": 1})
+
+        def publish_outline_item(node):
+            draft = node.outline
+            outline_item = PublishedOutlineItem(
+                shifu_bid=shifu_id,
+                outline_item_bid=draft.outline_item_bid,
+                title=draft.title,
+                position=draft.position,
+                type=draft.type,
+                hidden=draft.hidden,
+                parent_bid=draft.parent_bid,
+                content=draft.content,
+                created_user_bid=user_id,
+                created_at=now_time,
+                updated_user_bid=user_id,
+                updated_at=now_time,
+            )
+            db.session.add(outline_item)
+            db.session.flush()
+            if node.children:
+                for child in node.children:
+                    publish_outline_item(child)
+                return
+            for block in __get_block_list_internal(draft.outline_item_bid):
+                db.session.add(
+                    PublishedBlock(
+                        shifu_bid=shifu_id,
+                        block_bid=block.block_bid,
+                        position=block.position,
+                        type=block.type,
+                        outline_item_bid=draft.outline_item_bid,
+                        content=block.content,
+                        created_user_bid=user_id,
+                        created_at=now_time,
+                        updated_user_bid=user_id,
+                        updated_at=now_time,
+                    )
+                )
+                db.session.flush()
+
+        for node in build_outline_tree(app, shifu_id):
+            publish_outline_item(node)
+        db.session.commit()
+
+
+def _bulk(app, user_id, shifu_id):
+    from flaskr.service.shifu.shifu_publish_funcs import publish_shifu_draft
+
+    publish_shifu_draft(app, user_id, shifu_id, full=True)
+
+
+def _delta(app, user_id, shifu_id):
+    from flaskr.dao import db
+    from flaskr.service.shifu.models import DraftBlock
+    from flaskr.service.shifu.shifu_publish_funcs import publish_shifu_draft
+
+    with app.app_context():
+        block = DraftBlock.query.filter_by(shifu_bid=shifu_id).first()
+        block.content = f"edited {time.time()}"
+        db.session.commit()
+    publish_shifu_draft(app, user_id, shifu_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chapters", type=int, default=10)
+    parser.add_argument("--lessons", type=int, default=10)
+    parser.add_argument("--blocks", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--modes", default="legacy,bulk,delta")
+    args = parser.parse_args()
+
+    from sqlalchemy import event
+
+    from app import app
+    from flaskr.dao import db
+    from flaskr.service.shifu import shifu_publish_funcs
+    from flaskr.service.shifu.models import (
+        DraftBlock,
+        DraftOutlineItem,
+        DraftShifu,
+        LogPublishedStruct,
+        PublishedBlock,
+        PublishedOutlineItem,
+        PublishedShifu,
+    )
+
+    app.logger.setLevel(logging.ERROR)
+    # no summary generation, it calls the LLM
+    shifu_publish_funcs.enqueue_job = lambda *args, **kwargs: None
+    models = [DraftShifu, DraftOutlineItem, DraftBlock, PublishedShifu]
+    models += [PublishedOutlineItem, PublishedBlock, LogPublishedStruct]
+    with app.app_context():
+        _drop(models)
+        blocks = _create_draft(args)
+        engine = db.engine
+    statements = [0]
+
+    def _count(*_):
+        statements[0] += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    modes = {"legacy": _legacy, "bulk": _bulk, "delta": _delta}
+    try:
+        for mode in args.modes.split(","):
+            run = modes[mode.strip()]
+            timings = []
+            for _ in range(args.repeat):
+                statements[0] = 0
+                start = time.perf_counter()
+                run(app, "bench", SHIFU_BID)
+                timings.append(time.perf_counter() - start)
+            elapsed = min(timings)
+            print(
+                f"{mode:6s} blocks={blocks:6d} statements={statements[0]:6d} "
+                f"seconds={elapsed:7.3f} ms/1k blocks={elapsed * 1e6 / blocks:9.1f}"
+            )
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+        with app.app_context():
+            _drop(models)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Benchmark the latency of an editor route with and without the permission map cache.
+
+Modes:
+    legacy  the previous check, a Redis lookup keyed by user and shifu that a
+            collaborator always misses, then a DraftShifu and an AiCourseAuth
+            query
+    cached  the permissions of the user to all shifus, loaded once into the
+            in-process permission map
+
+The bench user is a collaborator of a shifu created by another user and
+requests GET /shifu/shifus/<shifu_bid>/detail. The app is created from the
+environment (.env), so MySQL and Redis must be reachable. The bench rows are
+removed again.
+
+Usage (from src/api):
+    python scripts/bench_shifu_permission.py --requests 5000 --threads 8
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+USER_ID = "bench-shifu-permission-user"
+SHIFU_BID = "bench_shifu_permission_shifu"
+
+
+def _legacy(app, user_id, shifu_id, auth_type):
+    """The previous permission check"""
+    from flaskr.common.config import get_config
+    from flaskr.dao import redis_client as redis
+    from flaskr.service.shifu.models import AiCourseAuth, DraftShifu
+
+    with app.app_context():
+        cache_key = (
+            get_config("REDIS_KEY_PREFIX")
+            + "shifu_permission:"
+            + user_id
+            + ":"
+            + shifu_id
+        )
+        cache_key_expire = int(get_config("SHIFU_PERMISSION_CACHE_EXPIRE"))
+        cache_result = redis.get(cache_key)
+        if cache_result is not None:
+            try:
+                return auth_type in json.loads(cache_result)
+            except (json.JSONDecodeError, TypeError):
+                redis.delete(cache_key)
+        shifu = DraftShifu.query.filter(
+            DraftShifu.shifu_bid == shifu_id,
+            DraftShifu.created_user_bid == user_id,
+        ).first()
+        if shifu:
+            redis.set(
+                cache_key, json.dumps(["view", "edit", "publish"]), cache_key_expire
+            )
+            return True
+        auth = AiCourseAuth.query.filter(
+            AiCourseAuth.course_id == shifu_id, AiCourseAuth.user_id == user_id
+        ).first()
+        if not auth:
+            return False
+        try:
+            result = auth_type in json.loads(auth.auth_type)
+            redis.set(cache_key, auth_type, cache_key_expire)
+            return result
+        except (json.JSONDecodeError, TypeError):
+            return False
+
+
+def _run(app, token, args, name):
+    path = app.config.get("PATH_PREFIX", "/api") + f"/shifu/shifus/{SHIFU_BID}/detail"
+    per_thread = args.requests // args.threads
+
+    def _worker(_):
+        client = app.test_client()
+        latencies = []
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            response = client.get(path, headers={"Token": token})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+            assert SHIFU_BID in response.get_data(as_text=True)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        latencies = sorted(sum(pool.map(_worker, range(args.threads)), []))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:6s} requests={len(latencies):6d} time={elapsed:6.2f}s "
+        f"requests/s={len(latencies) / elapsed:8.1f} "
+        f"p50={statistics.median(latencies) * 1000:6.2f}ms "
+        f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f}ms "
+        f"threads={args.threads}"
+    )
+
+
+def _drop():
+    from flaskr.dao import db
+    from flaskr.service.shifu.models import AiCourseAuth, DraftShifu
+    from flaskr.service.user.models import User, UserInfo as UserEntity
+
+    DraftShifu.query.filter_by(shifu_bid=SHIFU_BID).delete()
+    AiCourseAuth.query.filter_by(course_id=SHIFU_BID).delete()
+    User.query.filter_by(user_id=USER_ID).delete()
+    UserEntity.query.filter_by(user_bid=USER_ID).delete()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--modes", default="legacy,cached", help="comma separated modes"
+    )
+    args = parser.parse_args()
+
+    from app import app
+    from flaskr.dao import db
+    from flaskr.service.shifu import funcs, route
+    from flaskr.service.shifu.models import AiCourseAuth, DraftShifu
+    from flaskr.service.user import common
+    from flaskr.service.user.models import User
+    from flaskr.service.user.utils import generate_token
+
+    app.logger.setLevel(logging.ERROR)
+    with app.app_context():
+        _drop()
+        user = User(user_id=USER_ID, name="bench")
+        user.is_creator = True
+        user.user_birth = date(2003, 1, 1)
+        db.session.add(user)
+        db.session.add(
+            DraftShifu(
+                shifu_bid=SHIFU_BID,
+                title="bench",
+                price=Decimal(0),
+                created_user_bid="bench-shifu-permission-owner",
+            )
+        )
+        db.session.add(
+            AiCourseAuth(
+                course_id=SHIFU_BID, user_id=USER_ID, auth_type='["view", "edit"]'
+            )
+        )
+        db.session.commit()
+        token = generate_token(app, USER_ID)
+
+    modes = {"legacy": _legacy, "cached": funcs.shifu_permission_verification}
+    try:
+        for mode in args.modes.split(","):
+            mode = mode.strip()
+            route.shifu_permission_verification = modes[mode]
+            funcs._shifu_permission_cache.clear()
+            _run(app, token, args, mode)
+    finally:
+        route.shifu_permission_verification = funcs.shifu_permission_verification
+        with app.app_context():
+            common.revoke_token(app, token)
+            _drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Benchmark the SSE framing of run script streams.
+
+Modes:
+    legacy      json.dumps per DTO, one frame per LLM delta (previous framing)
+    orjson      SSEWriter without coalescing
+    coalesced   SSEWriter coalescing deltas (--coalesce-ms, --coalesce-bytes)
+    gzip        coalesced and gzip compressed
+
+Deltas arrive on a simulated clock every --delta-ms, so the run is CPU bound
+and the frame counts match a live LLM stream of that pace.
+
+Usage (from src/api):
+    python scripts/bench_sse_framing.py --deltas 2000 --runs 20
+"""
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def _fmt(o):
+    if isinstance(o, datetime.datetime):
+        return o.isoformat()
+    return o.__json__()
+
+
+def _legacy(items, clock, args):
+    for item in items:
+        yield (
+            "data: "
+            + json.dumps(item, default=_fmt, ensure_ascii=False)
+            + "\n\n".encode("utf-8").decode("utf-8")
+        ).encode("utf-8")
+
+
+def _writer(coalesce, compress):
+    from flaskr.service.learn.sse import SSEWriter
+
+    def _run(items, clock, args):
+        writer = SSEWriter(
+            coalesce_interval=args.coalesce_ms / 1000 if coalesce else 0,
+            coalesce_bytes=args.coalesce_bytes,
+            compress=compress,
+            clock=clock,
+        )
+        return writer.stream(items)
+
+    return _run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--deltas", type=int, default=2000)
+    parser.add_argument("--delta-ms", type=float, default=15)
+    parser.add_argument("--coalesce-ms", type=int, default=30)
+    parser.add_argument("--coalesce-bytes", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--modes", default="legacy,orjson,coalesced,gzip")
+    args = parser.parse_args()
+
+    # the learn models need the initialized app
+    from app import app  # noqa: F401
+    from flaskr.service.learn.learn_dtos import GeneratedType, RunMarkdownFlowDTO
+
+    texts = ["你好，", "这是", "一段", "流式", "输出。", " stream", "ing", " text"]
+    items = [
+        RunMarkdownFlowDTO(
+            outline_bid="outline-bench",
+            generated_block_bid=f"block-{i // 200}",
+            type=GeneratedType.CONTENT,
+            content=texts[i % len(texts)],
+        )
+        for i in range(args.deltas)
+    ]
+    modes = {
+        "legacy": _legacy,
+        "orjson": _writer(False, False),
+        "coalesced": _writer(True, False),
+        "gzip": _writer(True, True),
+    }
+
+    for mode in args.modes.split(","):
+        run = modes[mode.strip()]
+        timings = []
+        for _ in range(args.runs):
+            now = [0.0]
+
+            def clock():
+                return now[0]
+
+            def timed():
+                for i, item in enumerate(items):
+                    now[0] = i * args.delta_ms / 1000
+                    yield item
+
+            start = time.perf_counter()
+            chunks = list(run(timed(), clock, args))
+            timings.append(time.perf_counter() - start)
+        elapsed = statistics.median(timings)
+        print(
+            f"{mode:9s} deltas={args.deltas} writes={len(chunks):5d} "
+            f"bytes={sum(len(c) for c in chunks):8d} "
+            f"deltas/s={args.deltas / elapsed:10.0f} "
+            f"us/delta={elapsed / args.deltas * 1e6:6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark requests/sec of an authenticated route with and without the session cache.
+
+Modes:
+    uncached  every request validates the token in Redis and loads the user
+    cached    validated sessions are served from the in-process session cache
+
+The app is created from the environment (.env), so MySQL and Redis must be
+reachable. A bench user is created and removed again.
+
+Usage (from src/api):
+    python scripts/bench_validate_user.py --requests 5000 --threads 8
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+USER_ID = "bench-validate-user"
+
+
+def _run(app, token, args, name):
+    path = app.config.get("PATH_PREFIX", "/api") + "/user/info"
+    per_thread = args.requests // args.threads
+
+    def _worker(_):
+        client = app.test_client()
+        latencies = []
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            response = client.get(path, headers={"Token": token})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+            assert USER_ID in response.get_data(as_text=True)
+        return latencies
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        latencies = sorted(sum(pool.map(_worker, range(args.threads)), []))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:9s} requests={len(latencies):6d} time={elapsed:6.2f}s "
+        f"requests/s={len(latencies) / elapsed:8.1f} "
+        f"p50={statistics.median(latencies) * 1000:6.2f}ms "
+        f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f}ms "
+        f"threads={args.threads}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument(
+        "--modes", default="uncached,cached", help="comma separated modes"
+    )
+    args = parser.parse_args()
+
+    from app import app
+    from flaskr.dao import db
+    from flaskr.service.user import common
+    from flaskr.service.user.models import User, UserInfo as UserEntity
+    from flaskr.service.user.utils import generate_token
+
+    app.logger.setLevel(logging.ERROR)
+    with app.app_context():
+        if not User.query.filter_by(user_id=USER_ID).first():
+            db.session.add(User(user_id=USER_ID, name="bench"))
+            db.session.commit()
+        token = generate_token(app, USER_ID)
+
+    ttl = common._user_session_cache.ttl
+    try:
+        for mode in args.modes.split(","):
+            mode = mode.strip()
+            common._user_session_cache.clear()
+            common._user_session_cache.ttl = ttl if mode == "cached" else 0
+            _run(app, token, args, mode)
+    finally:
+        common._user_session_cache.ttl = ttl
+        with app.app_context():
+            common.revoke_token(app, token)
+            User.query.filter_by(user_id=USER_ID).delete()
+            UserEntity.query.filter_by(user_bid=USER_ID).delete()
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
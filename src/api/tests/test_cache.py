@@ -0,0 +1,58 @@
+from flaskr.dao.cache import LRUCache, get_cache, subscribe_invalidation, _dispatch
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache("test_lru", maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+
+
+def test_lru_cache_ttl(monkeypatch):
+    import flaskr.dao.cache as cache_module
+
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = LRUCache("test_ttl", maxsize=2, ttl=10)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now[0] += 11
+    assert cache.get("a") is None
+
+
+def test_lru_cache_delete_where():
+    cache = LRUCache("test_delete_where", maxsize=10)
+    cache.set(("shifu1", False, 1), "x")
+    cache.set(("shifu1", True, 2), "y")
+    cache.set(("shifu2", False, 3), "z")
+    assert cache.delete_where(lambda key: key[0] == "shifu1") == 2
+    assert len(cache) == 1
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_invalidation_dispatch():
+    cache = get_cache("test_dispatch", maxsize=10)
+    cache.set("k1", 1)
+    cache.set("k2", 2)
+
+    def evict(key):
+        if key is None:
+            cache.clear()
+        else:
+            cache.delete(key)
+
+    subscribe_invalidation("test_dispatch", evict)
+    _dispatch("test_dispatch", "k1")
+    assert cache.get("k1") is None
+    assert cache.get("k2") == 2
+    _dispatch("test_dispatch", None)
+    assert len(cache) == 0
@@ -0,0 +1,98 @@
+import logging
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _handler(monkeypatch, **kwargs):
+    from flaskr.common import log
+
+    sent = []
+
+    class _Response:
+        def raise_for_status(self):
+            pass
+
+    def post(url, json, timeout):
+        sent.append(json["content"]["text"])
+        return _Response()
+
+    monkeypatch.setattr(log.requests, "post", post)
+    clock = _Clock()
+    handler = log.FeishuLogHandler("http://feishu", clock=clock, **kwargs)
+    return handler, clock, sent
+
+
+def _record(message, name="app"):
+    return logging.LogRecord(name, logging.ERROR, __file__, 1, message, None, None)
+
+
+def test_errors_are_deduplicated_into_digests(app, monkeypatch):
+    handler, clock, sent = _handler(monkeypatch, digest_interval=10, dedup_window=60)
+    for _ in range(3):
+        handler.handle(_record("db down"))
+    handler.handle(_record("llm timeout"))
+    handler.flush()
+    # collected until the digest is due
+    assert sent == []
+
+    clock.now = 10
+    handler.flush()
+    assert len(sent) == 1
+    assert "db down\n(重复 3 次)" in sent[0] and "llm timeout" in sent[0]
+
+    # sent errors are only counted inside the window
+    clock.now = 20
+    handler.handle(_record("db down"))
+    handler.handle(_record("disk full"))
+    clock.now = 30
+    handler.flush()
+    assert "disk full" in sent[1] and "db down" not in sent[1]
+    assert "另有 1 条重复错误未发送" in sent[1]
+    assert handler.stats()["deduplicated"] == 3
+
+
+def test_rate_limit_and_drops(app, monkeypatch):
+    handler, clock, sent = _handler(
+        monkeypatch, digest_interval=0, rate_limit=2, max_pending=2
+    )
+    for i in range(2):
+        handler.handle(_record(f"error {i}"))
+        handler.flush()
+    for i in range(2, 5):
+        handler.handle(_record(f"error {i}"))
+        handler.flush()
+    # two messages per minute, the oldest waiting error is dropped
+    assert len(sent) == 2
+
+    clock.now = 60
+    handler.flush()
+    assert len(sent) == 3
+    assert "error 3" in sent[2] and "error 4" in sent[2] and "error 2" not in sent[2]
+    assert "1 条错误被丢弃" in sent[2]
+    assert handler.stats()["dropped"] == 1
+
+
+def test_queue_handler_does_not_block_when_full(app, monkeypatch):
+    from flaskr.common.log import FeishuLogHandler, FeishuQueueHandler
+
+    queue_handler = FeishuQueueHandler(FeishuLogHandler("http://feishu"), maxsize=2)
+    monkeypatch.setattr(queue_handler, "_ensure_listener", lambda: None)
+    logger = logging.getLogger("test_feishu_log")
+    logger.propagate = False
+    logger.addHandler(queue_handler)
+    try:
+        for i in range(5):
+            logger.error("error %s", i)
+        logger.warning("not an alert")
+    finally:
+        logger.removeHandler(queue_handler)
+    assert queue_handler.stats()["queue_dropped"] == 3
+    record = queue_handler.queue.get_nowait()
+    # formatted on the logging thread, deduplicated by the raw message
+    assert record.alert_key == ("test_feishu_log", logging.ERROR, "error 0")
@@ -0,0 +1,106 @@
+from flaskr.service.shifu.shifu_history_manager import HistoryItem
+from flaskr.service.shifu.struct_utils import find_node_with_parents
+
+
+def _build_struct() -> HistoryItem:
+    """
+    shifu
+    ├── chapter1
+    │   ├── lesson1 (block1, block2)
+    │   └── lesson2 (block3)
+    └── chapter2
+        └── lesson3
+    """
+    return HistoryItem(
+        bid="shifu",
+        id=1,
+        type="shifu",
+        children=[
+            HistoryItem(
+                bid="chapter1",
+                id=10,
+                type="outline",
+                children=[
+                    HistoryItem(
+                        bid="lesson1",
+                        id=11,
+                        type="outline",
+                        children=[
+                            HistoryItem(bid="block1", id=11, type="block"),
+                            HistoryItem(bid="block2", id=12, type="block"),
+                        ],
+                    ),
+                    HistoryItem(
+                        bid="lesson2",
+                        id=12,
+                        type="outline",
+                        children=[HistoryItem(bid="block3", id=13, type="block")],
+                    ),
+                ],
+            ),
+            HistoryItem(
+                bid="chapter2",
+                id=20,
+                type="outline",
+                children=[HistoryItem(bid="lesson3", id=21, type="outline")],
+            ),
+        ],
+    )
+
+
+def test_find_by_bid_and_id():
+    struct = _build_struct()
+    assert struct.find("lesson2").id == 12
+    assert struct.find("missing") is None
+    # ids are only unique per type
+    assert struct.find_by_id("outline", 11).bid == "lesson1"
+    assert struct.find_by_id("block", 11).bid == "block1"
+
+
+def test_parent_and_path():
+    struct = _build_struct()
+    assert struct.get_parent("block3").bid == "lesson2"
+    assert struct.get_parent("shifu") is None
+    assert [i.bid for i in struct.get_path("block2")] == [
+        "shifu",
+        "chapter1",
+        "lesson1",
+        "block2",
+    ]
+    assert struct.get_path("missing") is None
+
+
+def test_leaf_outlines_in_pre_order():
+    struct = _build_struct()
+    assert [i.bid for i in struct.get_outline_items()] == [
+        "chapter1",
+        "lesson1",
+        "lesson2",
+        "chapter2",
+        "lesson3",
+    ]
+    assert [i.bid for i in struct.get_leaf_outline_items()] == [
+        "lesson1",
+        "lesson2",
+        "lesson3",
+    ]
+    assert struct.get_next_leaf_outline_item("lesson2").bid == "lesson3"
+    assert struct.get_next_leaf_outline_item("lesson3") is None
+    assert struct.get_next_leaf_outline_item("chapter1") is None
+
+
+def test_find_node_with_parents_matches_tree_walk():
+    struct = _build_struct()
+    for bid in ["shifu", "chapter2", "lesson3", "block1", "missing"]:
+        indexed = find_node_with_parents(struct, bid)
+        walked = find_node_with_parents(struct, bid, [])
+        if walked is None:
+            assert indexed is None
+        else:
+            assert [i.bid for i in indexed] == [i.bid for i in walked]
+
+
+def test_index_survives_json_round_trip():
+    struct = HistoryItem.from_json(_build_struct().to_json())
+    assert struct.find("lesson1").children[1].bid == "block2"
+    assert "_index" not in struct.to_json()
@@ -0,0 +1,94 @@
+import time
+
+
+def _queue():
+    from flaskr.dao.jobs import JobQueue, MemoryJobBackend
+
+    job_queue = JobQueue(MemoryJobBackend())
+    job_queue.worker_threads = 0
+    job_queue.backoff = 0
+    return job_queue
+
+
+def test_failed_job_is_retried_until_it_succeeds(app):
+    from flaskr.dao.jobs import job_handler
+
+    calls = []
+
+    @job_handler("test.flaky", max_attempts=3)
+    def flaky(app, value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise RuntimeError("not yet")
+
+    job_queue = _queue()
+    job_id = job_queue.enqueue(app, "test.flaky", {"value": 1})
+    assert job_queue.get(job_id)["status"] == "queued"
+
+    assert job_queue.run_next(app)
+    job = job_queue.get(job_id)
+    assert (job["status"], job["attempts"], job["error"]) == ("retrying", 1, "not yet")
+
+    while job_queue.run_next(app, timeout=0.5):
+        pass
+    job = job_queue.get(job_id)
+    assert (job["status"], job["attempts"], job["error"]) == ("succeeded", 3, None)
+    assert calls == [1, 1, 1]
+    assert job_queue.stats()["retried"] == 2
+
+
+def test_job_fails_after_max_attempts(app):
+    from flaskr.dao.jobs import job_handler
+
+    @job_handler("test.broken", max_attempts=2)
+    def broken(app):
+        raise ValueError("broken")
+
+    job_queue = _queue()
+    job_id = job_queue.enqueue(app, "test.broken")
+    while job_queue.run_next(app, timeout=0.5):
+        pass
+    job = job_queue.get(job_id)
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", 2, "broken")
+    assert job_queue.stats()["failed"] == 1
+
+
+def test_idempotency_key_creates_the_job_once(app):
+    from flaskr.dao.jobs import job_handler
+
+    calls = []
+
+    @job_handler("test.notify")
+    def notify(app, order_bid):
+        calls.append(order_bid)
+
+    job_queue = _queue()
+    first = job_queue.enqueue(app, "test.notify", {"order_bid": "o1"}, key="o1")
+    assert job_queue.run_next(app)
+    # e.g. a payment callback delivered twice
+    second = job_queue.enqueue(app, "test.notify", {"order_bid": "o1"}, key="o1")
+    assert not job_queue.run_next(app)
+    assert first == second and calls == ["o1"]
+    assert job_queue.stats()["deduplicated"] == 1
+
+
+def test_worker_threads_run_jobs_in_the_background(app):
+    import threading
+
+    from flaskr.dao.jobs import job_handler
+
+    done = threading.Event()
+
+    @job_handler("test.background")
+    def background(app):
+        done.set()
+
+    job_queue = _queue()
+    job_queue.worker_threads = 1
+    job_queue.poll_interval = 0.05
+    job_id = job_queue.enqueue(app, "test.background")
+    assert done.wait(5)
+    deadline = time.monotonic() + 5
+    while job_queue.get(job_id)["status"] != "succeeded":
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
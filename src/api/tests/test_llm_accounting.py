@@ -0,0 +1,81 @@
+import threading
+import time
+
+
+class _RecordingSpan:
+    def __init__(self):
+        self.generations = []
+        self.outputs = []
+        self.threads = []
+
+    def generation(self, **kwargs):
+        self.threads.append(threading.current_thread().name)
+        self.generations.append(kwargs)
+
+    def update(self, **kwargs):
+        self.outputs.append(kwargs["output"])
+
+
+def test_truncate_log():
+    from flaskr.api.llm.accounting import truncate_log
+
+    assert truncate_log("short", 10) == "short"
+    assert truncate_log("x" * 25, 10) == "xxxxxxxxxx...(25 chars)"
+    assert truncate_log("x" * 25, 0) == "x" * 25
+    assert truncate_log([{"role": "user"}], 5) == "[{'ro...(18 chars)"
+
+
+def test_generations_are_exported_off_the_request_thread(app):
+    from flaskr.api.llm.accounting import StreamAccounting, TraceExporter
+    from flaskr.api.llm import accounting as accounting_module
+
+    exporter = TraceExporter("test_thread")
+    accounting_module._exporter, previous = exporter, accounting_module._exporter
+    try:
+        span = _RecordingSpan()
+        messages = [{"role": "user", "content": "hi"}]
+        accounting = StreamAccounting(app, span, "gpt-test", "test", messages)
+        # served by a fallback of the chain
+        accounting.set_served_model("gpt-fallback")
+        for chunk in ["Hel", "", "lo"]:
+            accounting.add(chunk)
+        accounting.usage = "usage"
+        assert accounting.finish(metadata={"a": 1}, update_span=True) == "Hello"
+        messages.append({"role": "assistant", "content": "Hello"})
+
+        deadline = time.monotonic() + 5
+        while exporter.exported < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        accounting_module._exporter = previous
+    generation = span.generations[0]
+    assert span.threads == ["trace-exporter-test_thread"]
+    assert generation["output"] == "Hello" and generation["usage"] == "usage"
+    assert generation["model"] == "gpt-fallback"
+    assert generation["metadata"] == {"a": 1, "requested_model": "gpt-test"}
+    assert generation["input"] == [{"role": "user", "content": "hi"}]
+    assert generation["start_time"] <= generation["completion_start_time"]
+    assert generation["completion_start_time"] <= generation["end_time"]
+    assert span.outputs == ["Hello"]
+
+
+def test_full_exporter_drops_and_flush_exports(app, monkeypatch):
+    from flaskr.api.llm.accounting import TraceExporter
+
+    exporter = TraceExporter("test_flush", batch_size=2, maxsize=3)
+    monkeypatch.setattr(exporter, "_ensure_thread", lambda: None)
+    calls = []
+
+    def _fail():
+        raise RuntimeError("langfuse down")
+
+    results = [exporter.submit(app, calls.append, i) for i in range(3)]
+    results.append(exporter.submit(app, calls.append, 3))
+    assert results == [True, True, True, False]
+    exporter.flush()
+    exporter.submit(app, _fail)
+    exporter.flush()
+    assert calls == [0, 1, 2]
+    stats = exporter.stats()
+    assert (stats["exported"], stats["dropped"], stats["failed"]) == (3, 1, 1)
+    assert stats["batches"] == 3 and stats["depth"] == 0
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+
+
+def test_iter_async_streams_items_from_llm_loop(app):
+    from flaskr.api.llm.aio import iter_async
+
+    threads = []
+
+    async def numbers():
+        for i in range(3):
+            threads.append(threading.current_thread().name)
+            await asyncio.sleep(0)
+            yield i
+
+    assert list(iter_async(numbers())) == [0, 1, 2]
+    assert set(threads) == {"llm-event-loop"}
+
+
+def test_iter_async_raises_and_cancels(app):
+    from flaskr.api.llm.aio import iter_async, run_async
+
+    async def failing():
+        yield 1
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        list(iter_async(failing()))
+
+    closed = threading.Event()
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.01)
+                yield 1
+        finally:
+            closed.set()
+
+    stream = iter_async(endless())
+    assert next(stream) == 1
+    stream.close()
+    assert closed.wait(1)
+    assert run_async(asyncio.sleep(0, result="ok")) == "ok"
+
+
+def test_aiter_sync_runs_blocking_iterator_off_loop(app):
+    from flaskr.api.llm.aio import aiter_sync, run_async
+
+    threads = []
+
+    def blocking():
+        for i in range(3):
+            threads.append(threading.current_thread().name)
+            yield i
+
+    async def collect():
+        return [i async for i in aiter_sync(blocking())]
+
+    assert run_async(collect()) == [0, 1, 2]
+    assert "llm-event-loop" not in threads
@@ -0,0 +1,166 @@
+from types import SimpleNamespace
+
+
+class _FakeSpan:
+    def __init__(self):
+        self.generations = []
+
+    def generation(self, **kwargs):
+        self.generations.append(kwargs)
+
+    def update(self, **kwargs):
+        pass
+
+
+_TEXT = "Hello, world. This reply is replayed in chunks."
+
+
+class _FakeRouter:
+    def __init__(self):
+        self.calls = 0
+
+    async def astream(self, model, messages, **kwargs):
+        self.calls += 1
+        for text in ["Hello, world. ", "This reply is replayed in chunks."]:
+            delta = SimpleNamespace(content=text)
+            yield SimpleNamespace(
+                id="chunk",
+                choices=[SimpleNamespace(delta=delta, finish_reason=None)],
+                usage=None,
+            )
+
+
+def _setup(monkeypatch, tmp_path, policies):
+    import flaskr.api.llm as llm
+    from flaskr.api.llm import accounting, response_cache
+
+    router = _FakeRouter()
+    monkeypatch.setattr(llm, "get_router", lambda: router)
+    # generations stay queued until the test flushes them
+    exporter = accounting.TraceExporter("test")
+    monkeypatch.setattr(exporter, "_ensure_thread", lambda: None)
+    monkeypatch.setattr(accounting, "_exporter", exporter)
+    monkeypatch.setattr(
+        llm, "get_openai_client_and_model", lambda model: (object(), model)
+    )
+    monkeypatch.setattr(
+        response_cache, "_policies", response_cache.parse_policies(policies)
+    )
+    monkeypatch.setattr(
+        response_cache,
+        "_backend",
+        response_cache.DiskResponseBackend(str(tmp_path), max_entries=10),
+    )
+    return llm, router
+
+
+def _invoke(llm, app, generation_name, message="Say hello", **kwargs):
+    span = _FakeSpan()
+    chunks = list(
+        llm.invoke_llm(
+            app,
+            "user",
+            span,
+            "gpt-test",
+            message,
+            system="You are a test",
+            generation_name=generation_name,
+            temperature=0.3,
+            **kwargs,
+        )
+    )
+    return "".join(c.result for c in chunks), chunks, span
+
+
+def test_cached_generations_are_replayed(app, monkeypatch, tmp_path):
+    from flaskr.api.llm import accounting
+
+    llm, router = _setup(monkeypatch, tmp_path, "shifu_summary:60,debug-*:60")
+
+    text, _, _ = _invoke(llm, app, "shifu_summary")
+    assert text == _TEXT and router.calls == 1
+    # line endings and trailing whitespace do not change the key
+    text, chunks, span = _invoke(llm, app, "shifu_summary", "Say hello \r\n")
+    accounting.get_trace_exporter().flush()
+    assert text == _TEXT and router.calls == 1
+    assert len(chunks) > 1 and chunks[-1].is_end and not chunks[0].is_end
+    assert span.generations[0]["metadata"]["response_cache"] == "hit"
+
+    _invoke(llm, app, "shifu_summary", temperature_hint=1)
+    _invoke(llm, app, "debug-block", "Debug this")
+    assert router.calls == 3
+    # generations without a policy are never cached
+    _invoke(llm, app, "user_input_1")
+    _invoke(llm, app, "user_input_1")
+    assert router.calls == 5
+
+
+def test_interrupted_generations_are_not_cached(app, monkeypatch, tmp_path):
+    llm, router = _setup(monkeypatch, tmp_path, "shifu_summary:60")
+    stream = llm.invoke_llm(
+        app, "user", _FakeSpan(), "gpt-test", "hi", generation_name="shifu_summary"
+    )
+    next(stream)
+    stream.close()
+    _invoke(llm, app, "shifu_summary", "hi")
+    assert router.calls == 2
+
+
+def test_disk_backend_expires_and_prunes(app, monkeypatch, tmp_path):
+    from flaskr.api.llm import response_cache
+
+    backend = response_cache.DiskResponseBackend(str(tmp_path), max_entries=2)
+    for key in ["a", "b", "c"]:
+        backend.set(app, key, {"text": key}, 60)
+    backend.get(app, "a")
+    now = response_cache.time.time()
+    for key, age in [("a", 0), ("b", 30), ("c", 20)]:
+        response_cache.os.utime(backend._path(key), (now - age, now - age))
+    backend.prune()
+    assert [backend.get(app, k) is not None for k in "abc"] == [True, False, True]
+
+    monkeypatch.setattr(response_cache.time, "time", lambda: now + 61)
+    assert backend.get(app, "a") is None
+
+
+def test_parse_policies():
+    from flaskr.api.llm.response_cache import parse_policies
+
+    assert parse_policies(" shifu_summary:600 , debug-*:60,broken, :5") == [
+        ("shifu_summary", 600),
+        ("debug-*", 60),
+    ]
+
+
+def test_async_cache_io_runs_off_the_event_loop(app, monkeypatch, tmp_path):
+    import asyncio
+    import threading
+
+    from flaskr.api.llm import response_cache
+
+    llm, router = _setup(monkeypatch, tmp_path, "shifu_summary:60")
+    backend = response_cache._backend
+    threads = []
+
+    class _RecordingBackend:
+        def get(self, app, key):
+            threads.append(threading.current_thread())
+            return backend.get(app, key)
+
+        def set(self, app, key, entry, ttl):
+            threads.append(threading.current_thread())
+            backend.set(app, key, entry, ttl)
+
+    monkeypatch.setattr(response_cache, "_backend", _RecordingBackend())
+
+    async def _run():
+        chunks = llm.ainvoke_llm(
+            app, "user", _FakeSpan(), "gpt-test", "hi", generation_name="shifu_summary"
+        )
+        return "".join([c.result async for c in chunks]), threading.current_thread()
+
+    for _ in range(2):
+        text, loop_thread = asyncio.run(_run())
+        assert text == _TEXT
+    assert router.calls == 1 and len(threads) == 3
+    assert loop_thread not in threads
@@ -0,0 +1,202 @@
+import asyncio
+
+import pytest
+
+
+class _FakeStream:
+    def __init__(self, chunks, delay, error):
+        self.chunks = chunks
+        self.delay = delay
+        self.error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class _FakeProvider:
+    """
+    Stands in for the async client of one base_url, behaviour per model
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.delays = {}
+        self.errors = {}
+        self.calls = []
+        self.streams = []
+        self.chat = self
+        self.completions = self
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def create(self, model, messages, **kwargs):
+        self.calls.append(model)
+        stream = _FakeStream(
+            [f"{model}:1", f"{model}:2"],
+            self.delays.get(model, 0),
+            self.errors.get(model),
+        )
+        self.streams.append(stream)
+        return stream
+
+
+def _router(monkeypatch, **kwargs):
+    from flaskr.api.llm import router as router_module
+
+    primary = _FakeProvider("https://primary/")
+    backup = _FakeProvider("https://backup/")
+    providers = {"primary": primary, "backup": backup}
+
+    def _resolve(model):
+        name, invoke_model = model.split("/")
+        if name not in providers:
+            raise KeyError(model)
+        return providers[name], invoke_model
+
+    monkeypatch.setattr(router_module, "get_async_client", lambda client: client)
+    router = router_module.LLMRouter(
+        _resolve,
+        {"primary/a": ["missing/x", "backup/b"]},
+        **kwargs,
+    )
+    return router, primary, backup
+
+
+def _collect(router, model="primary/a"):
+    async def _run():
+        return [chunk async for chunk in router.astream(model, [])]
+
+    return asyncio.run(_run())
+
+
+def test_parse_fallback_chains():
+    from flaskr.api.llm.router import parse_fallback_chains
+
+    assert parse_fallback_chains(" a > b>c, d>e ,f,") == {
+        "a": ["b", "c"],
+        "d": ["e"],
+    }
+    assert parse_fallback_chains("") == {}
+
+
+def test_failover_and_circuit_breaker(monkeypatch):
+    router, primary, backup = _router(monkeypatch, failure_threshold=2)
+    primary.errors["a"] = RuntimeError("500")
+
+    assert _collect(router) == ["b:1", "b:2"]
+    assert _collect(router) == ["b:1", "b:2"]
+    # the breaker is open now, the primary is skipped
+    assert _collect(router) == ["b:1", "b:2"]
+    assert primary.calls == ["a", "a"]
+    assert all(stream.closed for stream in primary.streams + backup.streams)
+    states = {s["name"]: s["state"] for s in router.stats()}
+    # named by model, the base urls are not exposed
+    assert states == {"primary/a": "open", "backup/b": "closed"}
+
+
+def test_request_errors_are_not_failed_over(monkeypatch):
+    import httpx
+    import openai
+
+    router, primary, backup = _router(monkeypatch)
+    response = httpx.Response(400, request=httpx.Request("POST", "https://primary/"))
+    primary.errors["a"] = openai.BadRequestError("bad", response=response, body=None)
+    with pytest.raises(openai.BadRequestError):
+        _collect(router)
+    assert backup.calls == []
+    assert router.stats()[0]["errors"] == 0
+
+
+def test_hedging_races_a_slow_primary(monkeypatch):
+    router, primary, backup = _router(monkeypatch, hedge_ttft=0.05)
+    primary.delays["a"] = 1
+    assert _collect(router) == ["b:1", "b:2"]
+    assert primary.calls == ["a"] and backup.calls == ["b"]
+    # the slower stream is cancelled and closed
+    assert primary.streams[0].closed
+
+    primary.delays["a"] = 0
+    assert _collect(router) == ["a:1", "a:2"]
+    assert backup.calls == ["b"]
+
+
+def test_circuit_breaker_half_open(monkeypatch):
+    from flaskr.api.llm import router as router_module
+
+    now = [100.0]
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: now[0])
+    breaker = router_module.CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] += 30
+    assert breaker.allow()
+    # one trial at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+def test_half_open_fallback_keeps_its_trial_until_it_is_tried(monkeypatch):
+    from flaskr.api.llm import router as router_module
+
+    now = [100.0]
+    monkeypatch.setattr(router_module.time, "monotonic", lambda: now[0])
+    router, primary, backup = _router(
+        monkeypatch, failure_threshold=1, reset_timeout=30
+    )
+    backup.errors["b"] = RuntimeError("500")
+    primary.errors["a"] = RuntimeError("500")
+    with pytest.raises(RuntimeError):
+        _collect(router)
+    now[0] += 30
+    del backup.errors["b"], primary.errors["a"]
+
+    served = []
+
+    async def _run():
+        stream = router.astream("primary/a", [], on_model=served.append)
+        return [chunk async for chunk in stream]
+
+    # the recovered primary serves, the half open backup is not asked
+    assert asyncio.run(_run()) == ["a:1", "a:2"]
+    assert served == ["primary/a"]
+    backup_health = router.get_health(backup, "b")
+    assert backup_health.breaker.state == backup_health.breaker.OPEN
+
+    # its trial is still there when the primary fails again
+    primary.errors["a"] = RuntimeError("500")
+    assert asyncio.run(_run()) == ["b:1", "b:2"]
+    assert served[-1] == "backup/b"
+    assert backup_health.breaker.state == backup_health.breaker.CLOSED
+
+
+def test_fallbacks_keep_the_configured_order(monkeypatch):
+    router, primary, backup = _router(monkeypatch)
+    router.fallback_chains = {"primary/a": ["backup/b", "backup/c"]}
+    primary.errors["a"] = RuntimeError("500")
+    # the last resort measured faster does not jump the chain
+    router.get_health(backup, "c").ewma_ttft = 0.01
+    router.get_health(backup, "b").ewma_ttft = 2.0
+    targets = router._get_targets("primary/a")
+    assert [t.model for t in targets] == ["primary/a", "backup/b", "backup/c"]
+    assert _collect(router) == ["b:1", "b:2"]
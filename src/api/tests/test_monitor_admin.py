@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+import pytest
+
+
+def test_stats_are_only_served_to_admins(app):
+    from flask import request
+
+    from flaskr.route.monitor import admin_required
+    from flaskr.service.common.models import AppException
+
+    stats = admin_required(lambda: "stats")
+    for user in (None, SimpleNamespace(is_admin=False)):
+        with app.test_request_context("/api/monitor/llm-router-stats"):
+            if user:
+                request.user = user
+            with pytest.raises(AppException):
+                stats()
+    with app.test_request_context("/api/monitor/llm-router-stats"):
+        request.user = SimpleNamespace(is_admin=True)
+        assert stats() == "stats"
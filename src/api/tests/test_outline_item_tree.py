@@ -0,0 +1,146 @@
+from decimal import Decimal
+
+
+def _publish_shifu(app, shifu_bid: str):
+    from flaskr.dao import db
+    from flaskr.service.shifu.models import (
+        LogPublishedStruct,
+        PublishedOutlineItem,
+        PublishedShifu,
+    )
+    from flaskr.service.shifu.shifu_history_manager import HistoryItem
+
+    shifu = PublishedShifu(shifu_bid=shifu_bid, title="shifu", price=Decimal(0))
+    db.session.add(shifu)
+    db.session.flush()
+    root = HistoryItem(bid=shifu_bid, id=shifu.id, type="shifu", children=[])
+    for chapter_index in range(2):
+        chapter = PublishedOutlineItem(
+            outline_item_bid=f"{shifu_bid}_c{chapter_index}",
+            shifu_bid=shifu_bid,
+            title=f"chapter {chapter_index}",
+            position=str(chapter_index),
+        )
+        db.session.add(chapter)
+        db.session.flush()
+        chapter_item = HistoryItem(
+            bid=chapter.outline_item_bid, id=chapter.id, type="outline", children=[]
+        )
+        root.children.append(chapter_item)
+        for section_index in range(3):
+            section = PublishedOutlineItem(
+                outline_item_bid=f"{shifu_bid}_c{chapter_index}_s{section_index}",
+                shifu_bid=shifu_bid,
+                title=f"section {section_index}",
+                position=f"{chapter_index}.{section_index}",
+                hidden=1 if section_index == 2 else 0,
+            )
+            db.session.add(section)
+            db.session.flush()
+            chapter_item.children.append(
+                HistoryItem(
+                    bid=section.outline_item_bid,
+                    id=section.id,
+                    type="outline",
+                    children=[],
+                )
+            )
+    db.session.add(
+        LogPublishedStruct(
+            struct_bid=f"{shifu_bid}_struct",
+            shifu_bid=shifu_bid,
+            struct=root.to_json(),
+        )
+    )
+    db.session.commit()
+
+
+def test_outline_item_tree_etag_follows_progress(app):
+    from flaskr.dao import db
+    from flaskr.service.learn.learn_dtos import LearnStatus
+    from flaskr.service.learn.learn_funcs import get_outline_item_tree_with_etag
+    from flaskr.service.learn.models import LearnProgressRecord
+    from flaskr.service.order.consts import LEARN_STATUS_IN_PROGRESS
+
+    with app.app_context():
+        _publish_shifu(app, "tree_shifu")
+        etag, tree = get_outline_item_tree_with_etag(
+            app, "tree_shifu", "tree_user", False
+        )
+        assert [i.bid for i in tree.outline_items] == ["tree_shifu_c0", "tree_shifu_c1"]
+        assert [i.bid for i in tree.outline_items[0].children] == [
+            "tree_shifu_c0_s0",
+            "tree_shifu_c0_s1",
+        ]
+        assert tree.outline_items[0].children[0].status == LearnStatus.NOT_STARTED
+
+        same_etag, not_modified = get_outline_item_tree_with_etag(
+            app, "tree_shifu", "tree_user", False, f'"{etag}"'
+        )
+        assert same_etag == etag
+        assert not_modified is None
+
+        # committing a progress record drops the cached progress map
+        db.session.add(
+            LearnProgressRecord(
+                progress_record_bid="tree_progress",
+                shifu_bid="tree_shifu",
+                outline_item_bid="tree_shifu_c0_s0",
+                user_bid="tree_user",
+                status=LEARN_STATUS_IN_PROGRESS,
+            )
+        )
+        db.session.commit()
+        new_etag, tree = get_outline_item_tree_with_etag(
+            app, "tree_shifu", "tree_user", False, f'"{etag}"'
+        )
+        assert new_etag != etag
+        assert tree.outline_items[0].children[0].status == LearnStatus.IN_PROGRESS
+
+        other_etag, _ = get_outline_item_tree_with_etag(
+            app, "tree_shifu", "other_user", False
+        )
+        assert other_etag == etag
+
+
+def test_progress_map_loaded_before_an_invalidation_is_not_served(app):
+    from flaskr.service.learn import learn_funcs
+
+    with app.app_context():
+        key = learn_funcs._get_learn_progress_key("race_shifu", "race_user")
+        version = learn_funcs._get_learn_progress_version(key)
+        # a progress record commits while the old map is loaded
+        learn_funcs._evict_learn_progress(key)
+        learn_funcs._learn_progress_cache.set(key, (version, {"stale": 1}))
+        assert learn_funcs._get_learn_progress_map(app, "race_shifu", "race_user") == {}
+
+
+def test_merged_progress_drops_the_maps_of_both_users(app):
+    from flaskr.dao import db
+    from flaskr.service.learn.learn_funcs import _get_learn_progress_map
+    from flaskr.service.learn.models import LearnProgressRecord
+    from flaskr.service.order.consts import LEARN_STATUS_IN_PROGRESS
+    from flaskr.service.user.phone_flow import migrate_user_study_record
+
+    with app.app_context():
+        db.session.add(
+            LearnProgressRecord(
+                progress_record_bid="merge_progress",
+                shifu_bid="merge_shifu",
+                outline_item_bid="merge_s0",
+                user_bid="merge_guest",
+                status=LEARN_STATUS_IN_PROGRESS,
+            )
+        )
+        db.session.commit()
+        assert _get_learn_progress_map(app, "merge_shifu", "merge_guest") == {
+            "merge_s0": LEARN_STATUS_IN_PROGRESS
+        }
+        assert _get_learn_progress_map(app, "merge_shifu", "merge_user") == {}
+
+        migrate_user_study_record(app, "merge_guest", "merge_user", "merge_shifu")
+        db.session.commit()
+        assert _get_learn_progress_map(app, "merge_shifu", "merge_guest") == {}
+        assert _get_learn_progress_map(app, "merge_shifu", "merge_user") == {
+            "merge_s0": LEARN_STATUS_IN_PROGRESS
+        }
@@ -0,0 +1,51 @@
+from markdown_flow import BlockType
+
+
+MDFLOW = """Hello {{nickname}}
+
+---
+
+?[%{{level}} Beginner|Expert]
+
+---
+
+Bye"""
+
+
+def test_parsed_mdflow_is_shared_by_content_hash(app):
+    from flaskr.service.shifu.shifu_mdflow_funcs import get_parsed_mdflow
+
+    parsed = get_parsed_mdflow("outline_parse_1", MDFLOW)
+    assert get_parsed_mdflow("outline_parse_1", MDFLOW) is parsed
+    assert len(parsed.blocks) == 3
+    assert parsed.blocks[1].block_type == BlockType.INTERACTION
+
+    edited = get_parsed_mdflow("outline_parse_1", MDFLOW + "\n\n---\n\nMore")
+    assert edited is not parsed
+    assert len(edited.blocks) == 4
+
+
+def test_parsed_mdflow_interaction_and_markdown_flow(app):
+    from flaskr.service.shifu.shifu_mdflow_funcs import get_parsed_mdflow
+
+    parsed = get_parsed_mdflow("outline_parse_2", MDFLOW)
+    interaction = parsed.get_interaction(1)
+    assert interaction is parsed.get_interaction(1)
+    assert [b["value"] for b in interaction["buttons"]] == ["Beginner", "Expert"]
+
+    first = parsed.create_markdown_flow()
+    second = parsed.create_markdown_flow()
+    assert first is not second
+    assert first.get_all_blocks() is parsed.blocks
+
+
+def test_parsed_mdflow_invalidation(app):
+    from flaskr.dao.cache import _dispatch
+    from flaskr.service.shifu.shifu_mdflow_funcs import (
+        OUTLINE_MDFLOW_CACHE_TOPIC,
+        get_parsed_mdflow,
+    )
+
+    parsed = get_parsed_mdflow("outline_parse_3", MDFLOW)
+    _dispatch(OUTLINE_MDFLOW_CACHE_TOPIC, "outline_parse_3")
+    assert get_parsed_mdflow("outline_parse_3", MDFLOW) is not parsed
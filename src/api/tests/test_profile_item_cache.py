@@ -0,0 +1,43 @@
+def test_profile_item_definitions_are_cached_until_edited(app):
+    from flaskr.dao import db
+    from flaskr.service.profile.profile_manage import (
+        _profile_item_cache,
+        add_profile_item_quick,
+        add_profile_item_quick_internal,
+        get_profile_item_definition_list,
+    )
+
+    with app.app_context():
+        add_profile_item_quick(app, "cached_shifu", "var_a", "creator")
+        keys = [
+            d.profile_key for d in get_profile_item_definition_list(app, "cached_shifu")
+        ]
+        assert "var_a" in keys
+
+        hits = _profile_item_cache.hits
+        definitions = get_profile_item_definition_list(app, "cached_shifu")
+        assert _profile_item_cache.hits == hits + 1
+        definitions.clear()
+        assert get_profile_item_definition_list(app, "cached_shifu")
+
+        # uncommitted items are visible to the session that added them
+        add_profile_item_quick_internal(app, "cached_shifu", "var_b", "creator")
+        keys = [
+            d.profile_key for d in get_profile_item_definition_list(app, "cached_shifu")
+        ]
+        assert "var_b" in keys
+        db.session.rollback()
+        keys = [
+            d.profile_key for d in get_profile_item_definition_list(app, "cached_shifu")
+        ]
+        assert "var_b" not in keys
+
+        # a committed edit bumps the version of the shifu
+        add_profile_item_quick(app, "cached_shifu", "var_c", "creator")
+        keys = [
+            d.profile_key for d in get_profile_item_definition_list(app, "cached_shifu")
+        ]
+        assert keys[-1] == "var_c"
+        assert "var_c" not in [
+            d.profile_key for d in get_profile_item_definition_list(app, "other_shifu")
+        ]
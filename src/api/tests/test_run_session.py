@@ -0,0 +1,267 @@
+import threading
+import time
+
+
+class _FakeLock:
+    def __init__(self, redis, name):
+        self.redis = redis
+        self.name = name
+        self.token = object()
+
+    def acquire(self, blocking=True):
+        with self.redis.cond:
+            if self.redis.locks.get(self.name) is None:
+                self.redis.locks[self.name] = self.token
+                return True
+            return False
+
+    def reacquire(self):
+        return True
+
+    def release(self):
+        with self.redis.cond:
+            if self.redis.locks.get(self.name) is self.token:
+                del self.redis.locks[self.name]
+
+
+def _id(entry_id):
+    return int(entry_id.split(b"-")[1]) if entry_id else -1
+
+
+class _FakeRedis:
+    """
+    The commands of a run session, XREAD blocks on a condition
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.values = {}
+        self.streams = {}
+        self.locks = {}
+        self.seq = 0
+
+    def lock(self, name, timeout=None, thread_local=True):
+        return _FakeLock(self, name)
+
+    def get(self, name):
+        with self.cond:
+            return self.values.get(name)
+
+    def set(self, name, value, px=None):
+        with self.cond:
+            self.values[name] = str(value).encode()
+
+    def delete(self, name):
+        with self.cond:
+            self.values.pop(name, None)
+
+    def expire(self, name, seconds):
+        return True
+
+    def pexpire(self, name, ms):
+        return True
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        with self.cond:
+            self.seq += 1
+            entry_id = f"0-{self.seq}".encode()
+            fields = {
+                k.encode(): v if isinstance(v, bytes) else str(v).encode()
+                for k, v in fields.items()
+            }
+            self.streams.setdefault(name, []).append((entry_id, fields))
+            self.cond.notify_all()
+            return entry_id
+
+    def xdel(self, name, entry_id):
+        with self.cond:
+            self.streams[name] = [
+                e for e in self.streams.get(name, []) if e[0] != entry_id
+            ]
+
+    def xlen(self, name):
+        with self.cond:
+            return len(self.streams.get(name, []))
+
+    def xrange(self, name, min="-", max="+", count=None):
+        with self.cond:
+            entries = [
+                e
+                for e in self.streams.get(name, [])
+                if (min == "-" or _id(e[0]) >= _id(min.encode()))
+                and (max == "+" or _id(e[0]) <= _id(max.encode()))
+            ]
+            return entries[:count] if count else entries
+
+    def xread(self, streams, count=None, block=None):
+        ((name, last_id),) = streams.items()
+        with self.cond:
+            if last_id == "$":
+                entries = self.streams.get(name, [])
+                last_id = entries[-1][0] if entries else None
+            last = _id(last_id.encode() if isinstance(last_id, str) else last_id)
+            deadline = time.monotonic() + (block or 0) / 1000
+
+            def _new():
+                return [e for e in self.streams.get(name, []) if _id(e[0]) > last]
+
+            while not _new() and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            entries = _new()[:count]
+            return [[name, entries]] if entries else []
+
+
+def _session(app, redis, user_bid="user_1"):
+    from flaskr.service.learn.run_session import RunSession
+
+    session = RunSession(app, user_bid, redis)
+    session.poll_interval = 0.05
+    return session
+
+
+def _data(frames):
+    return [f.split(b"\n", 1)[1] for f in frames if not f.startswith(b":")]
+
+
+def _ids(frames):
+    return [f.split(b"\n", 1)[0][len(b"id: ") :] for f in frames]
+
+
+def _gated_run(name, gate, count=3):
+    def run():
+        for i in range(count):
+            yield f"data: {name}{i}\n\n".encode()
+            if i == 0:
+                gate.wait(5)
+
+    return run
+
+
+def _consume(generator, into):
+    thread = threading.Thread(target=lambda: into.extend(generator), daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_for(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_identical_request_attaches_to_running_stream(app):
+    redis = _FakeRedis()
+    gate = threading.Event()
+    request = {"outline_bid": "outline", "input": "hi"}
+    first = []
+    thread = _consume(
+        _session(app, redis).stream(request, _gated_run("a", gate)), first
+    )
+    _wait_for(lambda: first)
+
+    second = _session(app, redis).stream(request, _gated_run("b", threading.Event()))
+    gate.set()
+    attached = list(second)
+    thread.join(5)
+    assert _data(first) == [b"data: a0\n\n", b"data: a1\n\n", b"data: a2\n\n"]
+    # the attached client gets the same frames with the same ids
+    assert attached == first
+
+
+def test_other_request_is_queued_until_the_running_one_ends(app):
+    redis = _FakeRedis()
+    gate = threading.Event()
+    first = []
+    thread = _consume(
+        _session(app, redis).stream({"input": "one"}, _gated_run("a", gate)), first
+    )
+    _wait_for(lambda: first)
+
+    second = []
+    queued = _consume(
+        _session(app, redis).stream({"input": "two"}, _gated_run("b", gate)),
+        second,
+    )
+    _wait_for(lambda: second)
+    # keepalives only while the first request runs
+    assert second[0] == b": queued\n\n" and not _data(second)
+    gate.set()
+    thread.join(5)
+    queued.join(5)
+    assert _data(second) == [b"data: b0\n\n", b"data: b1\n\n", b"data: b2\n\n"]
+    # nothing is left waiting
+    assert redis.xlen(_session(app, redis).inputs_key) == 0
+
+
+def test_reconnect_resumes_after_last_event_id(app):
+    redis = _FakeRedis()
+    gate = threading.Event()
+    gate.set()
+    frames = list(
+        _session(app, redis).stream({"input": "one"}, _gated_run("a", gate, count=4))
+    )
+    ids = _ids(frames)
+
+    resumed = list(
+        _session(app, redis).stream(
+            {"input": "one"}, _gated_run("b", gate), last_event_id=ids[1].decode()
+        )
+    )
+    assert resumed == frames[2:]
+
+
+def test_full_queue_is_rejected(app):
+    import json
+
+    redis = _FakeRedis()
+    session = _session(app, redis)
+    session.queue_size = 0
+    frames = list(session.stream({"outline_bid": "outline"}, _gated_run("a", None)))
+    payloads = [json.loads(f[len(b"data: ") :]) for f in frames]
+    assert [p["type"] for p in payloads] == ["content", "break"]
+    assert payloads[0]["outline_bid"] == "outline"
+
+
+def test_run_goes_on_after_disconnect_and_is_resumed(app):
+    redis = _FakeRedis()
+    gate = threading.Event()
+    session = _session(app, redis)
+    stream = session.stream({"input": "one"}, _gated_run("a", gate, count=4))
+    first = next(stream)
+    # the client goes away while the run waits on the LLM
+    stream.close()
+    gate.set()
+    _wait_for(lambda: not redis.locks)
+    assert redis.get(session.current_key) is None
+
+    resumed = list(
+        _session(app, redis).stream(
+            {"input": "one"},
+            _gated_run("b", gate),
+            last_event_id=_ids([first])[0].decode(),
+        )
+    )
+    assert _data(resumed) == [b"data: a1\n\n", b"data: a2\n\n", b"data: a3\n\n"]
+
+
+def test_detached_run_without_redis_completes(app):
+    from flaskr.i18n import get_current_language, set_language
+    from flaskr.service.learn.run_session import detach
+
+    done = threading.Event()
+    languages = []
+
+    def run():
+        languages.append(get_current_language())
+        yield b"data: a\n\n"
+        yield b"data: b\n\n"
+        done.set()
+
+    set_language("en-US")
+    stream = detach(app, run)
+    assert next(stream) == b"data: a\n\n"
+    stream.close()
+    assert done.wait(5)
+    # the run keeps the language of the request
+    assert languages == ["en-US"]
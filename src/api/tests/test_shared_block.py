@@ -0,0 +1,57 @@
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode("utf-8")
+
+
+MDFLOW = """Introduce the course in two sentences.
+---
+Greet {{nickname}} and ask about their job.
+---
+?[%{{job}}...your job]"""
+
+
+def test_only_variable_free_content_blocks_are_shared(app):
+    from flaskr.service.learn.shared_block import is_shared_block
+    from flaskr.service.shifu.shifu_mdflow_funcs import get_parsed_mdflow
+
+    blocks = get_parsed_mdflow("shared_outline", MDFLOW).blocks
+    assert [is_shared_block(b) for b in blocks] == [True, False, False]
+
+
+def test_shared_block_content_is_stored_per_published_version(app, monkeypatch):
+    from flaskr import dao
+    from flaskr.service.learn import shared_block
+    from flaskr.service.learn.llmsetting import LLMSettings
+    from flaskr.service.shifu.shifu_mdflow_funcs import get_parsed_mdflow
+
+    redis = _FakeRedis()
+    monkeypatch.setattr(dao, "redis_client", redis, raising=False)
+    settings = LLMSettings(model="gpt-test", temperature=0.3)
+    parsed = get_parsed_mdflow("shared_outline", MDFLOW)
+    key = shared_block.get_shared_block_key(parsed, 0, "system", settings)
+    assert shared_block.get_shared_block_content(app, key) is None
+
+    shared_block.set_shared_block_content(app, key, "Welcome!\nLet's start.")
+    assert shared_block.get_shared_block_content(app, key) == "Welcome!\nLet's start."
+    # another worker without the generation in memory reads it from Redis
+    shared_block._shared_block_cache.clear()
+    assert shared_block.get_shared_block_content(app, key) == "Welcome!\nLet's start."
+
+    republished = get_parsed_mdflow("shared_outline", MDFLOW + "\n---\nThe end.")
+    other_keys = [
+        shared_block.get_shared_block_key(republished, 0, "system", settings),
+        shared_block.get_shared_block_key(parsed, 0, "other system", settings),
+        shared_block.get_shared_block_key(
+            parsed, 0, "system", LLMSettings(model="gpt-test", temperature=1.0)
+        ),
+    ]
+    assert key not in other_keys
+    assert all(
+        shared_block.get_shared_block_content(app, k) is None for k in other_keys
+    )
@@ -0,0 +1,101 @@
+from decimal import Decimal
+
+
+def test_permission_map_is_cached_and_invalidated(app, monkeypatch):
+    from sqlalchemy import event
+
+    from flaskr.dao import db
+    from flaskr.service.shifu import funcs
+    from flaskr.service.shifu.models import AiCourseAuth, DraftShifu
+
+    monkeypatch.setattr(funcs, "ensure_invalidation_listener", lambda app: None)
+    user_id = "permission_user"
+    with app.app_context():
+        db.session.add(
+            DraftShifu(
+                shifu_bid="permission_own",
+                title="own",
+                price=Decimal(0),
+                created_user_bid=user_id,
+            )
+        )
+        db.session.add(
+            AiCourseAuth(
+                course_id="permission_shared",
+                user_id=user_id,
+                auth_type='["view", "edit"]',
+            )
+        )
+        db.session.commit()
+        engine = db.engine
+
+    statements = []
+
+    def _count(*_):
+        statements.append(1)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        checks = [
+            ("permission_own", "publish", True),
+            ("permission_shared", "view", True),
+            ("permission_shared", "edit", True),
+            ("permission_shared", "publish", False),
+            ("permission_other", "view", False),
+        ]
+        for shifu_bid, auth_type, expected in checks * 2:
+            assert (
+                funcs.shifu_permission_verification(app, user_id, shifu_bid, auth_type)
+                is expected
+            )
+        # one map per user, built with a query per table
+        assert len(statements) == 2
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    with app.app_context():
+        auth = AiCourseAuth.query.filter_by(course_id="permission_shared").first()
+        auth.auth_type = '["view", "edit", "publish"]'
+        db.session.add(
+            DraftShifu(
+                shifu_bid="permission_new",
+                title="new",
+                price=Decimal(0),
+                created_user_bid=user_id,
+            )
+        )
+        db.session.commit()
+    assert funcs.shifu_permission_verification(
+        app, user_id, "permission_shared", "publish"
+    )
+    assert funcs.shifu_permission_verification(app, user_id, "permission_new", "edit")
+
+    # unsharing drops the permissions at once
+    with app.app_context():
+        AiCourseAuth.query.filter_by(course_id="permission_shared").delete()
+        funcs.invalidate_shifu_permissions(app, user_id)
+        db.session.commit()
+    assert not funcs.shifu_permission_verification(
+        app, user_id, "permission_shared", "view"
+    )
+
+
+def test_map_loaded_before_an_invalidation_is_not_served(app, monkeypatch):
+    from flaskr.service.shifu import funcs
+
+    monkeypatch.setattr(funcs, "ensure_invalidation_listener", lambda app: None)
+    load = funcs._load_shifu_permissions
+
+    def load_then_unshare(user_id):
+        # the share is revoked while the old map is loaded
+        funcs._evict_shifu_permissions(user_id)
+        return {"permission_race": frozenset(["view"])}
+
+    monkeypatch.setattr(funcs, "_load_shifu_permissions", load_then_unshare)
+    assert funcs.shifu_permission_verification(
+        app, "race_user", "permission_race", "view"
+    )
+    monkeypatch.setattr(funcs, "_load_shifu_permissions", load)
+    assert not funcs.shifu_permission_verification(
+        app, "race_user", "permission_race", "view"
+    )
@@ -0,0 +1,181 @@
+from decimal import Decimal
+
+
+def _draft_shifu(shifu_bid: str):
+    from flaskr.dao import db
+    from flaskr.service.shifu.models import DraftBlock, DraftOutlineItem, DraftShifu
+
+    db.session.add(DraftShifu(shifu_bid=shifu_bid, title="shifu", price=Decimal(0)))
+    for bid, position, parent in [
+        ("c0", "01", ""),
+        ("c0s0", "0101", "c0"),
+        ("c0s1", "0102", "c0"),
+        ("c1", "02", ""),
+    ]:
+        db.session.add(
+            DraftOutlineItem(
+                outline_item_bid=f"{shifu_bid}_{bid}",
+                shifu_bid=shifu_bid,
+                title=bid,
+                position=position,
+                parent_bid=f"{shifu_bid}_{parent}" if parent else "",
+            )
+        )
+    for outline, block, position, content, deleted in [
+        ("c0s0", "b1", 2, "old", 0),
+        ("c0s0", "b0", 1, "first", 0),
+        ("c0s0", "b1", 2, "second", 0),
+        ("c0s0", "b2", 3, "removed", 1),
+        ("c0s1", "b3", 1, "third", 0),
+        ("c1", "b4", 1, "fourth", 0),
+    ]:
+        db.session.add(
+            DraftBlock(
+                block_bid=f"{shifu_bid}_{block}",
+                shifu_bid=shifu_bid,
+                outline_item_bid=f"{shifu_bid}_{outline}",
+                position=position,
+                content=content,
+                deleted=deleted,
+            )
+        )
+    db.session.commit()
+
+
+def test_publish_copies_drafts_in_bulk(app, monkeypatch):
+    from flaskr.service.shifu import shifu_publish_funcs
+    from flaskr.service.shifu.models import (
+        LogPublishedStruct,
+        PublishedBlock,
+        PublishedOutlineItem,
+    )
+    from flaskr.service.shifu.shifu_history_manager import HistoryItem
+
+    monkeypatch.setattr(shifu_publish_funcs, "enqueue_job", lambda *args, **kw: None)
+    shifu_bid = "publish_bulk_shifu"
+    with app.app_context():
+        _draft_shifu(shifu_bid)
+    for full in (False, True):
+        shifu_publish_funcs.publish_shifu_draft(app, "user", shifu_bid, full=full)
+
+    with app.app_context():
+        blocks = {
+            b.id: b
+            for b in PublishedBlock.query.filter_by(shifu_bid=shifu_bid, deleted=0)
+        }
+        outlines = {
+            o.id: o
+            for o in PublishedOutlineItem.query.filter_by(
+                shifu_bid=shifu_bid, deleted=0
+            )
+        }
+        struct = (
+            LogPublishedStruct.query.filter_by(shifu_bid=shifu_bid)
+            .order_by(LogPublishedStruct.id.desc())
+            .first()
+        )
+        history = HistoryItem.from_json(struct.struct)
+        # the full publish replaced the rows of the first one
+        assert len(outlines) == 4 and len(blocks) == 4
+        assert (
+            PublishedBlock.query.filter_by(shifu_bid=shifu_bid, deleted=1).count() == 4
+        )
+
+    def walk(item):
+        if item.type == "outline":
+            assert outlines[item.id].outline_item_bid == item.bid
+        if item.type == "block":
+            assert blocks[item.id].block_bid == item.bid
+            return [blocks[item.id].content]
+        return [c for child in item.children for c in walk(child)]
+
+    assert [c.bid for c in history.children] == [f"{shifu_bid}_c0", f"{shifu_bid}_c1"]
+    # the latest versions of the live blocks, in tree and position order
+    assert walk(history) == ["first", "second", "third", "fourth"]
+
+
+def test_delta_publish_only_writes_changed_rows(app, monkeypatch):
+    from flaskr.dao import db
+    from flaskr.service.shifu import shifu_publish_funcs
+    from flaskr.service.shifu.models import (
+        DraftBlock,
+        LogPublishedStruct,
+        PublishedBlock,
+        PublishedOutlineItem,
+    )
+    from flaskr.service.shifu.shifu_history_manager import HistoryItem
+
+    summaries = []
+    monkeypatch.setattr(
+        shifu_publish_funcs,
+        "enqueue_job",
+        lambda app, name, payload, **kw: summaries.append(payload),
+    )
+    shifu_bid = "publish_delta_shifu"
+    results = []
+
+    def publish():
+        results.append(shifu_publish_funcs.publish_shifu_draft(app, "user", shifu_bid))
+        with app.app_context():
+            structs = LogPublishedStruct.query.filter_by(shifu_bid=shifu_bid)
+            latest = structs.order_by(LogPublishedStruct.id.desc()).first()
+            return structs.count(), HistoryItem.from_json(latest.struct)
+
+    with app.app_context():
+        _draft_shifu(shifu_bid)
+    count, first = publish()
+    assert count == 1 and all(item.hash for item in first.get_outline_items())
+    # a new shifu row, all sections are summarized
+    assert summaries[0]["outline_bids"] is None
+    assert results[0].url.endswith(f"/c/{shifu_bid}")
+
+    # nothing changed, nothing is written
+    assert publish()[0] == 1 and len(summaries) == 1
+    assert not results[1].has_changes() and results[1].url == results[0].url
+
+    with app.app_context():
+        db.session.add(
+            DraftBlock(
+                block_bid=f"{shifu_bid}_b1",
+                shifu_bid=shifu_bid,
+                outline_item_bid=f"{shifu_bid}_c0s0",
+                position=2,
+                content="edited",
+            )
+        )
+        db.session.add(
+            DraftBlock(
+                block_bid=f"{shifu_bid}_b4",
+                shifu_bid=shifu_bid,
+                outline_item_bid=f"{shifu_bid}_c1",
+                position=1,
+                content="fourth",
+                deleted=1,
+            )
+        )
+        db.session.commit()
+    count, second = publish()
+    assert count == 2 and len(summaries) == 2
+    assert results[2].blocks == [f"{shifu_bid}_b1"]
+    assert results[2].removed_blocks == [f"{shifu_bid}_b4"]
+    # only the sections of the edited and the removed block are summarized again
+    assert summaries[1]["outline_bids"] == [f"{shifu_bid}_c0s0", f"{shifu_bid}_c1"]
+
+    def ids(struct):
+        return {
+            item.bid: item.id
+            for item in struct.get_index().by_bid.values()
+            if item.type != "shifu"
+        }
+
+    before, after = ids(first), ids(second)
+    changed = {bid for bid in after if after[bid] != before[bid]}
+    # only the edited block got a new row, the others kept their ids
+    assert changed == {f"{shifu_bid}_b1"}
+    assert set(before) - set(after) == {f"{shifu_bid}_b4"}
+    assert second.id == first.id
+    with app.app_context():
+        live = PublishedBlock.query.filter_by(shifu_bid=shifu_bid, deleted=0)
+        assert sorted(b.content for b in live) == ["edited", "first", "third"]
+        assert PublishedBlock.query.filter_by(shifu_bid=shifu_bid).count() == 5
+        assert PublishedOutlineItem.query.filter_by(shifu_bid=shifu_bid).count() == 4
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+
+def _section(bid):
+    return SimpleNamespace(bid=bid, title=bid, children=[])
+
+
+def _make_shifu_data(app, shifu_bid, section_bids):
+    from flaskr.dao import db
+    from flaskr.service.shifu.consts import BLOCK_TYPE_CONTENT_VALUE
+    from flaskr.service.shifu.models import PublishedOutlineItem
+
+    outline_tree = SimpleNamespace(
+        outline_items=[
+            SimpleNamespace(
+                bid="chapter",
+                title="chapter",
+                children=[_section(bid) for bid in section_bids],
+            )
+        ]
+    )
+    all_blocks = {
+        bid: [
+            SimpleNamespace(
+                type=BLOCK_TYPE_CONTENT_VALUE,
+                content=json.dumps({"content": f"content of {bid}"}),
+            )
+        ]
+        for bid in section_bids
+    }
+    outline_item_map = {}
+    for bid in section_bids:
+        outline_item = PublishedOutlineItem(
+            outline_item_bid=bid, shifu_bid=shifu_bid, title=bid
+        )
+        db.session.add(outline_item)
+        outline_item_map[bid] = outline_item
+    db.session.commit()
+    shifu = SimpleNamespace(
+        shifu_bid=shifu_bid,
+        ask_llm="gpt-test",
+        llm="",
+        ask_llm_temperature=0.3,
+        llm_temperature=0.3,
+    )
+    return outline_tree, all_blocks, outline_item_map, shifu
+
+
+def test_summaries_run_concurrently_and_are_reused(app, monkeypatch):
+    import flaskr.service.shifu.shifu_publish_funcs as publish_funcs
+
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+    calls = []
+
+    def fake_summary(app, prompt, model_name, user_id=None, temperature=0.8):
+        with lock:
+            running.append(prompt)
+            peak[0] = max(peak[0], len(running))
+            calls.append(prompt)
+        time.sleep(0.05)
+        with lock:
+            running.remove(prompt)
+        return "summary:" + prompt.split("content of ")[-1]
+
+    monkeypatch.setattr(publish_funcs, "_get_summary", fake_summary)
+    app.config["SHIFU_SUMMARY_CONCURRENCY"] = 4
+    with app.app_context():
+        sections = [f"summary_s{i}" for i in range(8)]
+        data = _make_shifu_data(app, "summary_shifu", sections)
+        summary_map = publish_funcs._generate_summaries(
+            app, data[0], data[1], data[2], "{all_script_content}", data[3]
+        )
+        assert len(calls) == 8
+        assert 1 < peak[0] <= 4
+        assert summary_map["summary_s3"]["content"].endswith("summary_s3")
+        assert data[2]["summary_s3"].summary_hash
+
+        # a new publish with unchanged content reuses every summary
+        calls.clear()
+        data = _make_shifu_data(app, "summary_shifu", sections)
+        summary_map = publish_funcs._generate_summaries(
+            app, data[0], data[1], data[2], "{all_script_content}", data[3]
+        )
+        assert calls == []
+        assert summary_map["summary_s5"]["content"].endswith("summary_s5")
+
+
+def test_only_changed_sections_are_summarized(app, monkeypatch):
+    import flaskr.service.shifu.shifu_publish_funcs as publish_funcs
+
+    calls = []
+
+    def fake_summary(app, prompt, model_name, user_id=None, temperature=0.8):
+        calls.append(prompt)
+        return "new"
+
+    monkeypatch.setattr(publish_funcs, "_get_summary", fake_summary)
+    with app.app_context():
+        sections = ["changed_s0", "changed_s1", "changed_s2"]
+        data = _make_shifu_data(app, "changed_shifu", sections)
+        data[2]["changed_s0"].summary = "kept"
+        data[2]["changed_s1"].summary = "stale"
+        summary_map = publish_funcs._generate_summaries(
+            app,
+            data[0],
+            data[1],
+            data[2],
+            "{all_script_content}",
+            data[3],
+            ["changed_s1"],
+        )
+        # s0 is unchanged, s2 has no summary yet
+        assert len(calls) == 2
+        assert summary_map["changed_s0"]["content"] == "kept"
+        assert summary_map["changed_s1"]["content"] == "new"
+        assert summary_map["changed_s2"]["content"] == "new"
+
+
+def test_failed_summaries_resume(app, monkeypatch):
+    import flaskr.service.shifu.shifu_publish_funcs as publish_funcs
+
+    calls = []
+
+    def flaky_summary(app, prompt, model_name, user_id=None, temperature=0.8):
+        calls.append(prompt)
+        if prompt.endswith("resume_s1"):
+            raise RuntimeError("llm down")
+        return "ok"
+
+    monkeypatch.setattr(publish_funcs, "_get_summary", flaky_summary)
+    with app.app_context():
+        data = _make_shifu_data(app, "resume_shifu", ["resume_s0", "resume_s1"])
+        with pytest.raises(RuntimeError):
+            publish_funcs._generate_summaries(
+                app, data[0], data[1], data[2], "{all_script_content}", data[3]
+            )
+        assert data[2]["resume_s0"].summary == "ok"
+
+        calls.clear()
+        monkeypatch.setattr(
+            publish_funcs, "_get_summary", lambda *args, **kwargs: "retried"
+        )
+        summary_map = publish_funcs._generate_summaries(
+            app, data[0], data[1], data[2], "{all_script_content}", data[3]
+        )
+        assert summary_map["resume_s0"]["content"] == "ok"
+        assert summary_map["resume_s1"]["content"] == "retried"
+
+
+def test_rate_limiter(monkeypatch):
+    from flaskr.api.llm import rate_limit
+
+    now = [0.0]
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(rate_limit.time, "sleep", sleep)
+    limiter = rate_limit.RateLimiter(rpm=60, burst=2)
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == pytest.approx(1.0)
+    assert rate_limit.RateLimiter(rpm=0).acquire() == 0
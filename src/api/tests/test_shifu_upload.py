@@ -0,0 +1,146 @@
+import hashlib
+import io
+import uuid
+
+import pytest
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 56
+
+
+def _png(size=0):
+    # unique content, resources of earlier tests are not matched
+    return PNG + uuid.uuid4().bytes + bytes(range(256)) * (size // 256)
+
+
+class _Result:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+
+    def put_object(self, key, data, headers=None):
+        self.objects[key] = bytes(data)
+
+    def init_multipart_upload(self, key, headers=None):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return _Result(upload_id=upload_id)
+
+    def upload_part(self, key, upload_id, part_number, data):
+        self.uploads[upload_id][part_number] = bytes(data)
+        return _Result(etag=f"etag-{part_number}")
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        uploaded = self.uploads.pop(upload_id)
+        self.objects[key] = b"".join(uploaded[p.part_number] for p in parts)
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.uploads.pop(upload_id)
+        self.aborted.append(key)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    from flaskr.service.shifu import funcs
+
+    fake = FakeBucket()
+    config = {"UPLOAD_MAX_SIZE_MB": "1", "UPLOAD_PART_SIZE_KB": "100"}
+    get_config = funcs.get_config
+    monkeypatch.setattr(
+        funcs, "get_config", lambda key: config.get(key) or get_config(key)
+    )
+    monkeypatch.setattr(
+        funcs, "_get_courses_bucket", lambda app: (fake, "https://cdn", "courses")
+    )
+    monkeypatch.setattr(funcs, "enqueue_job", lambda *args, **kwargs: None)
+    return fake
+
+
+def _upload(app, content: bytes, filename="image.png", resource_id="", **kwargs):
+    from werkzeug.datastructures import FileStorage
+
+    from flaskr.service.shifu.funcs import upload_file
+
+    file = FileStorage(stream=io.BytesIO(content), filename=filename)
+    return upload_file(app, "user", resource_id, file, **kwargs)
+
+
+def test_identical_content_is_stored_once(app, bucket):
+    from flaskr.service.resource.models import Resource
+
+    content = _png()
+    first = _upload(app, content)
+    second = _upload(app, content, filename="copy.png")
+    assert first == second and len(bucket.objects) == 1
+    with app.app_context():
+        # every upload has its own resource, sharing the object
+        resources = Resource.query.filter_by(url=first).all()
+        assert sorted(r.name for r in resources) == ["copy.png", "image.png"]
+        assert len({r.resource_id for r in resources}) == 2
+        assert all(len(r.content_hash) == 64 for r in resources)
+
+
+def test_update_never_overwrites_a_shared_object(app, bucket):
+    from flaskr.service.resource.models import Resource
+
+    content, changed = _png(), _png()
+    shared = _upload(app, content, filename="shared.png")
+    copy = _upload(app, content, filename="shared_copy.png")
+    with app.app_context():
+        resource_id = Resource.query.filter_by(name="shared_copy.png").one().resource_id
+    updated = _upload(app, changed, resource_id=resource_id)
+    assert copy == shared and updated != shared
+    assert bucket.objects[shared.rsplit("/", 1)[1]] == content
+    assert bucket.objects[updated.rsplit("/", 1)[1]] == changed
+    with app.app_context():
+        resource = Resource.query.filter_by(resource_id=resource_id).one()
+        assert resource.url == updated
+        assert Resource.query.filter_by(name="shared.png").one().url == shared
+
+
+def test_claimed_hash_skips_the_upload_of_a_known_file(app, bucket):
+    content = _png(256000)
+    first = _upload(app, content)
+    objects = dict(bucket.objects)
+    bucket.init_multipart_upload = None  # a duplicate must not start one
+    second = _upload(
+        app, content, content_hash=hashlib.sha256(content).hexdigest().upper()
+    )
+    assert second == first and bucket.objects == objects and not bucket.aborted
+
+
+def test_wrong_claimed_hash_is_not_trusted(app, bucket):
+    known = _png()
+    _upload(app, known)
+    other = _png(256000)
+    url = _upload(app, other, content_hash=hashlib.sha256(known).hexdigest())
+    assert bucket.objects[url.rsplit("/", 1)[1]] == other
+
+
+def test_large_file_is_uploaded_in_parts(app, bucket):
+    content = _png(256000)
+    url = _upload(app, content)
+    key = url.rsplit("/", 1)[1]
+    # 100KB parts, the rest in a third one
+    assert bucket.objects[key] == content and not bucket.uploads
+
+
+def test_oversized_upload_is_aborted(app, bucket):
+    from flaskr.service.common.models import AppException
+
+    with pytest.raises(AppException):
+        _upload(app, PNG + b"\x00" * (1024 * 1024))
+    assert not bucket.objects and not bucket.uploads and len(bucket.aborted) == 1
+
+
+def test_content_type_is_sniffed_not_taken_from_the_name(app, bucket):
+    from flaskr.service.common.models import AppException
+
+    with pytest.raises(AppException):
+        _upload(app, b"<html>not an image</html>", filename="image.png")
+    assert not bucket.objects
@@ -0,0 +1,149 @@
+import json
+import zlib
+
+
+def _content(text, block="block_1"):
+    from flaskr.service.learn.learn_dtos import GeneratedType, RunMarkdownFlowDTO
+
+    return RunMarkdownFlowDTO(
+        outline_bid="outline",
+        generated_block_bid=block,
+        type=GeneratedType.CONTENT,
+        content=text,
+    )
+
+
+def _timed(items):
+    """
+    Items paired with their arrival time in ms, fed through a fake clock
+    """
+    now = [0.0]
+
+    def clock():
+        return now[0]
+
+    def stream():
+        for at, item in items:
+            now[0] = at / 1000
+            yield item
+
+    return clock, stream()
+
+
+def _parse(frames):
+    return [json.loads(f[len(b"data: ") :]) for f in frames]
+
+
+def test_content_deltas_are_coalesced(app):
+    from flaskr.service.learn.learn_dtos import GeneratedType, RunMarkdownFlowDTO
+    from flaskr.service.learn.sse import SSEWriter
+
+    clock, items = _timed(
+        [
+            (0, _content("A")),
+            (5, _content("b")),
+            (10, _content("c")),
+            (40, _content("d")),
+            (45, _content("x" * 300)),
+            (50, _content("e", block="block_2")),
+            (
+                55,
+                RunMarkdownFlowDTO(
+                    outline_bid="outline",
+                    generated_block_bid="block_2",
+                    type=GeneratedType.BREAK,
+                    content="",
+                ),
+            ),
+            (500, _content("late", block="block_3")),
+            (501, _content("!", block="block_3")),
+        ]
+    )
+    # the fake clock drives the timing, held content waits for the next item
+    writer = SSEWriter(
+        coalesce_interval=0.03, coalesce_bytes=256, clock=clock, flush_timer=False
+    )
+    frames = _parse(writer.stream(items))
+    assert [(f["type"], f["generated_block_bid"], f["content"]) for f in frames] == [
+        # the first delta is sent at once
+        ("content", "block_1", "A"),
+        # held for 30ms
+        ("content", "block_1", "bcd"),
+        # size limit
+        ("content", "block_1", "x" * 300),
+        # another block and other frames flush the held content
+        ("content", "block_2", "e"),
+        ("break", "block_2", ""),
+        ("content", "block_3", "late"),
+        # the end of the stream flushes the held content
+        ("content", "block_3", "!"),
+    ]
+    assert writer.frame_count == 7
+
+
+def test_held_content_is_sent_when_the_interval_runs_out(app):
+    import time
+
+    from flaskr.service.learn.sse import SSEWriter
+
+    def stalling_provider():
+        yield _content("A")
+        time.sleep(0.005)
+        yield _content("b")
+        # the provider stalls, the held delta must not wait for the next one
+        time.sleep(0.5)
+        yield _content("c")
+
+    writer = SSEWriter(coalesce_interval=0.03, coalesce_bytes=256)
+    start = time.monotonic()
+    sent = [
+        (_parse([frame])[0]["content"], time.monotonic() - start)
+        for frame in writer.stream(stalling_provider())
+    ]
+    assert [content for content, _ in sent] == ["A", "b", "c"]
+    assert sent[1][1] < 0.25 <= sent[2][1]
+
+
+def test_source_errors_are_raised_to_the_reader(app):
+    import pytest
+
+    from flaskr.service.learn.sse import SSEWriter
+
+    def failing():
+        yield _content("A")
+        raise RuntimeError("run failed")
+
+    frames = SSEWriter(coalesce_interval=0.03).stream(failing())
+    assert _parse([next(frames)])[0]["content"] == "A"
+    with pytest.raises(RuntimeError):
+        next(frames)
+
+
+def test_disabled_coalescing_and_passthrough(app):
+    from flaskr.service.learn.sse import SSEWriter
+
+    items = [_content("a"), _content("b"), "data: raw\n\n"]
+    frames = list(SSEWriter(coalesce_interval=0).stream(items))
+    assert frames[2] == b"data: raw\n\n"
+    assert [f["content"] for f in _parse(frames[:2])] == ["a", "b"]
+    # the same json the previous json.dumps framing produced
+    assert _parse(frames[:1])[0] == {
+        "outline_bid": "outline",
+        "generated_block_bid": "block_1",
+        "type": "content",
+        "content": "a",
+    }
+
+
+def test_compressed_stream_is_decodable_frame_by_frame(app):
+    from flaskr.service.learn.sse import SSEWriter
+
+    writer = SSEWriter(coalesce_interval=0, compress=True)
+    decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+    chunks = list(writer.stream([_content("你好"), _content("world")]))
+    # every frame can be decoded as soon as it arrives
+    first = decompressor.decompress(chunks[0])
+    assert _parse([first])[0]["content"] == "你好"
+    rest = b"".join(decompressor.decompress(c) for c in chunks[1:])
+    assert _parse([rest])[0]["content"] == "world"
+    assert decompressor.eof
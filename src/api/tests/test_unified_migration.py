@@ -0,0 +1,161 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+SOURCE = "ai_course_lesson_attendscript"
+TARGET = "learn_generated_blocks"
+
+
+def _task(tmp_path, batch_size=3):
+    from flaskr.command.unified_migration_task import (
+        MigrationConfig,
+        UnifiedMigrationTask,
+    )
+
+    task = UnifiedMigrationTask(
+        f"sqlite:///{tmp_path / 'migration.db'}",
+        MigrationConfig(batch_size=batch_size, max_workers=2),
+    )
+    with task.engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {SOURCE} (
+                    id INTEGER PRIMARY KEY, log_id VARCHAR(36), attend_id VARCHAR(36),
+                    user_id VARCHAR(36), script_id VARCHAR(36), lesson_id VARCHAR(36),
+                    course_id VARCHAR(36), script_ui_type INT, script_role INT,
+                    script_content TEXT, script_index INT, script_ui_conf TEXT,
+                    interaction_type INT, status INT, created DATETIME, updated DATETIME
+                )
+            """
+            )
+        )
+        conn.execute(
+            text(
+                f"""
+                CREATE TABLE IF NOT EXISTS {TARGET} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    generated_block_bid VARCHAR(36), progress_record_bid VARCHAR(36),
+                    user_bid VARCHAR(36), block_bid VARCHAR(36),
+                    outline_item_bid VARCHAR(36), shifu_bid VARCHAR(36), type INT,
+                    role INT, generated_content TEXT, position INT,
+                    block_content_conf TEXT, liked INT, deleted INT, status INT,
+                    created_at DATETIME, updated_at DATETIME
+                )
+            """
+            )
+        )
+    return task
+
+
+def _add_source(task, ids, content="hello"):
+    with task.engine.begin() as conn:
+        conn.execute(
+            text(
+                f"""
+                INSERT INTO {SOURCE} (id, log_id, attend_id, user_id, script_id,
+                    lesson_id, course_id, script_ui_type, script_role, script_content,
+                    script_index, script_ui_conf, interaction_type, status, created,
+                    updated)
+                VALUES (:id, :log_id, 'attend', 'user', 'script', 'lesson', 'course',
+                    0, 0, :content, 0, '', 0, 1, :now, :now)
+            """
+            ),
+            [
+                {
+                    "id": i,
+                    "log_id": f"log-{i}",
+                    "content": content,
+                    "now": datetime.now(),
+                }
+                for i in ids
+            ],
+        )
+
+
+def _target(task):
+    with task.engine.connect() as conn:
+        return conn.execute(
+            text(
+                f"SELECT generated_block_bid, generated_content FROM {TARGET} ORDER BY id"
+            )
+        ).fetchall()
+
+
+def _migrate(task):
+    return task._migrate_table(SOURCE, task.table_mappings[SOURCE])
+
+
+def test_batches_insert_and_upsert_without_duplicates(tmp_path):
+    task = _task(tmp_path)
+    _add_source(task, range(1, 8))
+    result = _migrate(task)
+    assert (result.total_records, result.synced_records) == (7, 7)
+    assert _target(task) == [(f"log-{i}", "hello") for i in range(1, 8)]
+
+    # a rerun updates the existing records in place
+    with task.engine.begin() as conn:
+        conn.execute(text(f"UPDATE {SOURCE} SET script_content = 'changed'"))
+    task.force_full_migration = True
+    result = _migrate(task)
+    assert result.synced_records == 7 and result.error_records == 0
+    assert _target(task) == [(f"log-{i}", "changed") for i in range(1, 8)]
+    task.close()
+
+
+def test_incremental_run_resumes_after_checkpoint(tmp_path):
+    task = _task(tmp_path, batch_size=50)
+    _add_source(task, range(1, 121))
+    _migrate(task)
+    assert len(_target(task)) == 120
+
+    # only the records after the checkpoint are read again
+    _add_source(task, range(121, 131))
+    with task.engine.begin() as conn:
+        conn.execute(text(f"UPDATE {SOURCE} SET script_content = 'old' WHERE id < 121"))
+    result = _migrate(task)
+    assert result.synced_records == 10
+    rows = dict(_target(task))
+    assert len(rows) == 130
+    assert rows["log-1"] == "hello" and rows["log-130"] == "hello"
+    task.close()
+
+
+def test_checksum_verifier_pinpoints_divergent_records(tmp_path):
+    import asyncio
+
+    from flaskr.command.unified_migration_task import MigrationConfig
+
+    task = _task(tmp_path)
+    task.config = MigrationConfig(
+        batch_size=100, max_workers=2, checksum_chunk_size=50, checksum_leaf_size=4
+    )
+    task.table_mappings = {SOURCE: task.table_mappings[SOURCE]}
+    _add_source(task, range(1, 201))
+    _migrate(task)
+
+    result = asyncio.run(task.verify_data_consistency())[SOURCE]
+    assert result.is_consistent and result.old_count == result.new_count == 200
+
+    with task.engine.begin() as conn:
+        conn.execute(
+            text(
+                f"UPDATE {TARGET} SET generated_content = 'x' "
+                "WHERE generated_block_bid = 'log-17'"
+            )
+        )
+        conn.execute(text(f"DELETE FROM {TARGET} WHERE generated_block_bid = 'log-90'"))
+        conn.execute(
+            text(
+                f"INSERT INTO {TARGET} (generated_block_bid, deleted) "
+                "VALUES ('log-151', 0)"
+            )
+        )
+    result = asyncio.run(task.verify_data_consistency())[SOURCE]
+    assert not result.is_consistent
+    assert sorted(result.data_mismatches) == [
+        "Data mismatch for record: log-17",
+        "Duplicate records in target: log-151",
+        "Missing record in target: log-90",
+    ]
+    task.close()
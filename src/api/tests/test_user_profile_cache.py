@@ -0,0 +1,164 @@
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def expire(self, key, seconds):
+        return key in self.data
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def _add_profile_item(course_id, profile_id, profile_key):
+    from flaskr.dao import db
+    from flaskr.service.profile.models import ProfileItem
+
+    db.session.add(
+        ProfileItem(
+            profile_id=profile_id,
+            parent_id=course_id,
+            profile_key=profile_key,
+            profile_type=0,
+            profile_remark="",
+            profile_raw_prompt="",
+            profile_prompt="",
+            profile_prompt_model="",
+            profile_prompt_model_args="",
+            profile_color_setting="",
+            profile_script_id="",
+            status=1,
+        )
+    )
+
+
+def test_user_profiles_are_cached_and_invalidated_on_save(app, monkeypatch):
+    from flaskr import dao
+    from flaskr.dao import db
+    from flaskr.service.profile.dtos import ProfileToSave
+    from flaskr.service.profile.funcs import (
+        _get_user_profile_snapshot_key,
+        _get_user_profile_version_key,
+        get_user_profiles,
+        save_user_profiles,
+    )
+    from flaskr.service.profile.models import UserProfile
+
+    redis = _FakeRedis()
+    monkeypatch.setattr(dao, "redis_client", redis, raising=False)
+    with app.app_context():
+        _add_profile_item("profile_course", "profile_def_a", "var_a")
+        _add_profile_item("profile_course", "profile_def_b", "var_b")
+        db.session.add_all(
+            [
+                # matched by profile id even though the key was renamed
+                UserProfile(
+                    user_id="profile_user",
+                    profile_id="profile_def_a",
+                    profile_key="old_a",
+                    profile_value="a1",
+                ),
+                # matched by key when no row has the profile id
+                UserProfile(
+                    user_id="profile_user",
+                    profile_id="",
+                    profile_key="var_b",
+                    profile_value="b1",
+                ),
+            ]
+        )
+        db.session.commit()
+
+    with app.app_context():
+        profiles = get_user_profiles(app, "profile_user", "profile_course")
+        assert profiles["var_a"] == "a1"
+        assert profiles["var_b"] == "b1"
+        assert profiles["sys_user_language"] == "English"
+        profiles["sys_user_input"] = "changed by the caller"
+        assert "sys_user_input" not in get_user_profiles(
+            app, "profile_user", "profile_course"
+        )
+    version_key = _get_user_profile_version_key(app, "profile_user")
+    version = redis.data[version_key]
+    assert len(redis.data) == 2
+
+    with app.app_context():
+        save_user_profiles(
+            app,
+            "profile_user",
+            "profile_course",
+            [ProfileToSave(key="var_b", value="b2", bid="")],
+        )
+        # uncommitted values are visible to this request only
+        assert get_user_profiles(app, "profile_user", "profile_course")["var_b"] == (
+            "b2"
+        )
+        assert len(redis.data) == 2
+        db.session.commit()
+    # the snapshot of the old version is not read anymore
+    assert redis.data[version_key] == version + 1
+    assert (
+        _get_user_profile_snapshot_key(app, "profile_user", version + 1)
+        not in redis.data
+    )
+
+    with app.app_context():
+        assert get_user_profiles(app, "profile_user", "profile_course")["var_b"] == (
+            "b2"
+        )
+    assert len(redis.data) == 3
+
+
+def test_slow_reader_does_not_cache_a_stale_snapshot(app, monkeypatch):
+    from flaskr import dao
+    from flaskr.dao import db
+    from flaskr.service.profile import funcs
+    from flaskr.service.profile.models import UserProfile
+
+    redis = _FakeRedis()
+    monkeypatch.setattr(dao, "redis_client", redis, raising=False)
+    with app.app_context():
+        db.session.add(
+            UserProfile(
+                user_id="slow_user",
+                profile_id="",
+                profile_key="var_a",
+                profile_value="old",
+            )
+        )
+        db.session.commit()
+
+    build = funcs._build_user_profile_snapshot
+
+    def build_then_commit_a_write(user_id, session=None):
+        # the reader loaded the old rows, then a writer commits
+        snapshot = build(user_id, session)
+        with app.app_context():
+            UserProfile.query.filter_by(
+                user_id="slow_user"
+            ).first().profile_value = "new"
+            db.session.commit()
+        return snapshot
+
+    monkeypatch.setattr(
+        funcs, "_build_user_profile_snapshot", build_then_commit_a_write
+    )
+    with app.app_context():
+        assert funcs._get_user_profile_snapshot(app, "slow_user")["by_key"] == {
+            "var_a": "old"
+        }
+    monkeypatch.setattr(funcs, "_build_user_profile_snapshot", build)
+    with app.app_context():
+        assert funcs._get_user_profile_snapshot(app, "slow_user")["by_key"] == {
+            "var_a": "new"
+        }
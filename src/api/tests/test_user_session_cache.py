@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+
+class _CountingRedis:
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+def test_validated_sessions_are_cached_and_revoked(app, monkeypatch):
+    from flaskr.dao import db
+    from flaskr.service.common.models import AppException
+    from flaskr.service.user import common, utils
+    from flaskr.service.user.models import User
+
+    redis = _CountingRedis()
+    monkeypatch.setattr(common, "redis", redis)
+    monkeypatch.setattr(utils, "redis", redis)
+    with app.app_context():
+        user = User(user_id="session_user", name="before")
+        user.user_birth = datetime.date(2003, 1, 1)
+        db.session.add(user)
+        db.session.commit()
+        token = utils.generate_token(app, "session_user")
+        other_token = utils.generate_token(app, "session_user")
+
+    assert common.validate_user(app, token).name == "before"
+    user = common.validate_user(app, token)
+    assert redis.gets == 1
+    # every caller gets its own dto
+    user.name = "changed by a request"
+    assert common.validate_user(app, token).name == "before"
+
+    with app.app_context():
+        User.query.filter_by(user_id="session_user").first().name = "after"
+        db.session.commit()
+    assert common.validate_user(app, token).name == "after"
+    assert redis.gets == 2
+
+    common.validate_user(app, other_token)
+    common.revoke_token(app, token)
+    with pytest.raises(AppException):
+        common.validate_user(app, token)
+    gets = redis.gets
+    assert common.validate_user(app, other_token).name == "after"
+    assert redis.gets == gets
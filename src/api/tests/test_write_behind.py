@@ -0,0 +1,63 @@
+import time
+
+
+def _row(chat_id):
+    return {
+        "chat_id": chat_id,
+        "user_id": "write_behind_user",
+        "text": "hello",
+        "check_vendor": "test",
+        "check_result": 1,
+        "check_resp": "{}",
+        "is_pass": 1,
+        "check_strategy": "check_text",
+    }
+
+
+def _count(app, prefix):
+    from flaskr.service.check_risk.models import RiskControlResult
+
+    with app.app_context():
+        return RiskControlResult.query.filter(
+            RiskControlResult.chat_id.like(prefix + "%")
+        ).count()
+
+
+def test_rows_are_written_in_batches(app):
+    from flaskr.dao.write_behind import WriteBehindQueue
+    from flaskr.service.check_risk.models import RiskControlResult
+
+    write_queue = WriteBehindQueue(
+        "test_batches", RiskControlResult, batch_size=5, flush_interval=0.05
+    )
+    for i in range(12):
+        assert write_queue.put(app, _row(f"batch_{i}"))
+    deadline = time.monotonic() + 5
+    while write_queue.written < 12 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _count(app, "batch_") == 12
+    stats = write_queue.stats()
+    assert stats["depth"] == 0
+    assert stats["enqueued"] == 12
+    assert 3 <= stats["batches"] < 12
+
+
+def test_full_queue_drops_and_flush_writes_pending_rows(app, monkeypatch):
+    from flaskr.dao.write_behind import WriteBehindQueue
+    from flaskr.service.check_risk.models import RiskControlResult
+
+    write_queue = WriteBehindQueue(
+        "test_flush", RiskControlResult, batch_size=2, flush_interval=60, maxsize=3
+    )
+    # no writer thread, rows stay queued until the flush
+    monkeypatch.setattr(write_queue, "_ensure_writer", lambda: None)
+    results = [write_queue.put(app, _row(f"flush_{i}")) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert write_queue.stats()["depth"] == 3
+    write_queue.flush()
+    stats = write_queue.stats()
+    assert stats["depth"] == 0
+    assert stats["dropped"] == 2
+    assert stats["written"] == 3
+    assert stats["batches"] == 2
+    assert _count(app, "flush_") == 3